@@ -0,0 +1,233 @@
+"""Columnar transform of voucher lines, a batch of vouchers at a time.
+
+The voucher modules extract each voucher's raw fields while it streams
+past (extract_fields) and hand them here in batches of BATCH_SIZE. The
+fields of every line in a batch are gathered into columns and cleaned and
+converted column by column: each distinct text is stripped, unsigned and
+parsed to Decimal once and every other row reuses the result. With numpy
+installed the numbers also go into float64 arrays, and the per-voucher
+sums and total checks are array operations.
+
+Each voucher's line amounts are checked against the voucher's amount: the
+sum of its ledger entries (party, taxes and the like) for invoices and
+orders, the bank amount for payments. Signs are ignored, since Tally signs
+debits and credits. A voucher that does not add up is logged and counted
+as `unbalanced`, and still synced.
+"""
+import logging
+from decimal import Decimal
+from operator import itemgetter
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import metrics
+from records import to_decimal
+
+logger = logging.getLogger(__name__)
+
+# "auto" uses numpy when it is installed, "numpy" requires it, "python"
+# never uses it.
+BACKEND = "auto"
+# Vouchers transformed together.
+BATCH_SIZE = 500
+VALIDATE_TOTALS = True
+# Largest difference between line amounts and voucher amount still counted as balanced.
+TOLERANCE = Decimal("0.01")
+
+inventory_entries = itemgetter("inventory_entries")
+ledger_entries = itemgetter("ledger_entries")
+
+
+def configure(backend=None, batch_size=None):
+    global BACKEND, BATCH_SIZE
+    if backend is not None:
+        if backend not in ("auto", "numpy", "python"):
+            raise ValueError(f"Unknown batch transform backend: {backend}")
+        if backend == "numpy" and numpy is None:
+            raise ValueError("The numpy batch transform backend was requested but numpy is not installed")
+        BACKEND = backend
+    if batch_size is not None:
+        BATCH_SIZE = batch_size
+
+
+def using_numpy():
+    return numpy is not None and BACKEND in ("auto", "numpy")
+
+
+def extract_fields(vouchers, plan, doctype, watermark=None):
+    """Extract each streamed voucher with `plan` while its element is still alive.
+
+    Vouchers the watermark has already seen are skipped.
+    """
+    for voucher in vouchers:
+        if watermark and not watermark.observe(voucher):
+            continue
+        with metrics.timed("transform", doctype):
+            fields = plan.extract(voucher)
+        yield fields
+
+
+def iter_batches(items, size=None):
+    size = size or BATCH_SIZE
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def clean_number(text, unsigned=False):
+    """Strip a numeric text (and its minus signs with unsigned=True) and parse it to Decimal."""
+    if text is None:
+        return None
+    text = text.strip()
+    if unsigned:
+        text = text.replace("-", "")
+    return to_decimal(text)
+
+
+def is_number(value):
+    return isinstance(value, Decimal) and value.is_finite()
+
+
+def text_column(texts):
+    """Strip every text in a column, each distinct text once."""
+    distinct = {text: text if text is None else text.strip() for text in set(texts)}
+    return list(map(distinct.__getitem__, texts))
+
+
+class LineColumns:
+    """The lines of a batch of vouchers as columns, one list per key.
+
+    lines_of(fields) gives a voucher's lines (dicts from its FieldPlan). The
+    lines of the voucher at batch position i are rows starts[i] up to
+    starts[i + 1]. With carry=True a key missing from a line carries over
+    from the line before it in the same voucher, as the per-line parsing
+    loops did; otherwise it is None.
+    """
+
+    def __init__(self, batch, lines_of, keys, carry=True):
+        self.columns = {key: [] for key in keys}
+        self.starts = [0]
+        rows = 0
+        for fields in batch:
+            carried = dict.fromkeys(keys)
+            for line in lines_of(fields):
+                for key in keys:
+                    value = line.get(key)
+                    if value or not carry:
+                        carried[key] = value
+                    self.columns[key].append(carried[key])
+                rows += 1
+            self.starts.append(rows)
+
+    def __getitem__(self, key):
+        return self.columns[key]
+
+    def spans(self):
+        return zip(self.starts, self.starts[1:])
+
+
+class NumericColumn:
+    """A column of numeric texts, converted once per distinct text.
+
+    values holds clean_number(text) for every row. With numpy, floats holds
+    the same numbers as a float64 array, NaN where a text is not a number.
+    """
+
+    def __init__(self, texts, unsigned=False):
+        distinct = {text: clean_number(text, unsigned) for text in set(texts)}
+        self.values = list(map(distinct.__getitem__, texts))
+        self.floats = None
+        if using_numpy():
+            codes = dict(zip(distinct, range(len(distinct))))
+            numbers = numpy.array([float(value) if is_number(value) else numpy.nan for value in distinct.values()],
+                                  dtype=numpy.float64)
+            rows = numpy.fromiter(map(codes.__getitem__, texts), dtype=numpy.intp, count=len(texts))
+            self.floats = numbers[rows]
+
+    def sums(self, starts):
+        """Per-voucher sums; NaN (or None) where a voucher has no rows or a row is not a number."""
+        if self.floats is not None:
+            counts = numpy.diff(numpy.asarray(starts, dtype=numpy.intp))
+            owners = numpy.repeat(numpy.arange(len(counts)), counts)
+            sums = numpy.bincount(owners, weights=self.floats, minlength=len(counts))
+            sums[counts == 0] = numpy.nan
+            return sums
+        sums = []
+        for start, end in zip(starts, starts[1:]):
+            values = self.values[start:end]
+            sums.append(sum(values) if values and all(map(is_number, values)) else None)
+        return sums
+
+    def totals(self):
+        """One value per row, for a column holding one amount per voucher."""
+        return self.sums(range(len(self.values) + 1))
+
+
+def unbalanced(line_sums, totals):
+    """Batch positions whose line sum and total differ by more than TOLERANCE; unknown ones are skipped."""
+    if not isinstance(line_sums, list):
+        difference = numpy.abs(numpy.abs(line_sums) - numpy.abs(totals))
+        return numpy.flatnonzero(difference > float(TOLERANCE)).tolist()
+    return [position for position, (line_sum, total) in enumerate(zip(line_sums, totals))
+            if line_sum is not None and total is not None and abs(abs(line_sum) - abs(total)) > TOLERANCE]
+
+
+def check_totals(batch, line_sums, totals, doctype):
+    for position in unbalanced(line_sums, totals):
+        metrics.incr("unbalanced", doctype)
+        voucher_no = (batch[position].get("voucher_no") or "").strip()
+        logger.warning(f"{doctype} {voucher_no}: line amounts add up to {abs(line_sums[position]):.2f}, "
+                       f"the voucher amount is {abs(totals[position]):.2f}")
+
+
+def transform_inventory_vouchers(vouchers, build, doctype):
+    """Yield build(fields, lines) for extracted invoices or orders, a batch at a time.
+
+    `fields` needs inventory_entries (INVENTORY_ENTRY_FIELDS) and
+    ledger_entries (LEDGER_AMOUNT_FIELDS) groups. `lines` holds
+    (item_name, qty, rate) per inventory entry, qty and rate as Decimals.
+    build may return None to drop a voucher.
+    """
+    for batch in iter_batches(vouchers):
+        with metrics.timed("batch", doctype):
+            lines = LineColumns(batch, inventory_entries, ("item_name", "quantity", "rate", "amount"))
+            rows = list(zip(text_column(lines["item_name"]), NumericColumn(lines["quantity"]).values,
+                            NumericColumn(lines["rate"]).values))
+            if VALIDATE_TOTALS:
+                ledger = LineColumns(batch, ledger_entries, ("amount",), carry=False)
+                check_totals(batch, NumericColumn(lines["amount"]).sums(lines.starts),
+                             NumericColumn(ledger["amount"]).sums(ledger.starts), doctype)
+            records = [build(fields, rows[start:end]) for fields, (start, end) in zip(batch, lines.spans())]
+        yield from filter(None, records)
+
+
+def bill_allocations(fields):
+    return [entry["bill_allocation"] for entry in fields["ledger_entries"] if entry["bill_allocation"]]
+
+
+def transform_payment_vouchers(vouchers, build, doctype, unsigned=False):
+    """Yield build(fields, paid, allocations) for extracted payment vouchers, a batch at a time.
+
+    paid is the bank amount without its sign. `allocations` holds
+    (ref_no, amount) per bill allocation, the amount without its sign when
+    unsigned=True. build may return None to drop a voucher.
+    """
+    for batch in iter_batches(vouchers):
+        with metrics.timed("batch", doctype):
+            allocations = LineColumns(batch, bill_allocations, ("ref_no", "amount"))
+            amounts = NumericColumn(allocations["amount"], unsigned)
+            rows = list(zip(text_column(allocations["ref_no"]), amounts.values))
+            paid = NumericColumn([fields.get("amount_paid") for fields in batch], unsigned=True)
+            if VALIDATE_TOTALS:
+                check_totals(batch, amounts.sums(allocations.starts), paid.totals(), doctype)
+            records = [build(fields, paid_amount, rows[start:end])
+                       for fields, paid_amount, (start, end) in zip(batch, paid.values, allocations.spans())]
+        yield from filter(None, records)
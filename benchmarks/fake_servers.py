@@ -0,0 +1,306 @@
+"""Local stand-ins for Tally and ERPNext, and a way to point the sync modules at them.
+
+FakeTally answers export requests with synthetic XML from
+benchmarks.synthetic, applying their date range and ALTERID filter. FakeERPNext keeps documents in memory behind
+/api/resource/<doctype> and /api/method/frappe.client.insert_many.
+Both count the requests they serve.
+"""
+import json
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import requests
+
+import http_client
+import metrics
+from benchmarks.synthetic import (COLLECTION_HEAD, COLLECTION_TAIL, ENVELOPE_HEAD, ENVELOPE_TAIL, ledger_xml,
+                                  stock_item_xml, voucher_xml)
+from tally_envelope import voucher_collection_name
+
+# Every placeholder base URL used by the sync modules.
+TALLY_PLACEHOLDERS = ("YOUR_TALLY_URL", "TALLY_URL", "TALLY URL")
+ERP_PLACEHOLDERS = ("YOUR_ERP_URL", "ERP_URL", "CUSTOM_API TO CHECK THE EXISTANCE OF CUSTOMER IN ERP")
+
+# ERPNext names these doctypes after a field of the document.
+NAME_FIELDS = {"Customer": "customer_name", "Supplier": "supplier_name", "Item": "item_code"}
+
+WRITE_CHUNK = 64 * 1024
+
+
+class _Server:
+    def __init__(self, handler):
+        self.requests = Counter()
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        handler.server_state = self
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.httpd.server_port}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def count(self, key, sent=0):
+        with self._lock:
+            self.requests[key] += 1
+            self.bytes_sent += sent
+
+    def reset(self):
+        with self._lock:
+            self.requests.clear()
+            self.bytes_sent = 0
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; without this every small
+    # response waits on the client's delayed ACK.
+    disable_nagle_algorithm = True
+    server_state = None
+
+    def log_message(self, *args):
+        pass
+
+    def read_body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def send_body(self, status, body, content_type, delay=0.0):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        for start in range(0, len(body), WRITE_CHUNK):
+            if delay:
+                time.sleep(delay)
+            self.wfile.write(body[start:start + WRITE_CHUNK])
+        return len(body)
+
+
+class TallyObject:
+    """One exported object: its ALTERID, its voucher date (None for masters) and its XML."""
+
+    __slots__ = ("alter_id", "date", "xml")
+
+    def __init__(self, xml):
+        self.alter_id = int(re.search(r"<ALTERID>\s*(\d+)</ALTERID>", xml).group(1))
+        date = re.search(r"<DATE>(\d{8})</DATE>", xml)
+        self.date = date.group(1) if date else None
+        self.xml = xml.encode("utf-8")
+
+    def touch(self, alter_id):
+        """Give the object a new ALTERID, as an edit in Tally does."""
+        self.alter_id = alter_id
+        self.xml = re.sub(rb"<ALTERID>\s*\d+</ALTERID>", f"<ALTERID> {alter_id}</ALTERID>".encode("utf-8"), self.xml)
+
+
+def _export(head, objects, tail):
+    return head.encode("utf-8"), [TallyObject(xml) for xml in objects], tail.encode("utf-8")
+
+
+class FakeTally(_Server):
+    """Serve Ledger, StockItem and Voucher Register exports.
+
+    `masters` ledgers/stock items and `vouchers` vouchers of each voucher
+    type are generated up front. A request only gets the objects inside its
+    SVFROMDATE/SVTODATE range and above its `$AlterID > N` filter, like
+    Tally. touch() gives some objects a new ALTERID between runs.
+    `chunk_delay` seconds are slept before each 64 KB of a response, to
+    stand in for a slow Tally.
+    """
+
+    def __init__(self, masters=1000, vouchers=1000, lines=3, chunk_delay=0.0):
+        super().__init__(_TallyHandler)
+        self.chunk_delay = chunk_delay
+        self.exports = {
+            "SundryDebtorsLedgers": _export(COLLECTION_HEAD, (ledger_xml(n) for n in range(masters)), COLLECTION_TAIL),
+            "SundryCreditorsLedgers": _export(COLLECTION_HEAD, (ledger_xml(n, "Sundry Creditors") for n in range(masters)),
+                                              COLLECTION_TAIL),
+            "StockItems": _export(COLLECTION_HEAD, (stock_item_xml(n) for n in range(masters)), COLLECTION_TAIL),
+        }
+        for voucher_type in ("Sales", "Purchase", "Sales Order", "Purchase Order", "Receipt", "Payment"):
+            self.exports[voucher_type] = _export(
+                ENVELOPE_HEAD, (voucher_xml(n, voucher_type, lines) for n in range(1, vouchers + 1)), ENVELOPE_TAIL)
+            # Voucher collections (tally_envelope) are asked for by ID rather than VOUCHERTYPENAME.
+            self.exports[voucher_collection_name(voucher_type)] = self.exports[voucher_type]
+        self._next_alter_id = max((obj.alter_id for _, objects, _ in self.exports.values() for obj in objects),
+                                  default=0) + 1
+
+    def touch(self, count):
+        """Give the `count` latest objects of every export a new ALTERID; returns how many were touched.
+
+        Vouchers are touched newest first: an incremental Voucher Register
+        export starts at the last voucher date already synced.
+        """
+        touched = 0
+        seen = set()
+        with self._lock:
+            for _, objects, _ in self.exports.values():
+                if id(objects) in seen:
+                    continue
+                seen.add(id(objects))
+                latest = sorted(objects, key=lambda obj: (obj.date or "", obj.alter_id), reverse=True)
+                for obj in latest[:count]:
+                    obj.touch(self._next_alter_id)
+                    self._next_alter_id += 1
+                    touched += 1
+        return touched
+
+    def export_for(self, request):
+        match = re.search(r"<VOUCHERTYPENAME>(.*?)</VOUCHERTYPENAME>", request) or re.search(r"<ID>(.*?)</ID>", request)
+        export = self.exports.get(match.group(1).strip()) if match else None
+        if export is None:
+            return None
+        head, objects, tail = export
+        from_date = re.search(r"<SVFROMDATE[^>]*>(\d{8})</SVFROMDATE>", request)
+        to_date = re.search(r"<SVTODATE[^>]*>(\d{8})</SVTODATE>", request)
+        alter_id = re.search(r"\$AlterID\s*(?:>|&gt;)\s*(\d+)", request)
+        with self._lock:
+            selected = [obj.xml for obj in objects
+                        if (obj.date is None or from_date is None or obj.date >= from_date.group(1))
+                        and (obj.date is None or to_date is None or obj.date <= to_date.group(1))
+                        and (alter_id is None or obj.alter_id > int(alter_id.group(1)))]
+        return b"".join([head, *selected, tail])
+
+
+class _TallyHandler(_Handler):
+    def do_POST(self):
+        tally = self.server_state
+        body = tally.export_for(self.read_body().decode("utf-8", "replace"))
+        if body is None:
+            sent = self.send_body(400, b"<RESPONSE>Unknown export</RESPONSE>", "text/xml")
+        else:
+            sent = self.send_body(200, body, "text/xml; charset=utf-8", tally.chunk_delay)
+        tally.count("POST", sent)
+
+
+class FakeERPNext(_Server):
+    """In-memory /api/resource/<doctype> with `latency` seconds per request."""
+
+    def __init__(self, latency=0.0):
+        super().__init__(_ERPNextHandler)
+        self.latency = latency
+        self.docs = {}
+        self._names = count(1)
+
+    def insert(self, doctype, doc):
+        """Store doc and return its name, or None if the name is taken."""
+        with self._lock:
+            store = self.docs.setdefault(doctype, {})
+            # Other doctypes are named from a series; a client-side "name" is ignored.
+            name = doc.get(NAME_FIELDS.get(doctype)) or f"{doctype[:4].upper()}-{next(self._names):06d}"
+            if name in store:
+                return None
+            store[name] = dict(doc, name=name)
+            return name
+
+    def update(self, doctype, name, changes):
+        with self._lock:
+            doc = self.docs.get(doctype, {}).get(name)
+            if doc is not None:
+                doc.update(changes)
+            return doc
+
+    def select(self, doctype, filters, fields, start, length):
+        with self._lock:
+            rows = list(self.docs.get(doctype, {}).values())
+        for field, operator, value in filters:
+            if operator == "in":
+                wanted = set(value)
+                rows = [row for row in rows if row.get(field) in wanted]
+            else:
+                rows = [row for row in rows if row.get(field) == value]
+        rows = rows[start:start + length] if length else rows[start:]
+        return [{field: row.get(field) for field in fields} for row in rows]
+
+
+class _ERPNextHandler(_Handler):
+    def route(self):
+        parts = urlsplit(self.path)
+        return unquote(parts.path).strip("/").split("/"), parse_qs(parts.query)
+
+    def reply(self, method, status, payload):
+        erp = self.server_state
+        if erp.latency:
+            time.sleep(erp.latency)
+        sent = self.send_body(status, json.dumps(payload).encode("utf-8"), "application/json")
+        erp.count(method, sent)
+
+    def do_GET(self):
+        erp = self.server_state
+        path, query = self.route()
+        if path[:2] != ["api", "resource"] or len(path) < 3:
+            # The custom existence check used when no prefetch is available.
+            return self.reply("GET", 200, {"message": False})
+        filters = json.loads(query.get("filters", ["[]"])[0])
+        fields = json.loads(query.get("fields", ['["name"]'])[0])
+        start = int(query.get("limit_start", ["0"])[0])
+        length = int(query.get("limit_page_length", ["20"])[0])
+        self.reply("GET", 200, {"data": erp.select(path[2], filters, fields, start, length)})
+
+    def do_POST(self):
+        erp = self.server_state
+        path, _ = self.route()
+        doc = json.loads(self.read_body() or b"{}")
+        if path == ["api", "method", "frappe.client.insert_many"]:
+            docs = doc.get("docs") or []
+            if isinstance(docs, str):
+                docs = json.loads(docs)
+            names = [erp.insert(item.get("doctype"), item) for item in docs]
+            if None in names:
+                return self.reply("POST", 417, {"exception": "frappe.exceptions.DuplicateEntryError"})
+            return self.reply("POST", 200, {"message": names})
+        name = erp.insert(path[2], doc)
+        if name is None:
+            return self.reply("POST", 409, {"exception": "frappe.exceptions.DuplicateEntryError"})
+        self.reply("POST", 200, {"data": {"name": name}})
+
+    def do_PUT(self):
+        erp = self.server_state
+        path, _ = self.route()
+        doc = erp.update(path[2], path[3], json.loads(self.read_body() or b"{}"))
+        if doc is None:
+            return self.reply("PUT", 404, {"exception": "frappe.exceptions.DoesNotExistError"})
+        self.reply("PUT", 200, {"data": doc})
+
+
+class RoutedSession(requests.Session):
+    """A Session that sends the placeholder base URLs to real ones."""
+
+    def __init__(self, routes):
+        super().__init__()
+        self.routes = sorted(routes.items(), key=lambda route: -len(route[0]))
+
+    def request(self, method, url, *args, **kwargs):
+        for placeholder, base in self.routes:
+            if url.startswith(placeholder):
+                url = base + url[len(placeholder):]
+                break
+        return super().request(method, url, *args, **kwargs)
+
+
+def route_sessions(tally_url, erp_url):
+    """Make http_client.tally_session()/erp_session() talk to the given servers."""
+    routes = {placeholder: tally_url for placeholder in TALLY_PLACEHOLDERS}
+    routes.update((placeholder, erp_url) for placeholder in ERP_PLACEHOLDERS)
+    http_client.close_sessions()
+    for name, methods, read_retries in (("tally", http_client.TALLY_RETRY_METHODS, http_client.TALLY_READ_RETRIES),
+                                        ("erp", http_client.ERP_RETRY_METHODS, None)):
+        session = RoutedSession(routes)
+        session.adapters = http_client.build_session(methods, read_retries=read_retries).adapters
+        if name == "erp":
+            session.hooks["response"].append(metrics.observe_erp_response)
+        http_client._sessions[name] = session
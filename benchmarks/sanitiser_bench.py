@@ -0,0 +1,90 @@
+"""Compare the shared byte sanitiser with the legacy per-module regex chain.
+
+    python benchmarks/sanitiser_bench.py --size-mb 100
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic import voucher_register
+from sanitiser import VOUCHER_SANITISER
+from tally_stream import find_safe_split
+
+
+# The chain every voucher module used to run on response.text before the
+# shared sanitiser replaced it. It is kept here as the reference.
+def legacy_clean_unwanted_characters(xml_data):
+    fixed_xml = re.sub(r'(\s)([a-zA-Z0-9_-]+)\s*=\s*([a-zA-Z0-9_-]+)', r'\1"\2"="\3"', xml_data)
+    cleaned_data = re.sub(r'[^a-zA-Z0-9\s<>\-="/:.]', '', fixed_xml)
+    return cleaned_data
+
+
+def legacy_preserve_numeric_format(xml_data):
+    numeric_pattern = re.compile(r'\d+\.\d+(/[a-zA-Z]*)?')
+    def replace_invalid_chars(match):
+        return match.group(0)
+    cleaned_data = numeric_pattern.sub(replace_invalid_chars, xml_data)
+    return cleaned_data
+
+
+def legacy_modify_rate_and_quantity(xml_data):
+    xml_data = re.sub(r'(<RATE[^>]*>)([\d\.]+)(/no)(</RATE>)', r'\1\2\4', xml_data)
+    xml_data = re.sub(r'(<ACTUALQTY[^>]*>\s*)([\d\.]+)\s*no(</ACTUALQTY>)', r'\1\2\3', xml_data)
+    return xml_data
+
+
+def legacy_chain(raw):
+    text = raw.decode("utf-8")
+    cleaned = legacy_clean_unwanted_characters(text)
+    cleaned = legacy_preserve_numeric_format(cleaned)
+    return legacy_modify_rate_and_quantity(cleaned).encode("ascii", "ignore")
+
+
+def chunked(raw, chunk_size):
+    out = []
+    pending = b""
+    for start in range(0, len(raw), chunk_size):
+        pending += raw[start:start + chunk_size]
+        split = find_safe_split(pending)
+        if split:
+            out.append(VOUCHER_SANITISER(pending[:split]))
+            pending = pending[split:]
+    out.append(VOUCHER_SANITISER(pending))
+    return b"".join(out)
+
+
+def timed(label, func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - started
+    return label, elapsed, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-mb", type=float, default=100)
+    parser.add_argument("--chunk-kb", type=int, default=64)
+    parser.add_argument("--skip-legacy", action="store_true", help="only time the shared sanitiser")
+    args = parser.parse_args()
+
+    raw = voucher_register(size_bytes=int(args.size_mb * 1024 * 1024))
+    size_mb = len(raw) / (1024 * 1024)
+    print(f"Synthetic Voucher Register: {size_mb:.1f} MB")
+
+    runs = [timed("shared sanitiser (whole document)", VOUCHER_SANITISER, raw),
+            timed(f"shared sanitiser ({args.chunk_kb} KB chunks)", chunked, raw, args.chunk_kb * 1024)]
+    if not args.skip_legacy:
+        runs.append(timed("legacy re.sub chain", legacy_chain, raw))
+
+    reference = runs[-1][2]
+    for label, elapsed, result in runs:
+        match = "identical" if result == reference else "DIFFERS"
+        print(f"{label:40s} {elapsed:8.2f} s {size_mb / elapsed:8.1f} MB/s  output {match}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""Run every sync_* entry point against local Tally and ERPNext stand-ins.
+
+    python benchmarks/sync_bench.py --masters 2000 --vouchers 5000 --erp-latency-ms 20 --max-workers 8
+    python benchmarks/sync_bench.py --json after.json --baseline before.json
+    python benchmarks/sync_bench.py --runs 3 --incremental --changed 50
+
+Reports records/s, peak RSS and the requests each collection made. The
+stand-ins run in the same process, so RSS includes the synthetic exports
+and the documents the fake ERPNext has stored.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sync_all
+from benchmarks.fake_servers import FakeERPNext, FakeTally, route_sessions
+from http_client import close_sessions
+from push_pool import PushResults
+import metrics
+from ref_cache import close_ref_cache
+import tally_stream
+
+
+def current_rss():
+    """Resident set size in bytes, from /proc where available."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class RSSSampler:
+    """Track the peak RSS while a block runs."""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, current_rss())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = current_rss()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+
+def run_collection(collection, tally, erp, max_workers, verbose, full=True):
+    tally.reset()
+    erp.reset()
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    started = time.perf_counter()
+    with RSSSampler() as rss, output:
+        results = collection.sync(max_workers, full)
+    elapsed = time.perf_counter() - started
+    results = results or PushResults()
+    return {
+        "collection": collection.doctype,
+        "records": len(results),
+        "pushed": results.pushed,
+        "seconds": elapsed,
+        "records_per_second": len(results) / elapsed if elapsed else 0.0,
+        "peak_rss_mb": rss.peak / (1024 * 1024),
+        "tally_requests": sum(tally.requests.values()),
+        "tally_mb": tally.bytes_sent / (1024 * 1024),
+        "erp_requests": dict(erp.requests),
+    }
+
+
+def print_report(rows, baseline=None):
+    baseline = {row["collection"]: row for row in baseline or []}
+    print(f"{'collection':<24} {'records':>8} {'pushed':>8} {'seconds':>8} {'rec/s':>9} {'RSS MB':>8} "
+          f"{'Tally':>6} {'GET':>6} {'POST':>6} {'PUT':>6}")
+    for row in rows:
+        requests = row["erp_requests"]
+        line = (f"{row['collection']:<24} {row['records']:>8} {row['pushed']:>8} {row['seconds']:>8.2f} "
+                f"{row['records_per_second']:>9.1f} {row['peak_rss_mb']:>8.1f} {row['tally_requests']:>6} "
+                f"{requests.get('GET', 0):>6} {requests.get('POST', 0):>6} {requests.get('PUT', 0):>6}")
+        before = baseline.get(row["collection"])
+        if before and before["records_per_second"]:
+            line += f"  {row['records_per_second'] / before['records_per_second']:5.2f}x baseline"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--masters", type=int, default=1000, help="customers, suppliers and items exported")
+    parser.add_argument("--vouchers", type=int, default=1000, help="vouchers exported per voucher type")
+    parser.add_argument("--lines", type=int, default=3, help="inventory lines per voucher")
+    parser.add_argument("--erp-latency-ms", type=float, default=0, help="added to every ERPNext response")
+    parser.add_argument("--tally-chunk-delay-ms", type=float, default=0, help="slept before every 64 KB from Tally")
+    parser.add_argument("--max-workers", type=int, help="concurrent ERPNext pushes per collection")
+    parser.add_argument("--runs", type=int, default=1,
+                        help="repeat the sync; later runs reuse the sync ledger, like a nightly job")
+    parser.add_argument("--incremental", action="store_true",
+                        help="after the first run, export only what changed since the stored watermarks")
+    parser.add_argument("--changed", type=int, default=100,
+                        help="objects per export given a new ALTERID before each incremental run")
+    parser.add_argument("--window", choices=[*tally_stream.WINDOW_DAYS, "none"], default=tally_stream.WINDOW,
+                        help="date window of each Voucher Register request")
+    parser.add_argument("--only", nargs="*", help="collections to run, e.g. Customer 'Sales Invoice'")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="compare against results written earlier with --json")
+    parser.add_argument("--spool", action="store_true", help="spool Tally responses to disk (tally_stream.SPOOL)")
+    parser.add_argument("--metrics-json", help="write the sync modules' phase timings and counters to this file")
+    parser.add_argument("--verbose", action="store_true", help="show the sync modules' own output")
+    args = parser.parse_args()
+    metrics.setup_logging("DEBUG" if args.verbose else "WARNING")
+    tally_stream.SPOOL = args.spool
+    tally_stream.WINDOW = None if args.window == "none" else args.window
+    # The synthetic vouchers are dated 2024.
+    tally_stream.EXPORT_FROM_DATE = "20240101"
+
+    print(f"Generating {args.masters} masters and {args.vouchers} vouchers per type...")
+    tally = FakeTally(args.masters, args.vouchers, args.lines, args.tally_chunk_delay_ms / 1000).start()
+    erp = FakeERPNext(args.erp_latency_ms / 1000).start()
+    route_sessions(tally.url, erp.url)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    workdir = tempfile.mkdtemp(prefix="sync-bench-")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    rows = []
+    try:
+        for run in range(1, args.runs + 1):
+            full = not (args.incremental and run > 1)
+            if full:
+                print(f"\nRun {run} (watermarks and ledger in {workdir})")
+            else:
+                touched = tally.touch(args.changed)
+                print(f"\nRun {run}, incremental: {touched} object(s) given a new ALTERID (state in {workdir})")
+            run_rows = []
+            for _, stage in sync_all.STAGES:
+                for collection in stage:
+                    if args.only and collection.doctype not in args.only:
+                        continue
+                    run_rows.append(dict(run_collection(collection, tally, erp, args.max_workers, args.verbose,
+                                                        full), run=run))
+            print_report(run_rows, baseline if run == 1 else None)
+            rows.extend(run_rows)
+    finally:
+        os.chdir(cwd)
+        close_sessions()
+        close_ref_cache()
+        tally.stop()
+        erp.stop()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump([row for row in rows if row["run"] == 1], f, indent=2)
+    if args.metrics_json:
+        metrics.write_json(args.metrics_json)
+
+
+if __name__ == "__main__":
+    main()
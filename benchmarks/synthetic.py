@@ -0,0 +1,159 @@
+"""Synthetic Tally exports for benchmarks.
+
+The generated XML includes the things the sanitisers have to deal with:
+entity references, control-character references, non-ASCII text,
+punctuation in names and `/no` unit suffixes on rates and quantities.
+"""
+
+VOUCHER_TEMPLATE = """<TALLYMESSAGE xmlns:UDF="TallyUDF">
+<VOUCHER REMOTEID="5e1a-{n:08d}" VCHKEY="5e1a-{n:08d}:00000008" VCHTYPE="{voucher_type}" ACTION="Create" OBJVIEW="Invoice Voucher View">
+<DATE>2024{month:02d}{day:02d}</DATE>
+<GUID>5e1a-{n:08d}</GUID>
+<NARRATION>Being goods sold vide challan no. {n} &amp; e-way bill (Part-A) - qty=5 ₹ é</NARRATION>
+<PARTYNAME>Party {party} &amp; Sons (P) Ltd.</PARTYNAME>
+<PARTYLEDGERNAME>Party {party} &amp; Sons (P) Ltd.</PARTYLEDGERNAME>
+<VOUCHERNUMBER>{n}</VOUCHERNUMBER>
+<ORDERDUEDATE>{day:02d}-Apr-24</ORDERDUEDATE>
+<ALTERID> {n}</ALTERID>
+<MASTERID> {n}</MASTERID>
+{inventory}<ALLLEDGERENTRIES.LIST>
+<LEDGERNAME>Party {party} &amp; Sons (P) Ltd.</LEDGERNAME>
+<ISDEEMEDPOSITIVE>Yes</ISDEEMEDPOSITIVE>
+<AMOUNT>-{total:.2f}</AMOUNT>
+<BILLALLOCATIONS.LIST>
+<NAME>{bill:06d}</NAME>
+<BILLTYPE>Agst Ref</BILLTYPE>
+<AMOUNT>-{total:.2f}</AMOUNT>
+</BILLALLOCATIONS.LIST>
+<BANKALLOCATIONS.LIST>
+<TRANSACTIONTYPE>Cheque</TRANSACTIONTYPE>
+<AMOUNT>-{total:.2f}</AMOUNT>
+</BANKALLOCATIONS.LIST>
+</ALLLEDGERENTRIES.LIST>
+</VOUCHER>
+</TALLYMESSAGE>
+"""
+
+INVENTORY_TEMPLATE = """<ALLINVENTORYENTRIES.LIST>
+<STOCKITEMNAME>Item {item} &#4; 10mm (Grade-A)</STOCKITEMNAME>
+<ISDEEMEDPOSITIVE>No</ISDEEMEDPOSITIVE>
+<RATE>{rate:.2f}/no</RATE>
+<AMOUNT>{amount:.2f}</AMOUNT>
+<ACTUALQTY> {qty} no</ACTUALQTY>
+<BILLEDQTY> {qty} no</BILLEDQTY>
+</ALLINVENTORYENTRIES.LIST>
+"""
+
+ENVELOPE_HEAD = ("<ENVELOPE>\n<HEADER>\n<TALLYREQUEST>Import Data</TALLYREQUEST>\n</HEADER>\n<BODY>\n<IMPORTDATA>\n"
+                 "<REQUESTDESC>\n<REPORTNAME>Vouchers</REPORTNAME>\n</REQUESTDESC>\n<REQUESTDATA>\n")
+ENVELOPE_TAIL = "</REQUESTDATA>\n</IMPORTDATA>\n</BODY>\n</ENVELOPE>\n"
+
+
+def voucher_xml(n, voucher_type="Sales", lines=3):
+    inventory = []
+    total = 0.0
+    for line in range(lines):
+        qty = 1 + (n + line) % 20
+        rate = 100 + (n * 7 + line * 13) % 900 + 0.5
+        total += qty * rate
+        inventory.append(INVENTORY_TEMPLATE.format(item=(n + line) % 5000, rate=rate, amount=qty * rate, qty=qty))
+    return VOUCHER_TEMPLATE.format(
+        n=n, voucher_type=voucher_type, month=1 + n % 12, day=1 + n % 28, party=n % 2000,
+        bill=n, total=total, inventory="".join(inventory),
+    )
+
+
+def iter_voucher_register(count=None, size_bytes=None, voucher_type="Sales", lines=3, start=1):
+    """Yield a Voucher Register export as UTF-8 byte chunks.
+
+    Stops after `count` vouchers or once `size_bytes` bytes have been produced.
+    """
+    yield ENVELOPE_HEAD.encode("utf-8")
+    produced = 0
+    n = start
+    while (count is None or n < start + count) and (size_bytes is None or produced < size_bytes):
+        chunk = voucher_xml(n, voucher_type, lines).encode("utf-8")
+        produced += len(chunk)
+        n += 1
+        yield chunk
+    yield ENVELOPE_TAIL.encode("utf-8")
+
+
+def voucher_register(count=None, size_bytes=None, voucher_type="Sales", lines=3):
+    return b"".join(iter_voucher_register(count, size_bytes, voucher_type, lines))
+
+
+LEDGER_TEMPLATE = """<TALLYMESSAGE xmlns:UDF="TallyUDF">
+<LEDGER NAME="Party {n} &amp; Sons (P) Ltd." RESERVEDNAME="">
+<PARENT>{parent}</PARENT>
+<ALTERID> {n}</ALTERID>
+<INCOMETAXNUMBER>ABCDE{n:04d}F</INCOMETAXNUMBER>
+<LEDGSTREGDETAILS.LIST>
+<APPLICABLEFROM>20240401</APPLICABLEFROM>
+<GSTREGISTRATIONTYPE>{registration}</GSTREGISTRATIONTYPE>
+<GSTIN>27ABCDE{n:04d}F1Z5</GSTIN>
+</LEDGSTREGDETAILS.LIST>
+<LEDMAILINGDETAILS.LIST>
+<ADDRESS.LIST TYPE="String">
+<ADDRESS>Plot No. {n}, M.I.D.C. &amp; Sector-{sector} ₹</ADDRESS>
+<ADDRESS>Near Rly. Stn. (East) - Pune</ADDRESS>
+</ADDRESS.LIST>
+<APPLICABLEFROM>20240401</APPLICABLEFROM>
+<PINCODE>4110{pin:02d}</PINCODE>
+<MAILINGNAME>Party {n} &amp; Sons (P) Ltd.</MAILINGNAME>
+<STATE>Maharashtra</STATE>
+<COUNTRY>India</COUNTRY>
+</LEDMAILINGDETAILS.LIST>
+<LANGUAGENAME.LIST>
+<NAME.LIST TYPE="String">
+<NAME>Party {n} &amp; Sons (P) Ltd.</NAME>
+</NAME.LIST>
+</LANGUAGENAME.LIST>
+</LEDGER>
+</TALLYMESSAGE>
+"""
+
+STOCK_ITEM_TEMPLATE = """<TALLYMESSAGE xmlns:UDF="TallyUDF">
+<STOCKITEM NAME="Item {n} &#4; 10mm (Grade-A)" RESERVEDNAME="">
+<PARENT>Raw Material &amp; Parts</PARENT>
+<BASEUNITS>no</BASEUNITS>
+<ALTERID> {n}</ALTERID>
+<OPENINGBALANCE> {qty} no</OPENINGBALANCE>
+<HSNDETAILS.LIST>
+<APPLICABLEFROM>20240401</APPLICABLEFROM>
+<HSNCODE>7308{hsn:02d}</HSNCODE>
+</HSNDETAILS.LIST>
+<BATCHALLOCATIONS.LIST>
+<GODOWNNAME>Main Location</GODOWNNAME>
+<BATCHNAME>Primary Batch</BATCHNAME>
+<OPENINGBALANCE> {qty} no</OPENINGBALANCE>
+<OPENINGVALUE>-{value:.2f}</OPENINGVALUE>
+</BATCHALLOCATIONS.LIST>
+<LANGUAGENAME.LIST>
+<NAME.LIST TYPE="String">
+<NAME>Item {n} &#4; 10mm (Grade-A)</NAME>
+</NAME.LIST>
+</LANGUAGENAME.LIST>
+</STOCKITEM>
+</TALLYMESSAGE>
+"""
+
+
+def ledger_xml(n, parent="Sundry Debtors"):
+    registration = ("Regular", "Composition", "Unregistered/Consumer")[n % 3]
+    return LEDGER_TEMPLATE.format(n=n, parent=parent, registration=registration, sector=n % 40, pin=n % 100)
+
+
+def stock_item_xml(n):
+    qty = 1 + n % 50
+    return STOCK_ITEM_TEMPLATE.format(n=n, qty=qty, hsn=n % 100, value=qty * (100 + n % 900))
+
+
+COLLECTION_HEAD = "<ENVELOPE>\n<BODY>\n<DATA>\n<COLLECTION>\n"
+COLLECTION_TAIL = "</COLLECTION>\n</DATA>\n</BODY>\n</ENVELOPE>\n"
+
+
+def collection_export(count, render):
+    """A Collection export (ledgers, stock items) of `count` objects as UTF-8 bytes."""
+    body = "".join(render(n) for n in range(count))
+    return f"{COLLECTION_HEAD}{body}{COLLECTION_TAIL}".encode("utf-8")
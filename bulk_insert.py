@@ -0,0 +1,161 @@
+import logging
+
+import requests
+
+from erpnext_index import ERP_URL, fetch_names_by_field
+from http_client import erp_session
+from push_pool import PushResult, PushResults, push_records
+from sync_ledger import NEW, ledger_push
+
+logger = logging.getLogger(__name__)
+
+# Set to True (or pass bulk=True to sync_customers / sync_suppliers /
+# sync_stock_items) to create new master records in batches.
+BULK_INSERT = False
+# Any whitelisted method taking {"docs": [...]} works. frappe.client.insert_many
+# returns the inserted names; a custom method may return one
+# {"name": ..., "error": ...} row per doc instead, in order.
+BULK_METHOD = "frappe.client.insert_many"
+# frappe.client.insert_many refuses more than 200 documents per call.
+BATCH_SIZE = 200
+
+
+class BulkInsertError(Exception):
+    pass
+
+
+def post_insert_many(docs, method=None):
+    """Send one batch to the bulk insert method and return its `message`."""
+    url = f"{ERP_URL}/api/method/{method or BULK_METHOD}"
+    headers = {
+        "Authorization": "token API KEY:API SECRET",
+        "Content-Type": "application/json",
+    }
+    try:
+        response = erp_session().post(url, headers=headers, json={"docs": docs})
+    except requests.exceptions.RequestException as e:
+        raise BulkInsertError(str(e)) from e
+    try:
+        body = response.json()
+    except ValueError:
+        body = {}
+    if response.status_code != 200:
+        raise BulkInsertError(f"{response.status_code} {body.get('exception') or response.reason}")
+    return body.get("message")
+
+
+class LocalInsertMany:
+    """In-process stand-in for frappe.client.insert_many.
+
+    Assign an instance to INSERT_MANY to exercise the bulk path without an
+    ERPNext site. Like the real method, it refuses batches over 200 and
+    rejects the whole batch when one document fails, here on a duplicate
+    name. Inserted documents are kept in `docs`, keyed by (doctype, name).
+    """
+
+    NAME_FIELDS = ("name", "item_code", "customer_name", "supplier_name")
+
+    def __init__(self):
+        self.docs = {}
+        self.calls = 0
+
+    def __call__(self, docs, method=None):
+        self.calls += 1
+        if len(docs) > 200:
+            raise BulkInsertError("Only 200 inserts allowed in one request")
+        keys = []
+        for doc in docs:
+            name = next((doc[field] for field in self.NAME_FIELDS if doc.get(field)), None)
+            key = (doc.get("doctype"), name)
+            if not name or key in self.docs or key in keys:
+                raise BulkInsertError(f"Could not insert {doc.get('doctype')} {name!r}")
+            keys.append(key)
+        for key, doc in zip(keys, docs):
+            self.docs[key] = doc
+        return [name for _, name in keys]
+
+
+INSERT_MANY = post_insert_many
+
+
+def parse_rows(message, docs, doctype, name_field):
+    """Return one (name, error) pair per doc from a bulk insert response."""
+    rows = message or []
+    if rows and all(isinstance(row, dict) for row in rows):
+        if len(rows) != len(docs):
+            return [(None, f"{len(rows)} result rows for {len(docs)} documents")] * len(docs)
+        return [(row.get("name"), row.get("error")) for row in rows]
+    # insert_many returns an unordered set of names. They match name_field
+    # when the doctype is named by that field; otherwise look them up.
+    names = set(rows)
+    values = [doc.get(name_field) for doc in docs]
+    if all(value in names for value in values):
+        return [(value, None) for value in values]
+    by_value = fetch_names_by_field(doctype, name_field, values)
+    return [(by_value.get(value), None if value in by_value else "not found after insert") for value in values]
+
+
+def bulk_push(records, ledger, doctype, key, build_payload, add, update=None, name_field=None,
+              existing=None, max_workers=None, batch_size=None, diff=False):
+    """Push master records, creating the new ones BATCH_SIZE at a time.
+
+    Records the ledger has not seen, and whose key is not in `existing`, are
+    sent through INSERT_MANY. Everything else goes through
+    ledger_push(add, update, diff), max_workers at a time, reusing the
+    classification made here. If a batch is rejected, its records are retried
+    one by one with `add` once every batch is done, so each failure is
+    reported against its own record. Returns the PushResults of every
+    record, indexed in input order.
+    """
+    batch_size = batch_size or BATCH_SIZE
+    name_field = name_field or "name"
+    push = ledger_push(ledger, doctype, key, add, update, diff)
+
+    single, new = [], []
+    for index, record in enumerate(records, start=1):
+        classified = ledger.classify(doctype, key(record), record)
+        if classified[0] == NEW and not (existing and key(record) in existing):
+            new.append((index, record))
+        else:
+            single.append((index, record, classified))
+
+    results = PushResults()
+    rejected = []
+
+    def push_each(indexed):
+        pushed = push_records(indexed, lambda item: push(*item[1:]), max_workers)
+        results.merge(pushed, [item[0] for item in indexed])
+
+    def insert_batch(batch):
+        docs = [dict(build_payload(record), doctype=doctype) for _, record in batch]
+        try:
+            message = INSERT_MANY(docs)
+        except BulkInsertError as e:
+            logger.warning(f"Bulk insert of {len(batch)} {doctype} record(s) failed ({e}), adding them one by one...")
+            rejected.extend(batch)
+            return len(batch)
+        added = 0
+        for (index, record), (name, error) in zip(batch, parse_rows(message, docs, doctype, name_field)):
+            if name and not error:
+                ledger.record(doctype, key(record), record, name)
+                added += 1
+            else:
+                logger.warning(f"Failed to add {doctype} {key(record)} to ERPNext: {error}")
+                name = None
+            results.add(PushResult(index, name, None))
+        logger.debug(f"Added {added} of {len(batch)} {doctype} record(s) in one call.")
+        return len(batch)
+
+    push_each(single)
+    batches = [new[start:start + batch_size] for start in range(0, len(new), batch_size)]
+    outcomes = push_records(batches, insert_batch, max_workers, label=f"{doctype} batch")
+    for outcome in outcomes.failures:
+        if outcome.error is not None:
+            for index, _ in batches[outcome.index - 1]:
+                results.add(PushResult(index, None, outcome.error))
+    # Classified again: a record may have been added since, e.g. by an
+    # earlier duplicate in the same export.
+    rejected.sort(key=lambda item: item[0])
+    push_each(rejected)
+    results.failures.sort(key=lambda result: result.index)
+    return results
@@ -1,144 +1,148 @@
+import logging
 import requests
-import xml.etree.ElementTree as ET
-import re
+from functools import partial
+from operator import itemgetter
+
+import bulk_insert
+from bulk_insert import bulk_push
+from erpnext_index import fetch_existing_names
+from field_plan import Field, FieldPlan
+from http_client import erp_session, is_transient
+import metrics
+from push_pool import PushResults, push_records, summarise
+from records import Ledger
+from sanitiser import LEDGER_SANITISER
+from sync_ledger import SyncLedger, adopt_existing, changed_fields, ledger_push
+import tally_stream
+from tally_envelope import MASTER_NAME, collection_request, fetch_list
+from tally_source import tally_source
+from tally_stream import stream_tally_export
+from watermark import Watermark
+import xml_backend
+
+logger = logging.getLogger(__name__)
+
+find_ledgers = xml_backend.compile_findall(".//LEDGER")
+
+LEDGER_FIELDS = FieldPlan([
+    Field(".//NAME", "name"),
+    Field(".//INCOMETAXNUMBER", "pan"),
+    Field(".//LEDGSTREGDETAILSLIST/GSTREGISTRATIONTYPE", "gst_registration_type"),
+    Field(".//LEDGSTREGDETAILSLIST/GSTIN", "gstin"),
+    Field(".//LEDMAILINGDETAILSLIST/STATE", "state"),
+    Field(".//LEDMAILINGDETAILSLIST//ADDRESSLIST/ADDRESS", "addresses", many=True),
+    Field(".//LEDMAILINGDETAILSLIST/PINCODE", "pincode"),
+])
 
 TALLY_API_URL = "YOUR_TALLY_URL" 
 
-def clean_unwanted_characters(xml_data):
-    fixed_xml = re.sub(r'(\s)([a-zA-Z0-9_-]+)=([a-zA-Z0-9_-]+)', r'\1"\2"=\3', xml_data)
-    cleaned_data = re.sub(r'[^a-zA-Z0-9\s<>\-=/":]', '', fixed_xml)
-    return cleaned_data
-
-
 def clean_xml(xml_data):
-    cleaned_xml = clean_unwanted_characters(xml_data)
+    """Sanitise a Tally response and parse it; returns the root element or None."""
+    if xml_data is None:
+        return None
     try:
-        root = ET.fromstring(cleaned_xml)
-        return ET.tostring(root, encoding="unicode")
-    except ET.ParseError as e:
-        print("Error parsing XML:", e)
+        with metrics.timed("sanitise", "Customer"):
+            cleaned = LEDGER_SANITISER(xml_data.encode("utf-8"))
+        with metrics.timed("parse", "Customer"):
+            return xml_backend.fromstring(cleaned)
+    except xml_backend.PARSE_ERRORS as e:
+        logger.warning(f"Error parsing XML: {e}")
         return None
 
 
-def fetch_tally_data():
-    payload = """<ENVELOPE>
-    <HEADER>
-        <VERSION>1</VERSION>
-        <TALLYREQUEST>Export</TALLYREQUEST>
-        <TYPE>Collection</TYPE>
-        <ID>SundryDebtorsLedgers</ID>
-    </HEADER>
-    <BODY>
-        <DESC>
-            <STATICVARIABLES>
-                <SVEXPORTFORMAT>$$SysName:XML</SVEXPORTFORMAT>
-            </STATICVARIABLES>
-            <TDL>
-                <TDLMESSAGE>
-                    <COLLECTION NAME="SundryDebtorsLedgers" ISMODIFY="No" ISFIXED="No" ISINITIALIZE="No" ISOPTION="No" ISINTERNAL="No">
-                        <TYPE>Ledger</TYPE>
-                        <NATIVEMETHOD>*</NATIVEMETHOD>
-                        <FILTER>IsSundryDebtors</FILTER>
-                    </COLLECTION>
-                    <SYSTEM TYPE="Formulae" NAME="IsSundryDebtors">
-                        $Parent = "Sundry Debtors"
-                    </SYSTEM>
-                </TDLMESSAGE>
-            </TDL>
-        </DESC>
-    </BODY>
-</ENVELOPE>
-"""
+def tally_request_xml(watermark=None):
+    return collection_request("SundryDebtorsLedgers", "Ledger", fetch_list(LEDGER_FIELDS, {"name": MASTER_NAME}),
+                              {"IsSundryDebtors": '$Parent = "Sundry Debtors"'}, watermark)
+
+
+def fetch_tally_data(watermark=None, source=None):
+    payload = tally_request_xml(watermark)
 
     headers = {"Content-Type": "application/xml"}
-    response = requests.post(TALLY_API_URL, data=payload, headers=headers)
+    metrics.incr("tally_requests", "Customer")
+    with metrics.timed("tally_request", "Customer"):
+        response = (source or tally_source()).post(TALLY_API_URL, data=payload, headers=headers)
 
     if response.status_code == 200:
         return response.text
     else:
-        print(f"Failed to fetch data from Tally. Status code: {response.status_code}")
+        logger.warning(f"Failed to fetch data from Tally. Status code: {response.status_code}")
+        return None
+
+
+def parse_customer(ledger):
+    fields = LEDGER_FIELDS.extract(ledger)
+    customer_name = fields.get("name")
+    if customer_name is None or not customer_name.strip(): 
         return None
+    customer_name = customer_name.strip()
+
+    pan_no = fields.get("pan", " ")
+
+    gst_registration = fields.get("gst_registration_type", "Unregistered")
+
+    if gst_registration == "Regular":
+        gst_registration = "Registered Regular"
+    if gst_registration == "Composition":
+        gst_registration = "Registered Composition"
+    if gst_registration == "Unkown":
+        gst_registration = " "
+    if gst_registration == "Unregistered/Consumer":
+        gst_registration == "Unregistered"
+
+    gstin = fields.get("gstin")
+
+    state = fields.get("state")
+
 
+    addresses = [address.strip() for address in fields["addresses"] if address]
+    primary_address = ", ".join(addresses) if addresses else "Not Available"
 
-def get_customers_from_tally():
-    raw_xml = fetch_tally_data()
-
-    cleaned_xml = clean_xml(raw_xml)
-
-    if cleaned_xml:
-        try:
-            root = ET.fromstring(cleaned_xml)
-
-            customers = []
-            for ledger in root.findall(".//LEDGER"):
-                customer_name = ledger.find(".//NAME")
-                if customer_name is None or not customer_name.text.strip(): 
-                    continue
-                customer_name = customer_name.text.strip()
-                
-                pan_no = ledger.find(".//INCOMETAXNUMBER").text if ledger.find(".//INCOMETAXNUMBER") is not None else " "
-                
-                gst_registration ="Unregistered"
-                gst_element = ledger.find(".//LEDGSTREGDETAILSLIST/GSTREGISTRATIONTYPE")
-                if gst_element is not None:
-                    gst_registration = gst_element.text
-                
-                if gst_registration == "Regular":
-                    gst_registration = "Registered Regular"
-                if gst_registration == "Composition":
-                    gst_registration = "Registered Composition"
-                if gst_registration == "Unkown":
-                    gst_registration = " "
-                if gst_registration == "Unregistered/Consumer":
-                    gst_registration == "Unregistered"
-
-                gstin = None
-                gstin_element = ledger.find(".//LEDGSTREGDETAILSLIST/GSTIN")
-                if gstin_element is not None:
-                    gstin = gstin_element.text
-
-                state = None
-                state_element = ledger.find(".//LEDMAILINGDETAILSLIST/STATE")
-                if state_element is not None:
-                    state = state_element.text
-
-                
-                addresses = []
-                for address_element in ledger.findall(".//LEDMAILINGDETAILSLIST//ADDRESSLIST/ADDRESS"):
-                    if address_element.text:
-                        addresses.append(address_element.text.strip())
-                primary_address = ", ".join(addresses) if addresses else "Not Available"
-
-                pincode = " "
-                pincode_element = ledger.find(".//LEDMAILINGDETAILSLIST/PINCODE")
-                if pincode_element is not None:
-                    pincode = pincode_element.text
-
-                customers.append({
-                    'customer_name': customer_name,
-                    'pan': pan_no,
-                    'gstin': gstin,
-                    "gst": gst_registration,
-                    'state': state,
-                    'address': primary_address,  
-                    'pincode': pincode
-                })
-
-            if customers:
-                return customers
-            else:
-                print("No customers found in the response.")
-        except ET.ParseError as e:
-            print(f"Error parsing cleaned XML: {e}")
+    pincode = fields.get("pincode", " ")
+
+    return Ledger(
+        customer_name=customer_name,
+        pan=pan_no,
+        gstin=gstin,
+        gst=gst_registration,
+        state=state,
+        address=primary_address,
+        pincode=pincode
+    )
+
+
+def iter_customers(ledgers, watermark=None):
+    for ledger in ledgers:
+        if watermark and not watermark.observe(ledger):
+            continue
+        with metrics.timed("transform", "Customer"):
+            customer = parse_customer(ledger)
+        if customer:
+            yield customer
+
+
+def get_customers_from_tally(watermark=None, source=None):
+    source = source or tally_source()
+    if tally_stream.SPOOL or not source.live:
+        ledgers = stream_tally_export(TALLY_API_URL, tally_request_xml(watermark), "LEDGER", LEDGER_SANITISER,
+                                      {"Content-Type": "application/xml"}, watermark=watermark, doctype="Customer",
+                                      source=source)
     else:
-        print("Failed to clean the XML response.")
-    return []
+        root = clean_xml(fetch_tally_data(watermark, source))
+        if root is None:
+            logger.warning("Failed to clean the XML response.")
+            return []
+        ledgers = find_ledgers(root)
+    customers = list(iter_customers(ledgers, watermark))
+    if not customers:
+        logger.info("No customers found in the response.")
+    return customers
 
 
 def is_customer_present(customer_name):
     """Check if a customer exists in ERPNext using the custom API."""
     try:
-        response = requests.get(
+        response = erp_session().get(
             f"CUSTOM_API TO CHECK THE EXISTANCE OF CUSTOMER IN ERP",
             params={"customer_name": customer_name}
         )
@@ -146,26 +150,15 @@ def is_customer_present(customer_name):
             result = response.json()
             return result.get("message", False) 
         else:
-            print(f"Failed to check if customer exists. Status code: {response.status_code}")
+            logger.warning(f"Failed to check if customer exists. Status code: {response.status_code}")
             return False
     except Exception as e:
-        print(f"Error checking customer existence: {e}")
+        logger.warning(f"Error checking customer existence: {e}")
         return False
 
 
-def add_customer_to_erpnext(customer):
-    """Add a customer to ERPNext only if they don't already exist."""
-    if is_customer_present(customer.get('customer_name')):
-        print(f"Customer {customer['customer_name']} already exists in ERPNext. Skipping...")
-        return
-
-    erpnext_endpoint = "YOUR_ERP_URL/api/resource/Customer"
-    headers = {
-        "Authorization": "token API KEY:API SECRET",
-        "Content-Type": "application/json"
-    }
-
-    data = {
+def build_customer_payload(customer):
+    return {
         "doctype": "Customer",
         "customer_name": customer.get('customer_name', 'Unnamed Customer'),
         "custom_state": customer.get('state', 'Not Available'),
@@ -176,38 +169,113 @@ def add_customer_to_erpnext(customer):
         "primary_address": customer.get('address', 'Not Available')
     }
 
+
+def add_customer_to_erpnext(customer, existing_customers=None):
+    """Add a customer to ERPNext only if they don't already exist.
+
+    When `existing_customers` (a set prefetched by sync_customers) is given
+    it is used instead of querying ERPNext for every customer.
+    """
+    if existing_customers is not None:
+        exists = customer.get('customer_name') in existing_customers
+    else:
+        exists = is_customer_present(customer.get('customer_name'))
+    if exists:
+        logger.debug(f"Customer {customer['customer_name']} already exists in ERPNext. Skipping...")
+        return
+
+    erpnext_endpoint = "YOUR_ERP_URL/api/resource/Customer"
+    headers = {
+        "Authorization": "token API KEY:API SECRET",
+        "Content-Type": "application/json"
+    }
+
+    data = build_customer_payload(customer)
+
+    doc_name = None
     try:
-        response = requests.post(erpnext_endpoint, headers=headers, json=data)
+        response = erp_session().post(erpnext_endpoint, headers=headers, json=data)
         response.raise_for_status()
-        print(f"Successfully added customer {customer['customer_name']} to ERPNext.")
+        logger.debug(f"Successfully added customer {customer['customer_name']} to ERPNext.")
+        doc_name = response.json().get("data", {}).get("name")
+        if existing_customers is not None:
+            existing_customers.add(customer['customer_name'])
     except requests.exceptions.HTTPError as err:
-        print(f"Failed to add customer {customer['customer_name']} to ERPNext: {err}")
+        logger.warning(f"Failed to add customer {customer['customer_name']} to ERPNext: {err}")
+        if is_transient(err):
+            raise
     try:
         response_json = response.json()  
         if "_server_messages" in response_json:
             server_message = response_json["_server_messages"]
-            print(f"Error Message: {server_message}")
+            logger.warning(f"Error Message: {server_message}")
         else:
-            print("No server messages found in the response.")
+            logger.debug("No server messages found in the response.")
     except ValueError:
-        print("Response is not in JSON format.")
+        logger.warning("Response is not in JSON format.")
     except Exception as err:
-        print(f"Error occurred while adding customer {customer['customer_name']} to ERPNext: {err}")
+        logger.warning(f"Error occurred while adding customer {customer['customer_name']} to ERPNext: {err}")
+    return doc_name
 
 
-def sync_customers():
-    customers = get_customers_from_tally()
+def update_customer_in_erpnext(customer, erp_name, previous=None):
+    erpnext_endpoint = f"YOUR_ERP_URL/api/resource/Customer/{erp_name}"
+    headers = {
+        "Authorization": "token API KEY:API SECRET",
+        "Content-Type": "application/json",
+    }
+    data = build_customer_payload(customer)
+    if previous is not None:
+        data = changed_fields(build_customer_payload(previous), data)
+        if not data:
+            logger.debug(f"Customer {customer['customer_name']} has no changes for ERPNext, skipping...")
+            return erp_name
+
+    try:
+        response = erp_session().put(erpnext_endpoint, headers=headers, json=data)
+        response.raise_for_status()
+        logger.debug(f"Successfully updated customer {customer['customer_name']} in ERPNext.")
+        return erp_name
+    except requests.exceptions.HTTPError as err:
+        logger.warning(f"Failed to update customer {customer['customer_name']} in ERPNext: {err}")
+        if is_transient(err):
+            raise
+        return None
+
+
+def sync_customers(max_workers=None, full=False, records=None, watermark=None, bulk=None):
+    watermark = watermark or Watermark("Customer", full)
+    customers = get_customers_from_tally(watermark) if records is None else records
 
     if not customers:
-        print("No new customers to sync.")
-        return
+        logger.info("No new customers to sync.")
+        return PushResults()
+
+    existing_customers = fetch_existing_names("Customer", "customer_name")
 
+    valid = []
     for customer in customers:
         if 'customer_name' in customer:
-            add_customer_to_erpnext(customer)
+            valid.append(customer)
         else:
-            print(f"Customer data missing 'customer_name': {customer}")
+            logger.warning(f"Customer data missing 'customer_name': {customer}")
+
+    ledger = SyncLedger()
+    adopt_existing(ledger, "Customer", valid, itemgetter("customer_name"), "customer_name", existing_customers)
+    add = partial(add_customer_to_erpnext, existing_customers=existing_customers)
+    if (bulk_insert.BULK_INSERT if bulk is None else bulk):
+        results = bulk_push(valid, ledger, "Customer", itemgetter("customer_name"), build_customer_payload, add,
+                            update_customer_in_erpnext, name_field="customer_name",
+                            existing=existing_customers, max_workers=max_workers, diff=True)
+    else:
+        push = ledger_push(ledger, "Customer", itemgetter("customer_name"), add, update_customer_in_erpnext, diff=True)
+        results = push_records(valid, push, max_workers)
+    ledger.close()
+    watermark.commit(results.ok)
+    summarise(results, "Customer(s)", "Customer")
+    return results
 
 
 if __name__ == "__main__":
+    metrics.setup_logging()
     sync_customers()
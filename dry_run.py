@@ -0,0 +1,97 @@
+"""A stand-in for ERPNext that answers every request locally and only counts them.
+
+With install(), erp_session() returns a DryRunSession: inserts get made-up
+names, lookups find nothing, and no request leaves the machine. The sync
+ledger, watermarks and ref cache are pointed at a scratch directory so a
+dry run never marks anything as synced for the real one.
+"""
+import json
+import logging
+import os
+import tempfile
+import threading
+from collections import Counter
+from datetime import timedelta
+from itertools import count
+
+import requests
+from requests.hooks import dispatch_hook
+from requests.models import PreparedRequest
+
+import http_client
+import metrics
+import ref_cache
+import sync_ledger
+import watermark
+
+logger = logging.getLogger(__name__)
+
+
+class DryRunSession(requests.Session):
+    """Answers ERPNext API calls without sending them; `requests` counts (method, doctype)."""
+
+    def __init__(self):
+        super().__init__()
+        self.requests = Counter()
+        self._lock = threading.Lock()
+        self._names = count(1)
+
+    def request(self, method, url, params=None, data=None, headers=None, json=None, **kwargs):
+        method = method.upper()
+        request = PreparedRequest()
+        request.method = method
+        request.url = url
+        request.prepare_headers(headers)
+        request.prepare_body(data, None, json)
+        parts = metrics.api_path(url)
+        doctype = metrics.url_doctype(url)
+        with self._lock:
+            self.requests[(method, doctype)] += 1
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        response.request = request
+        response.elapsed = timedelta(0)
+        response.encoding = "utf-8"
+        response.headers["Content-Type"] = "application/json"
+        response._content = self.reply(method, parts, doctype, json).encode("utf-8")
+        return dispatch_hook("response", self.hooks, response)
+
+    def name(self, doctype):
+        return f"DRY-{doctype.replace(' ', '-').upper()}-{next(self._names):06d}"
+
+    def reply(self, method, parts, doctype, body):
+        if method == "GET":
+            # Nothing exists yet: lookups return no rows, the custom existence check False.
+            return json.dumps({"data": []} if parts[:2] == ["api", "resource"] else {"message": False})
+        if parts[:2] == ["api", "method"]:
+            docs = (body or {}).get("docs") or []
+            if isinstance(docs, str):
+                docs = json.loads(docs)
+            return json.dumps({"message": [self.name(doc.get("doctype", "doc")) for doc in docs]})
+        if method == "PUT":
+            return json.dumps({"data": {"name": parts[3] if len(parts) > 3 else None}})
+        return json.dumps({"data": {"name": self.name(doctype)}})
+
+    def summary(self):
+        with self._lock:
+            return sorted(self.requests.items(), key=lambda item: item[0][::-1])
+
+
+def install(state_dir=None):
+    """Send ERPNext calls to a DryRunSession and keep sync state in `state_dir` (a new temp dir when None)."""
+    state_dir = state_dir or tempfile.mkdtemp(prefix="tally-dry-run-")
+    sync_ledger.LEDGER_FILE = os.path.join(state_dir, sync_ledger.LEDGER_FILE)
+    watermark.WATERMARK_FILE = os.path.join(state_dir, watermark.WATERMARK_FILE)
+    ref_cache.close_ref_cache()
+    ref_cache.REF_CACHE_FILE = os.path.join(state_dir, ref_cache.REF_CACHE_FILE)
+    session = DryRunSession()
+    session.hooks["response"].append(metrics.observe_erp_response)
+    http_client.set_session("erp", session)
+    logger.info(f"Dry run: nothing is sent to ERPNext; sync state goes to {state_dir}")
+    return session
+
+
+def report(session):
+    for (method, doctype), requests_made in session.summary():
+        logger.info(f"Dry run: {requests_made} {method} request(s) for {doctype}")
@@ -0,0 +1,73 @@
+import json
+import logging
+
+import requests
+
+from http_client import erp_session
+
+logger = logging.getLogger(__name__)
+
+ERP_URL = "ERP_URL"
+PAGE_LENGTH = 1000
+REF_CHUNK_SIZE = 200
+
+
+def fetch_existing_names(doctype, field="name", page_length=PAGE_LENGTH):
+    """Page through /api/resource/<doctype> and return the set of `field` values.
+
+    Returns None if ERPNext could not be queried, so callers can fall back
+    to their per-record checks.
+    """
+    url = f"{ERP_URL}/api/resource/{doctype}"
+    headers = {"Authorization": "token API KEY:API SECRET"}
+    names = set()
+    start = 0
+    try:
+        while True:
+            params = {
+                "fields": json.dumps([field]),
+                "limit_start": start,
+                "limit_page_length": page_length,
+            }
+            response = erp_session().get(url, headers=headers, params=params)
+            response.raise_for_status()
+            rows = response.json().get("data", [])
+            names.update(row[field] for row in rows if row.get(field))
+            if len(rows) < page_length:
+                break
+            start += page_length
+    except (requests.exceptions.RequestException, ValueError) as e:
+        logger.warning(f"Failed to prefetch existing {doctype} records: {e}")
+        return None
+    logger.info(f"Found {len(names)} existing {doctype} record(s) in ERPNext.")
+    return names
+
+
+def fetch_names_by_field(doctype, field, values, chunk_size=REF_CHUNK_SIZE, filters=None):
+    """Map each of `values` to the name of the `doctype` record whose `field` matches.
+
+    Values are resolved with one `field in [...]` query per chunk instead of
+    one request per value. Values with no match are left out of the result.
+    `filters` are added to every query.
+    """
+    url = f"{ERP_URL}/api/resource/{doctype}"
+    headers = {"Authorization": "token API KEY:API SECRET"}
+    values = list(dict.fromkeys(v for v in values if v))
+    names = {}
+    for start in range(0, len(values), chunk_size):
+        chunk = values[start:start + chunk_size]
+        params = {
+            "filters": json.dumps([[field, "in", chunk], *(filters or [])]),
+            "fields": json.dumps(["name", field]),
+            "limit_page_length": 0,
+        }
+        try:
+            response = erp_session().get(url, headers=headers, params=params)
+            response.raise_for_status()
+            rows = response.json().get("data", [])
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logger.warning(f"Failed to resolve {len(chunk)} {doctype} reference(s): {e}")
+            continue
+        for row in rows:
+            names.setdefault(row.get(field), row["name"])
+    return names
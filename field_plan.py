@@ -0,0 +1,128 @@
+from collections import namedtuple
+
+# `path` is an ElementPath relative to the element being extracted, e.g.
+# ".//VOUCHERNUMBER", "OPENINGBALANCE" or ".//LEDMAILINGDETAILSLIST//ADDRESS".
+# The first match in document order wins. With many=True, every match is
+# collected into a list, like findall.
+Field = namedtuple("Field", ["path", "key", "convert", "many"], defaults=(None, False))
+
+# A repeated sub-record such as ALLINVENTORYENTRIES.LIST. Every match yields
+# a dict built from `fields` (a FieldPlan) relative to the matched element.
+# With first=True only the first match is kept and the value is a dict or None.
+Group = namedtuple("Group", ["path", "key", "fields", "first"], defaults=(False,))
+
+
+def split_path(path):
+    """Split an ElementPath into (trigger tag, remainder).
+
+    ".//A/B" becomes ("A", "B") and ".//A//B/C" becomes ("A", ".//B/C"):
+    the remainder is evaluated with find/findall on each A found by the walk.
+    Paths that do not start with ".//" have no trigger and are evaluated
+    directly on the extracted element.
+    """
+    if not path.startswith(".//"):
+        return None, path
+    head, sep, rest = path[3:].partition("/")
+    if not sep:
+        return head, None
+    if rest.startswith("/"):
+        rest = "." + sep + rest
+    return head, rest
+
+
+class FieldPlan:
+    """Declarative field map compiled into a single-walk extractor.
+
+    extract(element) walks the subtree of `element` once, with
+    element.iter(), and dispatches each element on its tag. It returns a
+    dict holding the raw text (or converted value) of every field that was
+    found. Missing fields are absent from the dict, so `.get(key, default)`
+    mirrors the old `find(...) is not None` checks. Groups are always
+    present, as a list of dicts (or a dict/None with first=True).
+
+    Outer fields see the whole subtree, including the inside of groups. That
+    matches a plain `.//TAG` find on the outer element. Each group element
+    is walked once more by its own plan.
+    """
+
+    def __init__(self, fields=(), groups=()):
+        self.fields = tuple(fields)
+        self.groups = tuple(groups)
+        self.triggers = {}
+        self.direct = []
+        for entry in self.fields + self.groups:
+            tag, rest = split_path(entry.path)
+            if tag is None:
+                self.direct.append((rest, entry))
+            else:
+                self.triggers.setdefault(tag, []).append((rest, entry))
+        # Without groups or list fields the walk can stop once every field is found.
+        self.stop_early = not self.groups and not any(field.many for field in self.fields)
+
+    def new_record(self):
+        record = {}
+        for field in self.fields:
+            if field.many:
+                record[field.key] = []
+        for group in self.groups:
+            record[group.key] = None if group.first else []
+        return record
+
+    def extract(self, element):
+        record = self.new_record()
+        for rest, entry in self.direct:
+            self._apply(record, entry, element, rest, element)
+        triggers = self.triggers
+        if triggers:
+            wanted = len(self.fields)
+            for node in element.iter():
+                matches = triggers.get(node.tag)
+                if matches is None or node is element:
+                    continue
+                for rest, entry in matches:
+                    self._apply(record, entry, node, rest, element)
+                if self.stop_early and len(record) == wanted:
+                    break
+        return record
+
+    @staticmethod
+    def _apply(record, entry, node, rest, element):
+        if isinstance(entry, Group):
+            if entry.first and record[entry.key] is not None:
+                return
+            targets = [node] if rest is None else node.findall(rest)
+            for target in targets:
+                sub_record = entry.fields.extract(target)
+                if entry.first:
+                    record[entry.key] = sub_record
+                    return
+                record[entry.key].append(sub_record)
+            return
+        if not entry.many and entry.key in record:
+            return
+        if rest is None:
+            targets = [node]
+        elif entry.many:
+            targets = node.findall(rest)
+        else:
+            target = node.find(rest)
+            targets = [] if target is None else [target]
+        for target in targets:
+            value = entry.convert(target.text) if entry.convert else target.text
+            if not entry.many:
+                record[entry.key] = value
+                return
+            record[entry.key].append(value)
+
+
+# Inventory lines shared by the invoice and order vouchers.
+INVENTORY_ENTRY_FIELDS = FieldPlan([
+    Field(".//STOCKITEMNAME", "item_name"),
+    Field(".//RATE", "rate"),
+    Field(".//ACTUALQTY", "quantity"),
+    Field("AMOUNT", "amount"),
+])
+
+# The amount of each ledger entry of a voucher. Bill and bank allocations
+# inside the entry carry their own AMOUNT, so only the direct child counts.
+LEDGER_AMOUNT_FIELDS = FieldPlan([Field("AMOUNT", "amount")])
@@ -0,0 +1,156 @@
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import metrics
+
+# Connections kept open per host. It must cover every ERPNext push in flight
+# (max_workers per collection, times the collections pushed side by side);
+# beyond it urllib3 opens throwaway connections. sync_all.py raises it to
+# match --max-workers.
+POOL_SIZE = 32
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 60
+MAX_RETRIES = 3
+BACKOFF_FACTOR = 0.5
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Statuses that say nothing about the document itself: a push that still gets
+# one after the retries failed, rather than being rejected, so it holds the
+# watermark. A 500 is usually an exception raised while validating the
+# document, which resending would only repeat.
+TRANSIENT_STATUSES = (429, 502, 503, 504)
+
+# Tally exports are read-only, so a failed POST can be replayed. ERPNext
+# inserts are not, so only the idempotent methods are retried on a bad status.
+TALLY_RETRY_METHODS = frozenset(["GET", "POST"])
+ERP_RETRY_METHODS = frozenset(["GET", "PUT", "DELETE", "HEAD", "OPTIONS"])
+# An insert is still retried when ERPNext turned it away before processing
+# it: on a 429, or a 503 that says when to come back (Retry-After). The wait
+# honours Retry-After.
+INSERT_RETRY_STATUSES = (429, 503)
+# A Tally export that timed out while being read is not sent again: the
+# windowed Voucher Register exports split the window instead, and a replay
+# would only wait out another READ_TIMEOUT. Connection errors and bad
+# statuses are still retried.
+TALLY_READ_RETRIES = 0
+
+_sessions = {}
+_lock = threading.Lock()
+
+
+class InsertRetry(Retry):
+    """Retry that also resends a POST outside retry_methods on INSERT_RETRY_STATUSES.
+
+    A 503 is only retried with a Retry-After header. Connection and read
+    errors on such a POST are still never retried.
+    """
+
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if super().is_retry(method, status_code, has_retry_after):
+            return True
+        if method.upper() != "POST" or not self.total or status_code not in INSERT_RETRY_STATUSES:
+            return False
+        return status_code != 503 or has_retry_after
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter that applies a default (connect, read) timeout to every request."""
+
+    def __init__(self, *args, timeout=None, **kwargs):
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return super().send(request, **kwargs)
+
+
+def build_session(retry_methods, pool_size=None, connect_timeout=None, read_timeout=None,
+                  max_retries=None, backoff_factor=None, read_retries=None):
+    retry = InsertRetry(
+        total=MAX_RETRIES if max_retries is None else max_retries,
+        read=read_retries,
+        backoff_factor=BACKOFF_FACTOR if backoff_factor is None else backoff_factor,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=retry_methods,
+        raise_on_status=False,
+    )
+    pool_size = pool_size or POOL_SIZE
+    adapter = TimeoutHTTPAdapter(
+        timeout=(connect_timeout or CONNECT_TIMEOUT, read_timeout or READ_TIMEOUT),
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def _get_session(name, retry_methods, response_hook=None, read_retries=None):
+    session = _sessions.get(name)
+    if session is None:
+        with _lock:
+            session = _sessions.get(name)
+            if session is None:
+                session = build_session(retry_methods, read_retries=read_retries)
+                if response_hook is not None:
+                    session.hooks["response"].append(response_hook)
+                _sessions[name] = session
+    return session
+
+
+def tally_session():
+    """Return the shared keep-alive session used for Tally export requests."""
+    return _get_session("tally", TALLY_RETRY_METHODS, read_retries=TALLY_READ_RETRIES)
+
+
+def erp_session():
+    """Return the shared keep-alive session used for ERPNext API calls.
+
+    Every response is recorded in metrics (timing, errors, retries).
+    """
+    return _get_session("erp", ERP_RETRY_METHODS, metrics.observe_erp_response)
+
+
+def is_transient(error):
+    """Whether an HTTPError carries one of the TRANSIENT_STATUSES."""
+    response = getattr(error, "response", None)
+    return response is not None and response.status_code in TRANSIENT_STATUSES
+
+
+def configure(pool_size=None, connect_timeout=None, read_timeout=None, max_retries=None,
+              backoff_factor=None):
+    """Override the pool/timeout/retry settings and drop any sessions already built."""
+    global POOL_SIZE, CONNECT_TIMEOUT, READ_TIMEOUT, MAX_RETRIES, BACKOFF_FACTOR
+    if pool_size is not None:
+        POOL_SIZE = pool_size
+    if connect_timeout is not None:
+        CONNECT_TIMEOUT = connect_timeout
+    if read_timeout is not None:
+        READ_TIMEOUT = read_timeout
+    if max_retries is not None:
+        MAX_RETRIES = max_retries
+    if backoff_factor is not None:
+        BACKOFF_FACTOR = backoff_factor
+    close_sessions()
+
+
+def close_sessions():
+    with _lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+def set_session(name, session):
+    """Use `session` as the shared "tally" or "erp" session from now on."""
+    with _lock:
+        previous = _sessions.get(name)
+        _sessions[name] = session
+    if previous is not None and previous is not session:
+        previous.close()
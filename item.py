@@ -1,172 +1,222 @@
+import logging
 import requests
-import xml.etree.ElementTree as ET
-import re
+from operator import itemgetter
+
+import bulk_insert
+from bulk_insert import bulk_push
+from field_plan import Field, FieldPlan, Group
+from http_client import erp_session, is_transient
+import metrics
+from push_pool import PushResults, push_records, summarise
+from records import StockItem, plain
+from sanitiser import STOCK_ITEM_SANITISER
+from sync_ledger import SyncLedger, adopt_existing, changed_fields, ledger_push
+import tally_stream
+from tally_envelope import MASTER_NAME, collection_request, fetch_list
+from tally_source import tally_source
+from tally_stream import stream_tally_export
+from watermark import Watermark
+import xml_backend
+
+logger = logging.getLogger(__name__)
+
+find_stock_items = xml_backend.compile_findall(".//STOCKITEM")
+
+STOCK_ITEM_FIELDS = FieldPlan(
+    [
+        Field(".//NAME", "name"),
+        Field(".//HSNDETAILS.LIST/HSNCODE", "hsn_code"),
+        Field(".//PARENT", "parent"),
+    ],
+    [Group(".//BATCHALLOCATIONS.LIST", "batch_allocations", FieldPlan([Field("OPENINGBALANCE", "opening_balance")]))],
+)
 
 
-def clean_unwanted_characters(xml_data):
-    fixed_xml = re.sub(r'(\s)([a-zA-Z0-9_-]+)\s*=\s*([a-zA-Z0-9_-]+)', r'\1"\2"="\3"', xml_data)
-    cleaned_data = re.sub(r'[^a-zA-Z0-9\s<>\-="/:.]', '', fixed_xml)
-    return cleaned_data
-
+def clean_xml(xml_data):
+    """Sanitise a Tally response and parse it; returns the root element or None."""
+    try:
+        with metrics.timed("sanitise", "Item"):
+            cleaned = STOCK_ITEM_SANITISER(xml_data.encode("utf-8"))
+        with metrics.timed("parse", "Item"):
+            return xml_backend.fromstring(cleaned)
+    except xml_backend.PARSE_ERRORS as e:
+        logger.warning(f"Error parsing XML: {e}")
+        return None
 
-def modify_rate_and_quantity(xml_data):
-    xml_data = re.sub(r'(<RATE[^>]*>)([\d\.]+)(/no)(</RATE>)', r'\1\2\4', xml_data)
-    xml_data = re.sub(r'(<OPENINGBALANCE[^>]*>)\s*([\d\.]+)\s*no(</OPENINGBALANCE>)', r'\1\2\3', xml_data)
-    return xml_data
 
+def parse_stock_item(stock_item):
+    fields = STOCK_ITEM_FIELDS.extract(stock_item)
+    item_name = fields.get("name")
+    if item_name is None or not item_name.strip(): 
+        return None
+    item_name = item_name.strip()
 
-def preserve_numeric_format(xml_data):
-    numeric_pattern = re.compile(r'\d+\.\d+(/[a-zA-Z]*)?')
+    opening_balance = ""
+    for batch_allocation in fields["batch_allocations"]:
+        opening_balance = batch_allocation.get("opening_balance")
 
-    def replace_invalid_chars(match):
-        return match.group(0)
+    hsn_code = fields.get("hsn_code") or "010121"
 
-    cleaned_data = numeric_pattern.sub(replace_invalid_chars, xml_data)
-    return cleaned_data
+    parent_group = fields.get("parent", "Products")
 
+    return StockItem(
+        item_name=item_name,
+        hsn_codes=hsn_code,
+        parent_group=parent_group,
+        rate=opening_balance
+    )
 
-def clean_xml(xml_data):
-    cleaned_xml = clean_unwanted_characters(xml_data)
-    cleaned_xml = modify_rate_and_quantity(cleaned_xml)
-    cleaned_xml = preserve_numeric_format(cleaned_xml)
 
-    try:
-        root = ET.fromstring(cleaned_xml)
-        return ET.tostring(root, encoding="unicode")
-    except ET.ParseError as e:
-        print("Error parsing XML:", e)
-        return None
+def iter_stock_items(stock_items, watermark=None):
+    for stock_item in stock_items:
+        if watermark and not watermark.observe(stock_item):
+            continue
+        with metrics.timed("transform", "Item"):
+            item = parse_stock_item(stock_item)
+        if item:
+            yield item
 
 
-def get_stock_items_from_tally():
+def get_stock_items_from_tally(watermark=None, source=None):
     url = "TALLY_URL"
-    xml_request = """
-    <ENVELOPE>
-    <HEADER>
-        <VERSION>1</VERSION>
-        <TALLYREQUEST>Export</TALLYREQUEST>
-        <TYPE>Collection</TYPE>
-        <ID>StockItems</ID>
-    </HEADER>
-    <BODY>
-        <DESC>
-            <STATICVARIABLES>
-                <SVEXPORTFORMAT>SysName:XML</SVEXPORTFORMAT>
-            </STATICVARIABLES>
-            <TDL>
-                <TDLMESSAGE>
-                    <COLLECTION NAME="StockItems" ISMODIFY="No" ISFIXED="No" ISINITIALIZE="No" ISOPTION="No" ISINTERNAL="No">
-                        <TYPE>StockItem</TYPE>
-                        <NATIVEMETHOD>*</NATIVEMETHOD>
-                    </COLLECTION>
-                </TDLMESSAGE>
-            </TDL>
-        </DESC>
-    </BODY>
-</ENVELOPE>
-    """
+    source = source or tally_source()
+    xml_request = collection_request("StockItems", "StockItem", fetch_list(STOCK_ITEM_FIELDS, {"name": MASTER_NAME}),
+                                     watermark=watermark)
 
     headers = {"Content-Type": "text/xml"}
 
+    if tally_stream.SPOOL or not source.live:
+        stock_items = stream_tally_export(url, xml_request, "STOCKITEM", STOCK_ITEM_SANITISER, headers, 10, watermark,
+                                          doctype="Item", source=source)
+        items = list(iter_stock_items(stock_items, watermark))
+        if not items:
+            logger.info("No stock items found in the response.")
+        return items
+
     try:
-        response = requests.post(url, data=xml_request, headers=headers, timeout=10)
+        metrics.incr("tally_requests", "Item")
+        with metrics.timed("tally_request", "Item"):
+            response = source.post(url, data=xml_request, headers=headers, timeout=10)
 
         if response.status_code == 200:
             raw_xml = response.text
-            cleaned_xml = clean_xml(raw_xml)
-            if cleaned_xml:
-                root = ET.fromstring(cleaned_xml)
-                items = []
-
-                for stock_item in root.findall(".//STOCKITEM"):
-                    item_name = stock_item.find(".//NAME")
-                    if item_name is None or not item_name.text.strip(): 
-                        continue
-                    item_name = item_name.text.strip()
-
-                    opening_balance = ""
-                    for batch_allocation in stock_item.findall(".//BATCHALLOCATIONS.LIST"):
-                        opening_balance = batch_allocation.find("OPENINGBALANCE")
-                        if opening_balance is not None:
-                            opening_balance = opening_balance.text
-
-                    hsn_detail = stock_item.find(".//HSNDETAILS.LIST/HSNCODE")
-                    hsn_code = hsn_detail.text if hsn_detail is not None and hsn_detail.text else "010121"
-
-                    parent_group = stock_item.find(".//PARENT")
-                    parent_group = parent_group.text if parent_group is not None else "Products"
-
-                    items.append({
-                        'item_name': item_name,
-                        'hsn_codes': hsn_code,
-                        'parent_group': parent_group,
-                        'rate':opening_balance
-                    })
-
+            root = clean_xml(raw_xml)
+            if root is not None:
+                items = list(iter_stock_items(find_stock_items(root), watermark))
                 if items:
                     return items
                 else:
-                    print("No stock items found in the response.")
+                    logger.info("No stock items found in the response.")
             else:
-                print("Failed to clean the XML data.")
+                logger.warning("Failed to clean the XML data.")
         else:
-            print(f"Failed to connect to Tally. Status code: {response.status_code}")
+            logger.warning(f"Failed to connect to Tally. Status code: {response.status_code}")
 
     except requests.exceptions.RequestException as e:
-        print(f"Error connecting to Tally: {e}")
+        logger.warning(f"Error connecting to Tally: {e}")
 
     return []
 
 
+def build_item_payload(item):
+    return {
+        "item_code": item.get('item_name', 'Unnamed Item'),
+        "item_group": item.get('parent_group', 'Products'),
+        "stock_uom": "Nos",
+        "gst_hsn_code": item.get('hsn_codes', '010121'),
+        "valuation_rate": plain(item.get('rate', ' '))
+    }
+
+
 def add_item_to_erpnext(item):
     erpnext_endpoint = "ERP_URL/api/resource/Item"
     headers = {
         "Authorization": "token API KEY:API SECRET",
         "Content-Type": "application/json"
     }
-    data = {
-        "item_code": item.get('item_name', 'Unnamed Item'),
-        "item_group": item.get('parent_group', 'Products'),
-        "stock_uom": "Nos",
-        "gst_hsn_code": item.get('hsn_codes', '010121'),
-        "valuation_rate": item.get('rate', ' ')
-    }
+    data = build_item_payload(item)
 
+    doc_name = None
     try:
-        response = requests.post(erpnext_endpoint, headers=headers, json=data)
+        response = erp_session().post(erpnext_endpoint, headers=headers, json=data)
         response.raise_for_status()
-        print(f"Successfully added item {item['item_name']} to ERPNext.")
+        logger.debug(f"Successfully added item {item['item_name']} to ERPNext.")
+        doc_name = response.json().get("data", {}).get("name")
     except requests.exceptions.HTTPError as err:
         if response.status_code == 409:
-            print(f"Item {item['item_name']} already exists, skipping....")
+            logger.debug(f"Item {item['item_name']} already exists, skipping....")
         else:
-            print(f"Failed to add Item {item['item_name']} to ERPNext: {err}")
+            logger.warning(f"Failed to add Item {item['item_name']} to ERPNext: {err}")
+            if is_transient(err):
+                raise
     try:
         response_json = response.json()  
         if "_server_messages" in response_json:
             server_message = response_json["_server_messages"]
-            print(f"Error Message: {server_message}")
+            logger.warning(f"Error Message: {server_message}")
         else:
-            print("No server messages found in the response.")
+            logger.debug("No server messages found in the response.")
     except ValueError:
-        print("Response is not in JSON format.")
+        logger.warning("Response is not in JSON format.")
     except Exception as err:
-        print(f"Error occurred while adding Item {item['item_name']} to ERPNext: {err}")
+        logger.warning(f"Error occurred while adding Item {item['item_name']} to ERPNext: {err}")
+    return doc_name
+
+
+def update_item_in_erpnext(item, erp_name, previous=None):
+    erpnext_endpoint = f"ERP_URL/api/resource/Item/{erp_name}"
+    headers = {
+        "Authorization": "token API KEY:API SECRET",
+        "Content-Type": "application/json",
+    }
+    data = build_item_payload(item)
+    if previous is not None:
+        data = changed_fields(build_item_payload(previous), data)
+        if not data:
+            logger.debug(f"Item {item['item_name']} has no changes for ERPNext, skipping...")
+            return erp_name
+
+    try:
+        response = erp_session().put(erpnext_endpoint, headers=headers, json=data)
+        response.raise_for_status()
+        logger.debug(f"Successfully updated item {item['item_name']} in ERPNext.")
+        return erp_name
+    except requests.exceptions.HTTPError as err:
+        logger.warning(f"Failed to update item {item['item_name']} in ERPNext: {err}")
+        if is_transient(err):
+            raise
+        return None
 
 
-def sync_stock_items():
-    items = get_stock_items_from_tally()
+def sync_stock_items(max_workers=None, full=False, records=None, watermark=None, bulk=None):
+    watermark = watermark or Watermark("Item", full)
+    items = get_stock_items_from_tally(watermark) if records is None else records
 
     if not items:
-        print("No new stock items to sync.")
-        return
+        logger.info("No new stock items to sync.")
+        return PushResults()
 
+    valid = []
     for item in items:
         if 'item_name' in item:
-            add_item_to_erpnext(item)
+            valid.append(item)
         else:
-            print(f"Item data missing 'item_name': {item}")
+            logger.warning(f"Item data missing 'item_name': {item}")
+
+    ledger = SyncLedger()
+    adopt_existing(ledger, "Item", valid, itemgetter("item_name"), "item_code")
+    if (bulk_insert.BULK_INSERT if bulk is None else bulk):
+        results = bulk_push(valid, ledger, "Item", itemgetter("item_name"), build_item_payload, add_item_to_erpnext,
+                            update_item_in_erpnext, name_field="item_code", max_workers=max_workers, diff=True)
+    else:
+        push = ledger_push(ledger, "Item", itemgetter("item_name"), add_item_to_erpnext, update_item_in_erpnext, diff=True)
+        results = push_records(valid, push, max_workers)
+    ledger.close()
+    watermark.commit(results.ok)
+    summarise(results, "Item(s)", "Item")
+    return results
 
 
 if __name__ == "__main__":
+    metrics.setup_logging()
     sync_stock_items()
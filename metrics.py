@@ -0,0 +1,192 @@
+"""Per-doctype phase timings and counters for the sync modules.
+
+Phases are tally_request, sanitise, parse, transform, batch, erp_request and
+submit. Counters include tally_requests, erp_requests, erp_errors,
+erp_retries, records, records_failed, records_rejected and unbalanced. Read them with summary(),
+write_json() or prometheus_text(), or serve them over HTTP with serve().
+"""
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlsplit
+
+# Default for setup_logging(). DEBUG shows one line per record, WARNING
+# only problems. The SYNC_LOG_LEVEL environment variable overrides it.
+LOG_LEVEL = os.environ.get("SYNC_LOG_LEVEL", "INFO")
+
+_lock = threading.Lock()
+_timings = {}
+_counters = {}
+
+
+def setup_logging(level=None):
+    logging.basicConfig(format="%(asctime)s %(levelname)-7s %(name)s: %(message)s")
+    logging.getLogger().setLevel((level or LOG_LEVEL).upper())
+
+
+def observe(phase, doctype, seconds):
+    key = (phase, doctype or "-")
+    with _lock:
+        timing = _timings.get(key)
+        if timing is None:
+            _timings[key] = [1, seconds, seconds]
+        else:
+            timing[0] += 1
+            timing[1] += seconds
+            timing[2] = max(timing[2], seconds)
+
+
+def incr(name, doctype=None, amount=1):
+    key = (name, doctype or "-")
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+@contextmanager
+def timed(phase, doctype):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(phase, doctype, time.perf_counter() - started)
+
+
+def timed_call(phase, doctype, func):
+    """Wrap func so every call is timed as `phase`."""
+    def call(*args, **kwargs):
+        with timed(phase, doctype):
+            return func(*args, **kwargs)
+    return call
+
+
+def api_path(url):
+    """The parts of an ERPNext URL from "api" on, e.g. ["api", "resource", "Customer", "CUST-1"]."""
+    parts = unquote(urlsplit(url).path).strip("/").split("/")
+    return parts[parts.index("api"):] if "api" in parts else parts
+
+
+def url_doctype(url):
+    parts = api_path(url)
+    return parts[2] if len(parts) > 2 and parts[0] == "api" else "-"
+
+
+def observe_erp_response(response, *args, **kwargs):
+    """requests response hook for the ERPNext session.
+
+    The doctype is taken from /api/resource/<doctype> (or the method name of
+    /api/method/<method>). Writes carrying docstatus 1 count as submit.
+    """
+    try:
+        doctype = url_doctype(response.url)
+        body = response.request.body or b""
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        phase = "submit" if b'"docstatus": 1' in body else "erp_request"
+        observe(phase, doctype, response.elapsed.total_seconds())
+        incr("erp_requests", doctype)
+        if response.status_code >= 400:
+            incr("erp_errors", doctype)
+        retries = getattr(response.raw, "retries", None)
+        if retries is not None and retries.history:
+            incr("erp_retries", doctype, len(retries.history))
+    except Exception:
+        logging.getLogger(__name__).debug("Could not record metrics for an ERPNext response", exc_info=True)
+
+
+def record_results(doctype, results):
+    incr("records", doctype, results.total)
+    incr("records_failed", doctype, results.failed)
+    incr("records_rejected", doctype, results.rejected)
+
+
+def reset():
+    with _lock:
+        _timings.clear()
+        _counters.clear()
+
+
+def summary():
+    """{doctype: {"phases": {phase: {count, seconds, max_seconds}}, "counters": {name: value}}}"""
+    result = {}
+    with _lock:
+        for (phase, doctype), (count, total, longest) in _timings.items():
+            phases = result.setdefault(doctype, {"phases": {}, "counters": {}})["phases"]
+            phases[phase] = {"count": count, "seconds": round(total, 6), "max_seconds": round(longest, 6)}
+        for (name, doctype), value in _counters.items():
+            result.setdefault(doctype, {"phases": {}, "counters": {}})["counters"][name] = value
+    return result
+
+
+def write_json(path):
+    with open(path, "w") as f:
+        json.dump(summary(), f, indent=2, sort_keys=True)
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"')
+
+
+def prometheus_text():
+    lines = [
+        "# HELP tally_sync_phase_seconds Time spent per sync phase.",
+        "# TYPE tally_sync_phase_seconds summary",
+    ]
+    with _lock:
+        timings = sorted(_timings.items())
+        counters = sorted(_counters.items())
+    for (phase, doctype), (count, total, _) in timings:
+        labels = f'phase="{_label(phase)}",doctype="{_label(doctype)}"'
+        lines.append(f"tally_sync_phase_seconds_count{{{labels}}} {count}")
+        lines.append(f"tally_sync_phase_seconds_sum{{{labels}}} {total:.6f}")
+    lines += [
+        "# HELP tally_sync_phase_max_seconds Longest single call per sync phase.",
+        "# TYPE tally_sync_phase_max_seconds gauge",
+    ]
+    for (phase, doctype), (_, _, longest) in timings:
+        lines.append(f'tally_sync_phase_max_seconds{{phase="{_label(phase)}",doctype="{_label(doctype)}"}} {longest:.6f}')
+    names = []
+    for (name, _), _ in counters:
+        if name not in names:
+            names.append(name)
+    for name in names:
+        lines.append(f"# TYPE tally_sync_{name}_total counter")
+        for (counter, doctype), value in counters:
+            if counter == name:
+                lines.append(f'tally_sync_{name}_total{{doctype="{_label(doctype)}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.startswith("/metrics.json"):
+            body, content_type = json.dumps(summary()).encode("utf-8"), "application/json"
+        elif self.path.startswith("/metrics"):
+            body, content_type = prometheus_text().encode("utf-8"), "text/plain; version=0.0.4"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+# Interface serve() binds to. The metrics name doctypes and error rates, so
+# only local scrapers see them unless this is widened on purpose.
+METRICS_HOST = "127.0.0.1"
+
+
+def serve(port, host=None):
+    """Serve /metrics (Prometheus text) and /metrics.json from a background thread."""
+    server = ThreadingHTTPServer((host or METRICS_HOST, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,180 @@
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Each sync_* streams fetch -> sanitise -> parse -> push on separate threads
+# joined by bounded queues. False keeps everything on the calling thread.
+PIPELINE = True
+# Items (byte chunks or records) buffered between two stages.
+QUEUE_SIZE = 64
+
+_DONE = object()
+_POLL_SECONDS = 0.1
+
+
+class _Failed:
+    def __init__(self, error):
+        self.error = error
+
+
+class StageStats:
+    """Counters for one pipeline stage.
+
+    `starved` is time spent waiting for the stage before it and `blocked`
+    is time spent waiting for room in the queue to the stage after it. What
+    is left of the wall time is the stage's own work.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.elapsed = 0.0
+        self.starved = 0.0
+        self.blocked = 0.0
+        self.depth_total = 0
+        self.depth_samples = 0
+        self.depth_max = 0
+
+    @property
+    def busy(self):
+        return max(0.0, self.elapsed - self.starved - self.blocked)
+
+    def sample_depth(self, depth):
+        self.depth_total += depth
+        self.depth_samples += 1
+        self.depth_max = max(self.depth_max, depth)
+
+    def line(self):
+        rate = self.items / self.elapsed if self.elapsed else 0.0
+        depth = f"{self.depth_total / self.depth_samples:5.1f} avg {self.depth_max:3d} max" if self.depth_samples else "-"
+        return (f"{self.name:<10} {self.items:>8} items {rate:>10.1f}/s  busy {self.busy:7.2f}s  "
+                f"starved {self.starved:7.2f}s  blocked {self.blocked:7.2f}s  queue {depth}")
+
+
+class Pipeline:
+    """Run generator stages on their own threads, joined by bounded queues.
+
+    stage(name, iterable) starts a thread that drains `iterable` into a
+    queue of at most queue_size items and returns a generator over that
+    queue. Feeding the returned generator into the next stage chains them:
+
+        chunks = pipeline.stage("fetch", response.iter_content(CHUNK_SIZE))
+        cleaned = pipeline.stage("sanitise", iter_sanitised_chunks(chunks, sanitise))
+
+    An exception raised in a stage is re-raised where its output is read,
+    so the existing error handling around the generators still applies.
+    The thread that reads the last stage is accounted to sink_name. A
+    consumer that stops early stops every stage.
+    """
+
+    def __init__(self, queue_size=None, sink_name="push"):
+        self.queue_size = queue_size or QUEUE_SIZE
+        self.stats = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._local = threading.local()
+        self._threads = []
+        self.sink = self._stats(sink_name)
+        self.started = time.monotonic()
+
+    def _stats(self, name):
+        with self._lock:
+            if name not in self.stats:
+                self.stats[name] = StageStats(name)
+            return self.stats[name]
+
+    def stage(self, name, iterable):
+        output = queue.Queue(maxsize=self.queue_size)
+        stats = self._stats(name)
+        thread = threading.Thread(target=self._run, args=(iterable, output, stats),
+                                  name=f"pipeline-{name}", daemon=True)
+        self._threads.append(thread)
+        thread.start()
+        return self._drain(output)
+
+    def _run(self, iterable, output, stats):
+        self._local.stats = stats
+        started = time.monotonic()
+        try:
+            for item in iterable:
+                stats.items += 1
+                if not self._put(output, item, stats):
+                    return
+            self._put(output, _DONE, stats)
+        except BaseException as err:
+            self._put(output, _Failed(err), stats)
+        finally:
+            stats.elapsed += time.monotonic() - started
+
+    def _put(self, output, item, stats):
+        waited = time.monotonic()
+        while not self._stop.is_set():
+            try:
+                output.put(item, timeout=_POLL_SECONDS)
+            except queue.Full:
+                continue
+            stats.blocked += time.monotonic() - waited
+            stats.sample_depth(output.qsize())
+            return True
+        return False
+
+    def _drain(self, source):
+        finished = False
+        try:
+            while not self._stop.is_set():
+                consumer = getattr(self._local, "stats", self.sink)
+                waited = time.monotonic()
+                try:
+                    item = source.get(timeout=_POLL_SECONDS)
+                except queue.Empty:
+                    consumer.starved += time.monotonic() - waited
+                    continue
+                consumer.starved += time.monotonic() - waited
+                if item is _DONE:
+                    finished = True
+                    return
+                if isinstance(item, _Failed):
+                    finished = True
+                    raise item.error
+                if consumer is self.sink:
+                    self.sink.items += 1
+                yield item
+        finally:
+            if not finished:
+                self._stop.set()
+
+    def record(self, name, items, seconds):
+        """Account work done outside a stage thread, e.g. a prefetched export window."""
+        stats = self._stats(name)
+        stats.items += items
+        stats.elapsed += seconds
+
+    def close(self):
+        """Stop any stage still running and wait briefly for the threads to exit."""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout=1)
+        self.sink.elapsed = time.monotonic() - self.started
+
+    def report(self):
+        self.close()
+        logger.info("Pipeline stages:")
+        for stats in self.stats.values():
+            if stats is not self.sink:
+                logger.info(f"  {stats.line()}")
+        logger.info(f"  {self.sink.line()}")
+        slowest = max(self.stats.values(), key=lambda stats: stats.busy)
+        logger.info(f"  Bottleneck: {slowest.name}")
+
+
+def run_stage(pipeline, name, iterable):
+    """pipeline.stage(name, iterable), or iterable unchanged when there is no pipeline."""
+    return iterable if pipeline is None else pipeline.stage(name, iterable)
+
+
+def new_pipeline(records):
+    """A Pipeline for a sync_* call that exports its own records, else None."""
+    return Pipeline() if records is None and PIPELINE else None
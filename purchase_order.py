@@ -1,144 +1,90 @@
+import logging
 import requests
-import xml.etree.ElementTree as ET
-import re
 from datetime import datetime
-
-def clean_unwanted_characters(xml_data):
-    fixed_xml = re.sub(r'(\s)([a-zA-Z0-9_-]+)\s*=\s*([a-zA-Z0-9_-]+)', r'\1"\2"="\3"', xml_data)
-    cleaned_data = re.sub(r'[^a-zA-Z0-9\s<>\-="/:.]', '', fixed_xml)
-    return cleaned_data
-
-
-def preserve_numeric_format(xml_data):
-    numeric_pattern = re.compile(r'\d+\.\d+(/[a-zA-Z]*)?')
-    def replace_invalid_chars(match):
-        return match.group(0) 
-    cleaned_data = numeric_pattern.sub(replace_invalid_chars, xml_data)
-    return cleaned_data
-
-
-def modify_rate_and_quantity(xml_data):
-    xml_data = re.sub(r'(<RATE[^>]*>)([\d\.]+)(/no)(</RATE>)', r'\1\2\4', xml_data)
-    xml_data = re.sub(r'(<ACTUALQTY[^>]*>\s*)([\d\.]+)\s*no(</ACTUALQTY>)', r'\1\2\3', xml_data)
-    return xml_data
-
-
-def normalize_and_clean_xml(xml_data):
-    cleaned_xml = clean_unwanted_characters(xml_data)
-    cleaned_xml = preserve_numeric_format(cleaned_xml)
-    cleaned_xml = modify_rate_and_quantity(cleaned_xml)
-    
-    try:
-        root = ET.fromstring(cleaned_xml)
-        cleaned_string = ET.tostring(root, encoding="unicode", method="xml").replace("\n", "").replace("\r", "").strip()
-        return cleaned_string
-    except ET.ParseError as e:
-        print("Error parsing XML:", e)
+from operator import itemgetter
+
+from batch_transform import extract_fields, transform_inventory_vouchers
+from field_plan import INVENTORY_ENTRY_FIELDS, LEDGER_AMOUNT_FIELDS, Field, FieldPlan, Group
+from http_client import erp_session, is_transient
+import metrics
+from pipeline import new_pipeline, run_stage
+from push_pool import push_records, summarise
+from records import InventoryLine, Voucher, plain
+from ref_cache import remember
+from sanitiser import VOUCHER_SANITISER
+from sync_ledger import SyncLedger, ledger_push
+from tally_envelope import ORDER_DUE_DATE, voucher_request
+from tally_stream import stream_voucher_register
+from watermark import Watermark
+
+logger = logging.getLogger(__name__)
+
+PURCHASE_ORDER_FIELDS = FieldPlan(
+    [
+        Field(".//PARTYLEDGERNAME", "party_ledger"),
+        Field(".//VOUCHERNUMBER", "voucher_no"),
+        Field(".//DATE", "date"),
+        Field(".//ORDERDUEDATE", "due_date"),
+    ],
+    [
+        Group(".//ALLINVENTORYENTRIES.LIST", "inventory_entries", INVENTORY_ENTRY_FIELDS),
+        Group(".//ALLLEDGERENTRIES.LIST", "ledger_entries", LEDGER_AMOUNT_FIELDS),
+    ],
+)
+
+
+def build_purchase_order(fields, lines):
+    party_ledger = fields["party_ledger"].strip() if fields.get("party_ledger") else "Unknown Supplier"
+    logger.debug(f"Processing Voucher for Supplier: {party_ledger}")
+
+    voucher_no = fields.get("voucher_no").strip()
+
+    date = fields.get("date").strip()
+    if date:
+       date = datetime.strptime(date, "%Y%m%d").strftime("%Y-%m-%d")
+
+    due_date = fields.get("due_date").strip()
+    if due_date:
+        due_date = datetime.strptime(due_date, "%d-%b-%y").strftime("%Y-%m-%d")
+
+
+    po_data = Voucher(
+        custom_ref_no=voucher_no,
+        transaction_date=date,
+        schedule_date=due_date,
+        party_ledger=party_ledger, 
+        items=[]
+        )
+
+
+    inventory_entries = fields["inventory_entries"]
+    if not inventory_entries:
+        logger.warning("No ALLINVENTORYENTRIESLIST tag found.")
+    for item_name, quantity, Rate in lines:
+        po_data["items"].append(InventoryLine(item_name=item_name, rate=Rate, qty=quantity))
+
+    if not po_data["items"]:
+        logger.warning(f"No valid items found for voucher '{party_ledger}'")
         return None
+    return po_data
 
 
-def get_purchase_orders_from_tally():
+def iter_purchase_orders_from_tally(watermark=None, pipeline=None, source=None):
+    """Stream Purchase Order vouchers from Tally, yielding one order dict at a time."""
     url = "TALLY_URL"
-    xml_request = """
-<ENVELOPE>
-    <HEADER>
-        <TALLYREQUEST>Export Data</TALLYREQUEST>
-    </HEADER>
-    <BODY>
-        <EXPORTDATA>
-            <REQUESTDESC>
-                <REPORTNAME>Voucher Register</REPORTNAME>
-                <STATICVARIABLES>
-                    <VOUCHERTYPENAME>Purchase Order</VOUCHERTYPENAME>
-                </STATICVARIABLES>
-            </REQUESTDESC>
-        </EXPORTDATA>
-    </BODY>
-</ENVELOPE>
-    """
-    headers = {"Content-Type": "text/xml"}
-    try:
-        response = requests.post(url, data=xml_request, headers=headers, timeout=10)
-        if response.status_code == 200:
-            raw_xml = response.text
-            cleaned_xml = normalize_and_clean_xml(raw_xml)
-
-            if cleaned_xml:
-                root = ET.fromstring(cleaned_xml)
-                purchase_orders = []
-
-                for voucher in root.findall(".//VOUCHER"):
-                   
-                    party_ledger_tag = voucher.find(".//PARTYLEDGERNAME")
-                    party_ledger = (
-                        party_ledger_tag.text.strip()
-                        if party_ledger_tag is not None and party_ledger_tag.text
-                        else "Unknown Supplier"
-                    )
-                    print(f"\nProcessing Voucher for Supplier: {party_ledger}")
-                   
-                    voucher_number_tag = voucher.find(".//VOUCHERNUMBER")
-                    voucher_no = voucher_number_tag.text.strip()
-
-                    date_tag = voucher.find(".//DATE")
-                    date = date_tag.text.strip()
-                    if date:
-                       date = datetime.strptime(date, "%Y%m%d").strftime("%Y-%m-%d")
-
-                    due_date_tag = voucher.find(".//ORDERDUEDATE")
-                    due_date = due_date_tag.text.strip()
-                    if due_date:
-                        due_date = datetime.strptime(due_date, "%d-%b-%y").strftime("%Y-%m-%d")
-
-                    
-                    po_data = {
-                        "custom_ref_no": voucher_no,
-                        "transaction_date":date,
-                        "schedule_date":due_date,
-                        "party_ledger": party_ledger, 
-                        "items": []
-                        }
-
-                   
-                    inventory_entries = voucher.findall(".//ALLINVENTORYENTRIES.LIST")
-                    if not inventory_entries:
-                        print(" - Warning: No ALLINVENTORYENTRIESLIST tag found.")
-                    for entry in inventory_entries:
-                        item_name_tag = entry.find(".//STOCKITEMNAME")
-                        if item_name_tag is not None and item_name_tag.text:
-                            item_name = item_name_tag.text.strip()
-                        rate_tag = entry.find(".//RATE")
-                        if rate_tag is not None and rate_tag.text:
-                            Rate = rate_tag.text.strip()
-                        quantity_tag = entry.find(".//ACTUALQTY")
-                        if quantity_tag is not None and quantity_tag.text:
-                            quantity = quantity_tag.text.strip()
-                    
-                        po_data["items"].append({"item_name": item_name,"rate":Rate,"qty":quantity})
-                    
-                    if po_data["items"]:
-                        purchase_orders.append(po_data)
-                    else:
-                        print(f" - No valid items found for voucher '{party_ledger}'")
-
-                return purchase_orders
-            else:
-                print("Failed to clean and parse XML from Tally.")
-        else:
-            print(f"Failed to connect to Tally. Status code: {response.status_code}")
-    except requests.exceptions.RequestException as e:
-        print(f"Error connecting to Tally: {e}")
-    return []
+    xml_request = voucher_request("Purchase Order", PURCHASE_ORDER_FIELDS, {"due_date": ORDER_DUE_DATE})
+    vouchers = stream_voucher_register(url, xml_request, VOUCHER_SANITISER, watermark, timeout=10, pipeline=pipeline,
+                                      doctype="Purchase Order", source=source)
+    fields = extract_fields(vouchers, PURCHASE_ORDER_FIELDS, "Purchase Order", watermark)
+    yield from transform_inventory_vouchers(fields, build_purchase_order, "Purchase Order")
 
 
-def add_purchase_order_to_erpnext(purchase_order):
-    erpnext_endpoint = "ERP_URL/api/resource/Purchase Order"
-    headers = {
-        "Authorization": "token API KEY:API SECRET",
-        "Content-Type": "application/json",
-    }
+def get_purchase_orders_from_tally(watermark=None, source=None):
+    return list(iter_purchase_orders_from_tally(watermark, source=source))
 
-    data = {
+
+def build_purchase_order_payload(purchase_order):
+    return {
         "custom_ref_no":purchase_order.get("custom_ref_no"),
         "supplier": purchase_order.get("party_ledger"),
         "transaction_date":purchase_order.get("transaction_date"),
@@ -149,46 +95,70 @@ def add_purchase_order_to_erpnext(purchase_order):
                 "item_code": item["item_name"],
                 "custom_content": "Set",
                 "schedule_date": purchase_order.get("schedule_date"),
-                "qty": item["qty"],
-                "rate": item["rate"]
+                "qty": plain(item["qty"]),
+                "rate": plain(item["rate"])
             }
             for item in purchase_order.get("items", [])
         ],
     }
 
+
+def add_purchase_order_to_erpnext(purchase_order):
+    erpnext_endpoint = "ERP_URL/api/resource/Purchase Order"
+    headers = {
+        "Authorization": "token API KEY:API SECRET",
+        "Content-Type": "application/json",
+    }
+
+    data = build_purchase_order_payload(purchase_order)
+
+    doc_name = None
     try:
-        response = requests.post(erpnext_endpoint, headers=headers, json=data)
+        response = erp_session().post(erpnext_endpoint, headers=headers, json=data)
         response.raise_for_status()
-        print(f"Successfully added Purchase Order '{purchase_order.get('party_ledger')}' to ERPNext.")
+        logger.debug(f"Successfully added Purchase Order '{purchase_order.get('party_ledger')}' to ERPNext.")
+        doc_name = response.json().get("data", {}).get("name")
+        remember("Purchase Order", purchase_order.get("custom_ref_no"), doc_name)
     except requests.exceptions.HTTPError as err:
-        print(f"Failed to add Purchase Order '{purchase_order.get('party_ledger')}' to ERPNext: {err}")
+        logger.warning(f"Failed to add Purchase Order '{purchase_order.get('party_ledger')}' to ERPNext: {err}")
+        if is_transient(err):
+            raise
     try:
         response_json = response.json()  
         if "_server_messages" in response_json:
             server_message = response_json["_server_messages"]
-            print(f"Error Message: {server_message}")
+            logger.warning(f"Error Message: {server_message}")
         else:
-            print("No server messages found in the response.")
+            logger.debug("No server messages found in the response.")
     except ValueError:
-        print("Response is not in JSON format.")
+        logger.warning("Response is not in JSON format.")
     except Exception as err:
-        print(f"Error occurred while adding Purchase Order '{purchase_order.get('party_ledger')}' to ERPNext: {err}")
-
+        logger.warning(f"Error occurred while adding Purchase Order '{purchase_order.get('party_ledger')}' to ERPNext: {err}")
+    return doc_name
 
-def sync_purchase_orders():
-    print("Fetching Purchase Orders from Tally Prime...")
-    purchase_orders = get_purchase_orders_from_tally()
 
-    if not purchase_orders:
-        print("No purchase orders to sync.")
-        return
+def sync_purchase_orders(max_workers=None, full=False, records=None, watermark=None):
+    watermark = watermark or Watermark("Purchase Order", full)
+    pipeline = new_pipeline(records)
+    if records is None:
+        logger.info("Fetching Purchase Orders from Tally Prime...")
+        records = run_stage(pipeline, "parse", iter_purchase_orders_from_tally(watermark, pipeline))
+    ledger = SyncLedger()
+    push = ledger_push(ledger, "Purchase Order", itemgetter("custom_ref_no"), add_purchase_order_to_erpnext)
+    results = push_records(records, push, max_workers, label="Purchase Order")
+    if pipeline is not None:
+        pipeline.report()
+    ledger.close()
 
-    print(f"\nFound {len(purchase_orders)} Purchase Order(s) to sync.\n")
+    if not results:
+        logger.info("No purchase orders to sync.")
+        return results
 
-    for idx, purchase_order in enumerate(purchase_orders, start=1):
-        print(f"Syncing Purchase Order {idx}...")
-        add_purchase_order_to_erpnext(purchase_order)
+    watermark.commit(results.ok)
+    summarise(results, "Purchase Order(s)", "Purchase Order")
+    return results
 
 
 if __name__ == "__main__":
+    metrics.setup_logging()
     sync_purchase_orders()
\ No newline at end of file
@@ -0,0 +1,129 @@
+import logging
+import threading
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# 1 keeps the original one-request-at-a-time behaviour. Raise it (ERPNext
+# clusters typically absorb 16-32 concurrent inserts) to push in parallel.
+MAX_WORKERS = 1
+
+PushResult = namedtuple("PushResult", ["index", "result", "error"])
+
+
+class Rejected(Exception):
+    """Raised by a push for a record that cannot be synced as it stands.
+
+    It counts as a failure but, like a rejection from ERPNext, does not hold
+    the watermark back: only an edit in Tally can fix it.
+    """
+
+
+class PushResults:
+    """Outcome of pushing a stream of records.
+
+    Only counters and the failed PushResults are kept, so memory does not
+    grow with the size of the export. A push that returned nothing or
+    raised is a failure; `ok` is False once any push raised something other
+    than Rejected, which is what holds a watermark back. The add_* and
+    update_* functions return None when ERPNext rejects a document and
+    raise on connection errors and http_client.TRANSIENT_STATUSES.
+    """
+
+    def __init__(self):
+        self.total = 0
+        self.pushed = 0
+        self.rejected = 0
+        self.errors = 0
+        self.failures = []
+        self._lock = threading.Lock()
+
+    def add(self, result):
+        with self._lock:
+            self.total += 1
+            if result.error is None and result.result:
+                self.pushed += 1
+                return
+            if isinstance(result.error, Rejected):
+                self.rejected += 1
+            elif result.error is not None:
+                self.errors += 1
+            self.failures.append(result)
+
+    def merge(self, other, indexes=None):
+        """Add the results of a sub-push; `indexes` maps its 1-based indexes back to ours."""
+        with self._lock:
+            self.total += other.total
+            self.pushed += other.pushed
+            self.rejected += other.rejected
+            self.errors += other.errors
+            for result in other.failures:
+                self.failures.append(result._replace(index=indexes[result.index - 1]) if indexes else result)
+
+    @property
+    def failed(self):
+        return self.total - self.pushed
+
+    @property
+    def ok(self):
+        return self.errors == 0
+
+    def __len__(self):
+        return self.total
+
+
+def _push_one(push, index, record, label):
+    if label:
+        logger.debug(f"Syncing {label} {index}...")
+    try:
+        return PushResult(index, push(record), None)
+    except Rejected as err:
+        logger.warning(f"Could not sync {label or 'record'} {index}: {err}")
+        return PushResult(index, None, err)
+    except Exception as err:
+        logger.warning(f"Error occurred while syncing {label or 'record'} {index}: {err}")
+        return PushResult(index, None, err)
+
+
+def push_records(records, push, max_workers=None, label=None):
+    """Call push(record) for every record and return their PushResults.
+
+    `records` may be any iterable, including a streaming generator. At most
+    2 * max_workers records are taken from it ahead of the workers, so memory
+    stays bounded. Failures are listed in input order. Every push has
+    finished by the time this returns, so calling the sync_* functions one
+    after another still pushes invoices before the payments that reference
+    them.
+    """
+    max_workers = max_workers or MAX_WORKERS
+    results = PushResults()
+    if max_workers <= 1:
+        for index, record in enumerate(records, start=1):
+            results.add(_push_one(push, index, record, label))
+        return results
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        in_flight = set()
+        for index, record in enumerate(records, start=1):
+            if len(in_flight) >= max_workers * 2:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results.add(future.result())
+            in_flight.add(executor.submit(_push_one, push, index, record, label))
+        for future in wait(in_flight).done:
+            results.add(future.result())
+    results.failures.sort(key=lambda result: result.index)
+    return results
+
+
+def summarise(results, label, doctype=None):
+    if doctype:
+        metrics.record_results(doctype, results)
+    if results.rejected:
+        logger.info(f"{label}: {results.pushed} pushed, {results.rejected} rejected, "
+                    f"{results.failed - results.rejected} skipped or failed.")
+    else:
+        logger.info(f"{label}: {results.pushed} pushed, {results.failed} skipped or failed.")
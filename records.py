@@ -0,0 +1,146 @@
+"""Record types for what the parsers pull out of Tally.
+
+Each record keeps its values in __slots__ instead of a per-record dict and
+behaves like the dict it replaces (record["qty"], record.get(...), `in`,
+keys(), dict(record)), so payload builders, itemgetter keys and the sync
+ledger work on records and on the stored dicts of earlier runs alike. Only
+the keys a parser sets are present. Numeric fields are parsed to Decimal
+once, on assignment; text that is not a number is kept as it is. The same
+quantities, rates, item and party names recur across thousands of lines, so
+records share one Decimal per distinct text and intern their name fields.
+
+A Decimal prints as the text it was parsed from, so a record normalises
+(sync_ledger.normalise) to the same JSON, and the same content hash, as the
+dict it replaces. Use plain() when building ERPNext payloads.
+"""
+import sys
+from decimal import Decimal, InvalidOperation
+
+# Decimals are immutable, so equal texts can share one; bounded for long runs.
+DECIMAL_CACHE_SIZE = 65536
+_decimals = {}
+
+
+def to_decimal(value):
+    if value is None or isinstance(value, Decimal):
+        return value
+    number = _decimals.get(value)
+    if number is not None:
+        return number
+    try:
+        number = Decimal(value)
+    except (InvalidOperation, TypeError, ValueError):
+        return value
+    if len(_decimals) >= DECIMAL_CACHE_SIZE:
+        _decimals.clear()
+    _decimals[value] = number
+    return number
+
+
+def plain(value):
+    """A record value as it goes into an ERPNext payload (Decimals as their text)."""
+    return str(value) if isinstance(value, Decimal) else value
+
+
+class Record:
+    __slots__ = ()
+    # Fields parsed to Decimal on assignment.
+    numeric = ()
+    # Text fields whose values repeat across records (names, warehouses), interned.
+    shared = ()
+
+    def __init__(self, **values):
+        for key, value in values.items():
+            self[key] = value
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        if key in self.numeric:
+            value = to_decimal(value)
+        elif key in self.shared and type(value) is str:
+            value = sys.intern(value)
+        setattr(self, key, value)
+
+    def __getitem__(self, key):
+        if key in self.__slots__:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                pass
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return key in self.__slots__ and hasattr(self, key)
+
+    def keys(self):
+        return [key for key in self.__slots__ if hasattr(self, key)]
+
+    def _pairs(self):
+        return [(key, getattr(self, key)) for key in self.keys()]
+
+    # Voucher has an `items` field, which hides this method there; dict(record)
+    # and as_dict() work on every record.
+    def items(self):
+        return self._pairs()
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def as_dict(self):
+        return dict(self._pairs())
+
+    def __eq__(self, other):
+        if isinstance(other, Record):
+            return self.as_dict() == other.as_dict()
+        if isinstance(other, dict):
+            return self.as_dict() == other
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"{type(self).__name__}({', '.join(f'{key}={value!r}' for key, value in self._pairs())})"
+
+
+class Ledger(Record):
+    """A customer or supplier ledger."""
+    __slots__ = ("customer_name", "supplier_name", "pan", "gstin", "gst", "state", "address", "pincode")
+    shared = ("state",)
+
+
+class StockItem(Record):
+    __slots__ = ("item_name", "hsn_codes", "parent_group", "rate")
+    numeric = ("rate",)
+    shared = ("parent_group",)
+
+
+class InventoryLine(Record):
+    __slots__ = ("item_code", "item_name", "qty", "rate", "warehouse")
+    numeric = ("qty", "rate")
+    shared = ("item_code", "item_name", "warehouse")
+
+
+class BillAllocation(Record):
+    __slots__ = ("ref_no", "invoice_number", "allocated_amount")
+    numeric = ("allocated_amount",)
+
+
+class Voucher(Record):
+    """An invoice, order or payment voucher; `items` holds InventoryLines, `reff` BillAllocations."""
+    __slots__ = (
+        "custom_ref_no", "vch_no", "customer", "supplier", "party_ledger", "party_name",
+        "posting_date", "transaction_date", "date", "due_date", "delivery_date", "schedule_date",
+        "paid", "pay_type", "items", "reff",
+    )
+    numeric = ("paid",)
+    shared = ("customer", "supplier", "party_ledger", "party_name", "pay_type")
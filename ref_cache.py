@@ -0,0 +1,176 @@
+"""Persistent map from a Tally voucher number (custom_ref_no) to the ERPNext document name.
+
+Once ERPNext has created a document for a voucher its name does not change,
+so payment allocations are resolved from this cache before ERPNext is
+asked. Lookups and the add_*_to_erpnext functions fill it. A document that
+is cancelled or amended in ERPNext must be invalidated, either with
+invalidate() or from the command line:
+
+    python ref_cache.py invalidate "Sales Invoice" 1042 1043
+    python ref_cache.py clear "Sales Invoice"
+"""
+import argparse
+import sqlite3
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+from erpnext_index import fetch_names_by_field
+
+REF_CACHE_FILE = "ref_cache.sqlite3"
+# Entries kept in memory in front of the SQLite file.
+LRU_SIZE = 10000
+# Cancelled documents (docstatus 2) are never resolved or cached, so an
+# invalidated ref_no resolves to its amendment on the next lookup.
+LIVE_FILTERS = [["docstatus", "!=", 2]]
+
+_cache = None
+_lock = threading.Lock()
+
+
+class RefCache:
+    """(doctype, ref_no) -> ERPNext name, in SQLite with an in-memory LRU front."""
+
+    def __init__(self, path=None, size=None):
+        self.path = path or REF_CACHE_FILE
+        self.size = size or LRU_SIZE
+        self._lock = threading.Lock()
+        self._lru = OrderedDict()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS ref_names (
+                doctype TEXT NOT NULL,
+                ref_no TEXT NOT NULL,
+                erp_name TEXT NOT NULL,
+                cached_at TEXT NOT NULL,
+                PRIMARY KEY (doctype, ref_no)
+            )"""
+        )
+        self._conn.commit()
+
+    def _remember(self, key, erp_name):
+        self._lru[key] = erp_name
+        self._lru.move_to_end(key)
+        if len(self._lru) > self.size:
+            self._lru.popitem(last=False)
+
+    def get_many(self, doctype, ref_nos):
+        """Return {ref_no: erp_name} for the ref_nos that are cached."""
+        names = {}
+        missing = []
+        with self._lock:
+            for ref_no in ref_nos:
+                key = (doctype, str(ref_no))
+                if key in self._lru:
+                    self._lru.move_to_end(key)
+                    names[ref_no] = self._lru[key]
+                else:
+                    missing.append(ref_no)
+            for start in range(0, len(missing), 500):
+                chunk = [str(ref_no) for ref_no in missing[start:start + 500]]
+                rows = self._conn.execute(
+                    f"SELECT ref_no, erp_name FROM ref_names WHERE doctype = ? AND ref_no IN ({','.join('?' * len(chunk))})",
+                    [doctype, *chunk],
+                ).fetchall()
+                for ref_no, erp_name in rows:
+                    self._remember((doctype, ref_no), erp_name)
+                    names[ref_no] = erp_name
+        return names
+
+    def get(self, doctype, ref_no):
+        return self.get_many(doctype, [ref_no]).get(ref_no)
+
+    def put_many(self, doctype, names):
+        if not names:
+            return
+        now = datetime.now().isoformat()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO ref_names (doctype, ref_no, erp_name, cached_at) VALUES (?, ?, ?, ?)",
+                [(doctype, str(ref_no), erp_name, now) for ref_no, erp_name in names.items()],
+            )
+            self._conn.commit()
+            for ref_no, erp_name in names.items():
+                self._remember((doctype, str(ref_no)), erp_name)
+
+    def put(self, doctype, ref_no, erp_name):
+        if ref_no and erp_name:
+            self.put_many(doctype, {ref_no: erp_name})
+
+    def invalidate(self, doctype, ref_nos=None):
+        """Drop the given ref_nos of `doctype`, or all of them when ref_nos is None."""
+        with self._lock:
+            if ref_nos is None:
+                self._conn.execute("DELETE FROM ref_names WHERE doctype = ?", (doctype,))
+                for key in [key for key in self._lru if key[0] == doctype]:
+                    del self._lru[key]
+            else:
+                for ref_no in ref_nos:
+                    self._conn.execute(
+                        "DELETE FROM ref_names WHERE doctype = ? AND ref_no = ?", (doctype, str(ref_no))
+                    )
+                    self._lru.pop((doctype, str(ref_no)), None)
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def ref_cache():
+    """Return the shared RefCache, opening REF_CACHE_FILE on first use."""
+    global _cache
+    if _cache is None:
+        with _lock:
+            if _cache is None:
+                _cache = RefCache()
+    return _cache
+
+
+def close_ref_cache():
+    global _cache
+    with _lock:
+        if _cache is not None:
+            _cache.close()
+            _cache = None
+
+
+def remember(doctype, ref_no, erp_name):
+    """Record the name ERPNext gave the document created for ref_no."""
+    ref_cache().put(doctype, ref_no, erp_name)
+
+
+def invalidate(doctype, ref_nos=None):
+    """Forget cached names after documents were cancelled or amended in ERPNext."""
+    ref_cache().invalidate(doctype, ref_nos)
+
+
+def resolve_ref_nos(doctype, ref_nos):
+    """Map ref_nos to `doctype` names, asking ERPNext only for those not cached."""
+    cache = ref_cache()
+    ref_nos = list(dict.fromkeys(ref_no for ref_no in ref_nos if ref_no))
+    names = cache.get_many(doctype, ref_nos)
+    missing = [ref_no for ref_no in ref_nos if ref_no not in names]
+    if missing:
+        fetched = fetch_names_by_field(doctype, "custom_ref_no", missing, filters=LIVE_FILTERS)
+        cache.put_many(doctype, fetched)
+        names.update(fetched)
+    return names
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("action", choices=["invalidate", "clear"])
+    parser.add_argument("doctype")
+    parser.add_argument("ref_nos", nargs="*")
+    args = parser.parse_args()
+    if args.action == "invalidate" and not args.ref_nos:
+        parser.error("invalidate needs at least one ref_no; use clear to drop a whole doctype")
+    invalidate(args.doctype, args.ref_nos if args.action == "invalidate" else None)
+    close_ref_cache()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,145 +1,96 @@
+import logging
 import requests
-import xml.etree.ElementTree as ET
-import re
 from datetime import datetime
-
-
-def clean_unwanted_characters(xml_data):
-    fixed_xml = re.sub(r'(\s)([a-zA-Z0-9_-]+)\s*=\s*([a-zA-Z0-9_-]+)', r'\1"\2"="\3"', xml_data)
-    cleaned_data = re.sub(r'[^a-zA-Z0-9\s<>\-="/:.]', '', fixed_xml)
-    return cleaned_data
-
-
-def preserve_numeric_format(xml_data):
-    numeric_pattern = re.compile(r'\d+\.\d+(/[a-zA-Z]*)?')
-    def replace_invalid_chars(match):
-        return match.group(0)
-    cleaned_data = numeric_pattern.sub(replace_invalid_chars, xml_data)
-    return cleaned_data
-
-
-def modify_rate_and_quantity(xml_data):
-    xml_data = re.sub(r'(<RATE[^>]*>)([\d\.]+)(/no)(</RATE>)', r'\1\2\4', xml_data)
-    xml_data = re.sub(r'(<ACTUALQTY[^>]*>\s*)([\d\.]+)\s*no(</ACTUALQTY>)', r'\1\2\3', xml_data)
-    return xml_data
-
-
-def normalize_and_clean_xml(xml_data):
-    cleaned_xml = clean_unwanted_characters(xml_data)
-    cleaned_xml = preserve_numeric_format(cleaned_xml)
-    cleaned_xml = modify_rate_and_quantity(cleaned_xml)
-    
-    try:
-        root = ET.fromstring(cleaned_xml)
-        cleaned_string = ET.tostring(root, encoding="unicode", method="xml").replace("\n", "").replace("\r", "").strip()
-        return cleaned_string
-    except ET.ParseError as e:
-        print("Error parsing XML:", e)
+from operator import itemgetter
+
+from batch_transform import extract_fields, transform_inventory_vouchers
+from field_plan import INVENTORY_ENTRY_FIELDS, LEDGER_AMOUNT_FIELDS, Field, FieldPlan, Group
+from http_client import erp_session, is_transient
+import metrics
+from pipeline import new_pipeline, run_stage
+from push_pool import push_records, summarise
+from records import InventoryLine, Voucher, plain
+from ref_cache import remember
+from sanitiser import VOUCHER_SANITISER
+from sync_ledger import SyncLedger, ledger_push
+from tally_envelope import COMPANY, ORDER_DUE_DATE, voucher_request
+from tally_stream import stream_voucher_register
+from watermark import Watermark
+
+logger = logging.getLogger(__name__)
+
+# Create invoices with docstatus 1 in a single POST. If ERPNext refuses to
+# submit it (a validation error, SUBMIT_REJECTED_STATUSES), the invoice is
+# created as a draft and submitted with a second request. Any other error,
+# e.g. a duplicate (409) or a server error, fails the push as it is.
+SUBMIT_ON_CREATE = True
+SUBMIT_REJECTED_STATUSES = (417,)
+
+SALES_INVOICE_FIELDS = FieldPlan(
+    [
+        Field(".//PARTYLEDGERNAME", "customer"),
+        Field(".//VOUCHERNUMBER", "voucher_no"),
+        Field(".//DATE", "date"),
+        Field(".//ORDERDUEDATE", "due_date"),
+    ],
+    [
+        Group(".//ALLINVENTORYENTRIES.LIST", "inventory_entries", INVENTORY_ENTRY_FIELDS),
+        Group(".//ALLLEDGERENTRIES.LIST", "ledger_entries", LEDGER_AMOUNT_FIELDS),
+    ],
+)
+
+
+def build_sales_invoice(fields, lines):
+    customer_name = fields["customer"].strip() if fields.get("customer") else "Unknown Customer"
+    logger.debug(f"Processing Sales Invoice for Customer: {customer_name}")
+
+    voucher_no = fields.get("voucher_no").strip()
+
+    date = fields.get("date").strip()
+    if date:
+       date = datetime.strptime(date, "%Y%m%d").strftime("%Y-%m-%d")
+
+    due_date = fields.get("due_date").strip()
+    if due_date:
+        due_date = datetime.strptime(due_date, "%d-%b-%y").strftime("%Y-%m-%d")
+
+    invoice_data = Voucher(
+        custom_ref_no=voucher_no,
+        customer=customer_name,
+        posting_date=date,
+        due_date=due_date,
+        items=[]
+    )
+
+    inventory_entries = fields["inventory_entries"]
+    if not inventory_entries:
+        logger.warning("No ALLINVENTORYENTRIESLIST tag found.")
+    for item_name, quantity, Rate in lines:
+        invoice_data["items"].append(InventoryLine(item_code=item_name, qty=quantity, rate=Rate))    
+
+    if not invoice_data["items"]:
+        logger.warning(f"No valid items found for customer '{customer_name}'")
         return None
+    return invoice_data
 
 
-def get_sales_invoices_from_tally():
+def iter_sales_invoices_from_tally(watermark=None, pipeline=None, source=None):
+    """Stream Sales vouchers from Tally, yielding one invoice dict at a time."""
     url = "TALLY_URL"
-    xml_request = """
-<ENVELOPE>
-        <HEADER>
-        <TALLYREQUEST>Export Data</TALLYREQUEST>
-        </HEADER>
-        <BODY>
-        <EXPORTDATA>
-        <REQUESTDESC>
-        <STATICVARIABLES>
-        <SVCURRENTCOMPANY>$etca_name</SVCURRENTCOMPANY>
-        <SHOWCREATEDBY>YES</SHOWCREATEDBY>
-        <SHOWPARTYNAME>YES</SHOWPARTYNAME>
-        <VOUCHERTYPENAME>Sales</VOUCHERTYPENAME>
-        </STATICVARIABLES>
-        <REPORTNAME>Voucher Register</REPORTNAME>
-        </REQUESTDESC>
-        </EXPORTDATA>
-        </BODY>
-</ENVELOPE>
-    """
-    headers = {"Content-Type": "text/xml"}
-    try:
-        response = requests.post(url, data=xml_request, headers=headers, timeout=10)
-        if response.status_code == 200:
-            raw_xml = response.text
-            cleaned_xml = normalize_and_clean_xml(raw_xml)
-
-            if cleaned_xml:
-                root = ET.fromstring(cleaned_xml)
-                sales_invoices = []
-
-                for voucher in root.findall(".//VOUCHER"):
-                    customer_tag = voucher.find(".//PARTYLEDGERNAME")
-                    customer_name = (
-                        customer_tag.text.strip()
-                        if customer_tag is not None and customer_tag.text
-                        else "Unknown Customer"
-                    )
-                    print(f"\nProcessing Sales Invoice for Customer: {customer_name}")
-
-                    voucher_number_tag = voucher.find(".//VOUCHERNUMBER")
-                    voucher_no = voucher_number_tag.text.strip()
-                    
-                    date_tag = voucher.find(".//DATE")
-                    date = date_tag.text.strip()
-                    if date:
-                       date = datetime.strptime(date, "%Y%m%d").strftime("%Y-%m-%d")
-
-                    due_date_tag = voucher.find(".//ORDERDUEDATE")
-                    due_date = due_date_tag.text.strip()
-                    if due_date:
-                        due_date = datetime.strptime(due_date, "%d-%b-%y").strftime("%Y-%m-%d")
-
-                    invoice_data = {
-                        "custom_ref_no": voucher_no,
-                        "customer": customer_name,
-                        "posting_date": date,
-                        "due_date": due_date,
-                        "items": []
-                    }
-
-                    inventory_entries = voucher.findall(".//ALLINVENTORYENTRIES.LIST")
-                    if not inventory_entries:
-                        print(" - Warning: No ALLINVENTORYENTRIESLIST tag found.")
-                    for entry in inventory_entries:
-                        item_name_tag = entry.find(".//STOCKITEMNAME")
-                        if item_name_tag is not None and item_name_tag.text:
-                            item_name = item_name_tag.text.strip()
-                        rate_tag = entry.find(".//RATE")
-                        if rate_tag is not None and rate_tag.text:
-                            Rate = rate_tag.text.strip()
-                        quantity_tag = entry.find(".//ACTUALQTY")
-                        if quantity_tag is not None and quantity_tag.text:
-                            quantity = quantity_tag.text.strip()
-
-                        invoice_data["items"].append({"item_code": item_name, "qty": quantity, "rate": Rate})    
-
-                    if invoice_data["items"]:
-                        sales_invoices.append(invoice_data)
-                    else:
-                        print(f" - No valid items found for customer '{customer_name}'")
-
-                return sales_invoices
-            else:
-                print("Failed to clean and parse XML from Tally.")
-        else:
-            print(f"Failed to connect to Tally. Status code: {response.status_code}")
-    except requests.exceptions.RequestException as e:
-        print(f"Error connecting to Tally: {e}")
-    return []
+    xml_request = voucher_request("Sales", SALES_INVOICE_FIELDS, {"due_date": ORDER_DUE_DATE},
+                                  static_variables=COMPANY)
+    vouchers = stream_voucher_register(url, xml_request, VOUCHER_SANITISER, watermark, timeout=10, pipeline=pipeline,
+                                      doctype="Sales Invoice", source=source)
+    fields = extract_fields(vouchers, SALES_INVOICE_FIELDS, "Sales Invoice", watermark)
+    yield from transform_inventory_vouchers(fields, build_sales_invoice, "Sales Invoice")
 
 
-def add_sales_invoice_to_erpnext(sales_invoice):
-    erpnext_endpoint = "ERP_URL/api/resource/Sales Invoice"
-    headers = {
-        "Authorization": "token API KEY:API SECRET",
-        "Content-Type": "application/json",
-    }
+def get_sales_invoices_from_tally(watermark=None, source=None):
+    return list(iter_sales_invoices_from_tally(watermark, source=source))
+
 
-    data = {
+def build_sales_invoice_payload(sales_invoice):
+    return {
         "custom_ref_no": sales_invoice.get("custom_ref_no"),
         "customer": sales_invoice.get("customer"),
         "posting_date": sales_invoice.get("posting_date"),
@@ -147,60 +98,112 @@ def add_sales_invoice_to_erpnext(sales_invoice):
         "items": [
             {
                 "item_code": item["item_code"],
-                "qty": item["qty"],
-                "rate": item["rate"],
+                "qty": plain(item["qty"]),
+                "rate": plain(item["rate"]),
             }
             for item in sales_invoice.get("items", [])
         ],
     }
 
+
+def delete_draft_sales_invoice(endpoint, invoice_name, headers):
+    """Delete a draft whose submit failed, so a later run does not leave another one next to it."""
+    try:
+        response = erp_session().delete(f"{endpoint}/{invoice_name}", headers=headers)
+        response.raise_for_status()
+        logger.info(f"Deleted draft Sales Invoice {invoice_name} after its submit failed.")
+    except requests.exceptions.RequestException as err:
+        logger.warning(f"Could not delete draft Sales Invoice {invoice_name} after its submit failed, delete it in ERPNext: {err}")
+
+
+def add_sales_invoice_to_erpnext(sales_invoice):
+    erpnext_endpoint = "ERP_URL/api/resource/Sales Invoice"
+    headers = {
+        "Authorization": "token API KEY:API SECRET",
+        "Content-Type": "application/json",
+    }
+
+    data = build_sales_invoice_payload(sales_invoice)
+
+    doc_name = None
     try:
-        response = requests.post(erpnext_endpoint, headers=headers, json=data)
+        submitted = False
+        if SUBMIT_ON_CREATE:
+            response = erp_session().post(erpnext_endpoint, headers=headers, json=dict(data, docstatus=1))
+            submitted = response.ok
+            if response.status_code in SUBMIT_REJECTED_STATUSES:
+                logger.warning(f"Sales Invoice for '{sales_invoice.get('customer')}' was rejected when submitted on create ({response.status_code}), retrying as draft and submit...")
+            elif not submitted:
+                response.raise_for_status()
+        if not submitted:
+            response = erp_session().post(erpnext_endpoint, headers=headers, json=data)
         response.raise_for_status()
 
         invoice_name = response.json().get("data", {}).get("name")
         if not invoice_name:
-            print(f"Failed to fetch the Sales Invoice name for customer '{sales_invoice.get('customer')}'.")
+            logger.warning(f"Failed to fetch the Sales Invoice name for customer '{sales_invoice.get('customer')}'.")
             return
 
-        submit_endpoint = f"{erpnext_endpoint}/{invoice_name}"
-        submit_response = requests.put(
-            submit_endpoint, 
-            headers=headers, 
-            json={"docstatus": 1}  
-        )
-        submit_response.raise_for_status()
-        print(f"Successfully added and submitted Sales Invoice for '{sales_invoice.get('customer')}' to ERPNext.")
+        if not submitted:
+            submit_endpoint = f"{erpnext_endpoint}/{invoice_name}"
+            try:
+                submit_response = erp_session().put(
+                    submit_endpoint, 
+                    headers=headers, 
+                    json={"docstatus": 1}  
+                )
+            except requests.exceptions.RequestException:
+                # ERPNext refuses to delete the invoice if the submit went through after all.
+                delete_draft_sales_invoice(erpnext_endpoint, invoice_name, headers)
+                raise
+            if not submit_response.ok:
+                response = submit_response
+                delete_draft_sales_invoice(erpnext_endpoint, invoice_name, headers)
+            submit_response.raise_for_status()
+        logger.debug(f"Successfully added and submitted Sales Invoice for '{sales_invoice.get('customer')}' to ERPNext.")
+        doc_name = invoice_name
+        remember("Sales Invoice", sales_invoice.get("custom_ref_no"), doc_name)
 
     except requests.exceptions.HTTPError as err:
-        print(f"Failed to add or submit Sales Invoice for '{sales_invoice.get('customer')}' to ERPNext: {err}")
+        logger.warning(f"Failed to add or submit Sales Invoice for '{sales_invoice.get('customer')}' to ERPNext: {err}")
+        if is_transient(err):
+            raise
     try:
         response_json = response.json()  
         if "_server_messages" in response_json:
             server_message = response_json["_server_messages"]
-            print(f"Error Message: {server_message}")
+            logger.warning(f"Error Message: {server_message}")
         else:
-            print("No server messages found in the response.")
+            logger.debug("No server messages found in the response.")
     except ValueError:
-        print("Response is not in JSON format.")
+        logger.warning("Response is not in JSON format.")
     except Exception as err:
-        print(f"Error occurred while adding or submitting Sales Invoice for '{sales_invoice.get('customer')}' to ERPNext: {err}")
-
+        logger.warning(f"Error occurred while adding or submitting Sales Invoice for '{sales_invoice.get('customer')}' to ERPNext: {err}")
+    return doc_name
 
-def sync_sales_invoices():
-    print("Fetching Sales Invoices from Tally Prime...")
-    sales_invoices = get_sales_invoices_from_tally()
 
-    if not sales_invoices:
-        print("No sales invoices to sync.")
-        return
+def sync_sales_invoices(max_workers=None, full=False, records=None, watermark=None):
+    watermark = watermark or Watermark("Sales Invoice", full)
+    pipeline = new_pipeline(records)
+    if records is None:
+        logger.info("Fetching Sales Invoices from Tally Prime...")
+        records = run_stage(pipeline, "parse", iter_sales_invoices_from_tally(watermark, pipeline))
+    ledger = SyncLedger()
+    push = ledger_push(ledger, "Sales Invoice", itemgetter("custom_ref_no"), add_sales_invoice_to_erpnext)
+    results = push_records(records, push, max_workers, label="Sales Invoice")
+    if pipeline is not None:
+        pipeline.report()
+    ledger.close()
 
-    print(f"\nFound {len(sales_invoices)} Sales Invoice(s) to sync.\n")
+    if not results:
+        logger.info("No sales invoices to sync.")
+        return results
 
-    for idx, sales_invoice in enumerate(sales_invoices, start=1):
-        print(f"Syncing Sales Invoice {idx}...")
-        add_sales_invoice_to_erpnext(sales_invoice)
+    watermark.commit(results.ok)
+    summarise(results, "Sales Invoice(s)", "Sales Invoice")
+    return results
 
 
 if __name__ == "__main__":
+    metrics.setup_logging()
     sync_sales_invoices()
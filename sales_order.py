@@ -1,151 +1,95 @@
+import logging
 import requests
-import xml.etree.ElementTree as ET
-import re
 from datetime import datetime
-
-
-def clean_unwanted_characters(xml_data):
-    fixed_xml = re.sub(r'(\s)([a-zA-Z0-9_-]+)\s*=\s*([a-zA-Z0-9_-]+)', r'\1"\2"="\3"', xml_data)
-    cleaned_data = re.sub(r'[^a-zA-Z0-9\s<>\-="/:.]', '', fixed_xml)
-    return cleaned_data
-
-
-def preserve_numeric_format(xml_data):
-    numeric_pattern = re.compile(r'\d+\.\d+(/[a-zA-Z]*)?')
-    def replace_invalid_chars(match):
-        return match.group(0) 
-    cleaned_data = numeric_pattern.sub(replace_invalid_chars, xml_data)
-    return cleaned_data
-
-
-def modify_rate_and_quantity(xml_data):
-    xml_data = re.sub(r'(<RATE[^>]*>)([\d\.]+)(/no)(</RATE>)', r'\1\2\4', xml_data)
-    xml_data = re.sub(r'(<ACTUALQTY[^>]*>\s*)([\d\.]+)\s*no(</ACTUALQTY>)', r'\1\2\3', xml_data)
-    return xml_data
-
-
-def normalize_and_clean_xml(xml_data):
-    cleaned_xml = clean_unwanted_characters(xml_data)
-    cleaned_xml = preserve_numeric_format(cleaned_xml)
-    cleaned_xml = modify_rate_and_quantity(cleaned_xml)
-    
-    try:
-        root = ET.fromstring(cleaned_xml)
-        cleaned_string = ET.tostring(root, encoding="unicode", method="xml").replace("\n", "").replace("\r", "").strip()
-        return cleaned_string
-    except ET.ParseError as e:
-        print("Error parsing XML:", e)
+from operator import itemgetter
+
+from batch_transform import extract_fields, transform_inventory_vouchers
+from field_plan import INVENTORY_ENTRY_FIELDS, LEDGER_AMOUNT_FIELDS, Field, FieldPlan, Group
+from http_client import erp_session, is_transient
+import metrics
+from pipeline import new_pipeline, run_stage
+from push_pool import push_records, summarise
+from records import InventoryLine, Voucher, plain
+from sanitiser import VOUCHER_SANITISER
+from sync_ledger import SyncLedger, ledger_push
+from tally_envelope import COMPANY, ORDER_DUE_DATE, voucher_request
+from tally_stream import stream_voucher_register
+from watermark import Watermark
+
+logger = logging.getLogger(__name__)
+
+SALES_ORDER_FIELDS = FieldPlan(
+    [
+        Field(".//PARTYNAME", "customer"),
+        Field(".//VOUCHERNUMBER", "voucher_no"),
+        Field(".//DATE", "date"),
+        Field(".//ORDERDUEDATE", "due_date"),
+    ],
+    [
+        Group(".//ALLINVENTORYENTRIES.LIST", "inventory_entries", INVENTORY_ENTRY_FIELDS),
+        Group(".//ALLLEDGERENTRIES.LIST", "ledger_entries", LEDGER_AMOUNT_FIELDS),
+    ],
+)
+
+
+def build_sales_order(fields, lines):
+    customer_name = fields["customer"].strip() if fields.get("customer") else "Unknown Customer"
+
+    voucher_no = fields.get("voucher_no").strip()
+
+    date = fields.get("date").strip()
+    if date:
+       date = datetime.strptime(date, "%Y%m%d").strftime("%Y-%m-%d")
+
+    delivery_date = fields.get("due_date").strip()
+    if delivery_date:
+        delivery_date = datetime.strptime(delivery_date, "%d-%b-%y").strftime("%Y-%m-%d")
+
+
+    order_data = Voucher(
+        custom_ref_no=voucher_no,
+        transaction_date=date,
+        delivery_date=delivery_date,
+        customer=customer_name, 
+        items=[]
+        )
+
+    inventory_entries = fields["inventory_entries"]
+    if not inventory_entries:
+        logger.warning("No ALLINVENTORYENTRIES.LIST tag found.")
+    for item_name, quantity, Rate in lines:
+        order_data["items"].append(
+            InventoryLine(
+                item_code=item_name,
+                qty=quantity,
+                rate=Rate,
+                warehouse="All Warehouses - SSL",
+            )
+        )
+
+    if not order_data["items"]:
+        logger.warning(f"No valid items found for customer '{customer_name}'")
         return None
+    return order_data
 
 
-def get_sales_orders_from_tally():
+def iter_sales_orders_from_tally(watermark=None, pipeline=None, source=None):
+    """Stream Sales Order vouchers from Tally, yielding one order dict at a time."""
     url = "TALLY_URL"
-    xml_request = """
-<ENVELOPE>
-        <HEADER>
-        <TALLYREQUEST>Export Data</TALLYREQUEST>
-        </HEADER>
-        <BODY>
-        <EXPORTDATA>
-        <REQUESTDESC>
-        <STATICVARIABLES>
-        <SVCURRENTCOMPANY>$etca_name</SVCURRENTCOMPANY>
-        <SHOWCREATEDBY>YES</SHOWCREATEDBY>
-        <SHOWPARTYNAME>YES</SHOWPARTYNAME>
-        <VOUCHERTYPENAME>Sales Order</VOUCHERTYPENAME>
-        </STATICVARIABLES>
-        <REPORTNAME>Voucher Register</REPORTNAME>
-        </REQUESTDESC>
-        </EXPORTDATA>
-        </BODY>
-</ENVELOPE>
-    """
-    headers = {"Content-Type": "text/xml"}
-    try:
-        response = requests.post(url, data=xml_request, headers=headers, timeout=10)
-        if response.status_code == 200:
-            raw_xml = response.text
-            cleaned_xml = normalize_and_clean_xml(raw_xml)
-
-            if cleaned_xml:
-                root = ET.fromstring(cleaned_xml)
-                sales_orders = []
-
-                for voucher in root.findall(".//VOUCHER"):
-                    customer_tag = voucher.find(".//PARTYNAME")
-                    customer_name = (
-                        customer_tag.text.strip()
-                        if customer_tag is not None and customer_tag.text
-                        else "Unknown Customer"
-                    )
-
-                    voucher_number_tag = voucher.find(".//VOUCHERNUMBER")
-                    voucher_no = voucher_number_tag.text.strip()
-                    
-                    date_tag = voucher.find(".//DATE")
-                    date = date_tag.text.strip()
-                    if date:
-                       date = datetime.strptime(date, "%Y%m%d").strftime("%Y-%m-%d")
-
-                    due_date_tag = voucher.find(".//ORDERDUEDATE")
-                    delivery_date = due_date_tag.text.strip()
-                    if delivery_date:
-                        delivery_date = datetime.strptime(delivery_date, "%d-%b-%y").strftime("%Y-%m-%d")
-
-
-                    order_data = {
-                        "custom_ref_no": voucher_no,
-                        "transaction_date":date,
-                        "delivery_date":delivery_date,
-                        "customer": customer_name, 
-                        "items": []
-                        }
-
-                    inventory_entries = voucher.findall(".//ALLINVENTORYENTRIES.LIST")
-                    if not inventory_entries:
-                        print(" - Warning: No ALLINVENTORYENTRIES.LIST tag found.")
-                    for entry in inventory_entries:
-                        item_name_tag = entry.find(".//STOCKITEMNAME")
-                        if item_name_tag is not None and item_name_tag.text:
-                            item_name = item_name_tag.text.strip()
-                        rate_tag = entry.find(".//RATE")
-                        if rate_tag is not None and rate_tag.text:
-                            Rate = rate_tag.text.strip()
-                        quantity_tag = entry.find(".//ACTUALQTY")
-                        if quantity_tag is not None and quantity_tag.text:
-                            quantity = quantity_tag.text.strip()
-                            
-                        order_data["items"].append(
-                            {
-                                "item_code": item_name,
-                                "qty": quantity,
-                                "rate": Rate,
-                                "warehouse": "All Warehouses - SSL",
-                            }
-                        )
-                    if order_data["items"]:
-                        sales_orders.append(order_data)
-                    else:
-                        print(f" - No valid items found for customer '{customer_name}'")
-
-                return sales_orders
-            else:
-                print("Failed to clean and parse XML from Tally.")
-        else:
-            print(f"Failed to connect to Tally. Status code: {response.status_code}")
-    except requests.exceptions.RequestException as e:
-        print(f"Error connecting to Tally: {e}")
-    return []
+    xml_request = voucher_request("Sales Order", SALES_ORDER_FIELDS, {"due_date": ORDER_DUE_DATE},
+                                  static_variables=COMPANY)
+    vouchers = stream_voucher_register(url, xml_request, VOUCHER_SANITISER, watermark, timeout=10, pipeline=pipeline,
+                                      doctype="Sales Order", source=source)
+    fields = extract_fields(vouchers, SALES_ORDER_FIELDS, "Sales Order", watermark)
+    yield from transform_inventory_vouchers(fields, build_sales_order, "Sales Order")
 
 
-def add_sales_order_to_erpnext(sales_order):
-    erpnext_endpoint = "ERP_URL/api/resource/Sales Order"
-    headers = {
-        "Authorization": "token API KEY:API SECRET",
-        "Content-Type": "application/json",
-    }
+def get_sales_orders_from_tally(watermark=None, source=None):
+    return list(iter_sales_orders_from_tally(watermark, source=source))
 
-    data = {
+
+def build_sales_order_payload(sales_order):
+    return {
         "doctype": "Sales Order",
         "custom_ref_no":sales_order.get("custom_ref_no"),
         "customer": sales_order.get("customer"),
@@ -156,47 +100,91 @@ def add_sales_order_to_erpnext(sales_order):
             {
                 "item_code": item["item_code"],
                 "delivery_date": sales_order.get("delivery_date"),
-                "qty": item["qty"],
-                "rate": item["rate"],
+                "qty": plain(item["qty"]),
+                "rate": plain(item["rate"]),
                 "warehouse": item["warehouse"],
             }
             for item in sales_order.get("items", [])
         ],
     }
 
+
+def add_sales_order_to_erpnext(sales_order):
+    erpnext_endpoint = "ERP_URL/api/resource/Sales Order"
+    headers = {
+        "Authorization": "token API KEY:API SECRET",
+        "Content-Type": "application/json",
+    }
+
+    data = build_sales_order_payload(sales_order)
+
+    doc_name = None
     try:
-        response = requests.post(erpnext_endpoint, headers=headers, json=data)
+        response = erp_session().post(erpnext_endpoint, headers=headers, json=data)
         response.raise_for_status()
-        print(f"Successfully added Sales Order for '{sales_order.get('customer')}' to ERPNext.")
+        logger.debug(f"Successfully added Sales Order for '{sales_order.get('customer')}' to ERPNext.")
+        doc_name = response.json().get("data", {}).get("name")
     except requests.exceptions.HTTPError as err:
-        print(f"Failed to add Sales Order for '{sales_order.get('customer')}' to ERPNext: {err}")
+        logger.warning(f"Failed to add Sales Order for '{sales_order.get('customer')}' to ERPNext: {err}")
+        if is_transient(err):
+            raise
     try:
         response_json = response.json()  
         if "_server_messages" in response_json:
             server_message = response_json["_server_messages"]
-            print(f"Error Message: {server_message}")
+            logger.warning(f"Error Message: {server_message}")
         else:
-            print("No server messages found in the response.")
+            logger.debug("No server messages found in the response.")
     except ValueError:
-        print("Response is not in JSON format.")
+        logger.warning("Response is not in JSON format.")
     except Exception as err:
-        print(f"Error occurred while adding Sales Order for '{sales_order.get('customer')}' to ERPNext: {err}")
+        logger.warning(f"Error occurred while adding Sales Order for '{sales_order.get('customer')}' to ERPNext: {err}")
+    return doc_name
+
 
+def update_sales_order_in_erpnext(sales_order, erp_name):
+    """Update a Sales Order previously pushed from Tally; only valid while it is not submitted."""
+    erpnext_endpoint = f"ERP_URL/api/resource/Sales Order/{erp_name}"
+    headers = {
+        "Authorization": "token API KEY:API SECRET",
+        "Content-Type": "application/json",
+    }
+    data = build_sales_order_payload(sales_order)
+
+    try:
+        response = erp_session().put(erpnext_endpoint, headers=headers, json=data)
+        response.raise_for_status()
+        logger.debug(f"Successfully updated Sales Order for '{sales_order.get('customer')}' in ERPNext.")
+        return erp_name
+    except requests.exceptions.HTTPError as err:
+        logger.warning(f"Failed to update Sales Order for '{sales_order.get('customer')}' in ERPNext: {err}")
+        if is_transient(err):
+            raise
+        return None
 
-def sync_sales_orders():
-    print("Fetching Sales Orders from Tally Prime...")
-    sales_orders = get_sales_orders_from_tally()
 
-    if not sales_orders:
-        print("No sales orders to sync.")
-        return
+def sync_sales_orders(max_workers=None, full=False, records=None, watermark=None):
+    watermark = watermark or Watermark("Sales Order", full)
+    pipeline = new_pipeline(records)
+    if records is None:
+        logger.info("Fetching Sales Orders from Tally Prime...")
+        records = run_stage(pipeline, "parse", iter_sales_orders_from_tally(watermark, pipeline))
+    ledger = SyncLedger()
+    push = ledger_push(ledger, "Sales Order", itemgetter("custom_ref_no"), add_sales_order_to_erpnext, update_sales_order_in_erpnext)
+    results = push_records(records, push, max_workers, label="Sales Order")
+    if pipeline is not None:
+        pipeline.report()
+    ledger.close()
 
-    print(f"\nFound {len(sales_orders)} Sales Order(s) to sync.\n")
+    if not results:
+        logger.info("No sales orders to sync.")
+        return results
 
-    for idx, sales_order in enumerate(sales_orders, start=1):
-        print(f"Syncing Sales Order {idx}...")
-        add_sales_order_to_erpnext(sales_order)
+    watermark.commit(results.ok)
+    summarise(results, "Sales Order(s)", "Sales Order")
+    return results
 
 
 if __name__ == "__main__":
+    metrics.setup_logging()
     sync_sales_orders()
\ No newline at end of file
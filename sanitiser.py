@@ -0,0 +1,97 @@
+import re
+
+_WHITESPACE = b" \t\n\r\x0b\x0c"
+_ALNUM = b"abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
+_NAME_BYTES = frozenset(_ALNUM + b"_-")
+_SPACE_BYTES = frozenset(_WHITESPACE)
+
+# Unit suffixes Tally appends to numeric fields, e.g. <RATE>125.50/no</RATE>
+# and <ACTUALQTY> 10 no</ACTUALQTY>. The groups of each pattern are the
+# parts that are kept.
+_UNIT_PATTERNS = {
+    "RATE": rb"(RATE[^>]*>[\d.]+)/no(</RATE>)",
+    "ACTUALQTY": rb"(ACTUALQTY[^>]*>\s*[\d.]+)\s*no(</ACTUALQTY>)",
+    "OPENINGBALANCE": rb"(OPENINGBALANCE[^>]*>)\s*([\d.]+)\s*no(</OPENINGBALANCE>)",
+}
+
+_BARE_VALUE = re.compile(rb"=(\s*)([a-zA-Z0-9_-]+)")
+
+
+class Sanitiser:
+    """Byte-level cleaner for Tally XML exports.
+
+    Does the same job as the clean_unwanted_characters /
+    modify_rate_and_quantity chain each module used to carry:
+
+    - bare attribute values (`name=value`) are quoted;
+    - bytes outside `allowed_punctuation` + alphanumerics + whitespace are
+      dropped with a single bytes.translate;
+    - `/no` and `no` unit suffixes are stripped from the `unit_tags` fields.
+
+    The two regex scans both start with a literal byte (`=` and `<`), so
+    the regex engine can jump between candidates instead of trying every
+    position. Input is raw bytes in any ASCII-compatible encoding, and
+    every non-ASCII byte is dropped. Nothing is rewritten across a closing
+    tag, so the sanitiser can be applied chunk by chunk to a stream cut
+    after closing tags (see tally_stream.find_safe_split).
+    """
+
+    def __init__(self, allowed_punctuation, unit_tags=(), quote_values=True, spaced_equals=True):
+        allowed = set(_ALNUM + _WHITESPACE + allowed_punctuation)
+        self.delete_bytes = bytes(b for b in range(256) if b not in allowed)
+        self.quote_values = quote_values
+        self.spaced_equals = spaced_equals
+        self.unit_pattern = None
+        if unit_tags:
+            self.unit_pattern = re.compile(b"<(?:" + b"|".join(_UNIT_PATTERNS[tag] for tag in unit_tags) + b")")
+
+    def quote_attributes(self, data):
+        """Rewrite ` name = value` as ` "name"="value"`.
+
+        With quote_values=False the value stays bare, and with
+        spaced_equals=False no whitespace is allowed around the `=`. These
+        are the two ledger-export variants.
+
+        Matches the old `(\\s)([\\w-]+)\\s*=\\s*([\\w-]+)` substitution,
+        but only the `=` signs followed by a bare value are examined.
+        """
+        pieces = []
+        last = 0
+        for match in _BARE_VALUE.finditer(data):
+            name_end = match.start()
+            if match.group(1) and not self.spaced_equals:
+                continue
+            while self.spaced_equals and name_end > last and data[name_end - 1] in _SPACE_BYTES:
+                name_end -= 1
+            name_start = name_end
+            while name_start > last and data[name_start - 1] in _NAME_BYTES:
+                name_start -= 1
+            if name_start == name_end or name_start - 1 < last or data[name_start - 1] not in _SPACE_BYTES:
+                continue
+            value = match.group(2)
+            if self.quote_values:
+                value = b'"' + value + b'"'
+            pieces.append(data[last:name_start])
+            pieces.append(b'"' + data[name_start:name_end] + b'"=' + value)
+            last = match.end()
+        if not pieces:
+            return data
+        pieces.append(data[last:])
+        return b"".join(pieces)
+
+    @staticmethod
+    def _strip_unit(match):
+        return b"<" + b"".join(group for group in match.groups() if group is not None)
+
+    def __call__(self, data):
+        data = self.quote_attributes(data).translate(None, self.delete_bytes)
+        if self.unit_pattern is not None:
+            data = self.unit_pattern.sub(self._strip_unit, data)
+        return data
+
+
+# Ledger exports (customer.py, supplier.py) also drop ".", which turns
+# LEDGSTREGDETAILS.LIST into LEDGSTREGDETAILSLIST. The field paths rely on this.
+LEDGER_SANITISER = Sanitiser(b'<>-=/":', quote_values=False, spaced_equals=False)
+STOCK_ITEM_SANITISER = Sanitiser(b'<>-="/:.', unit_tags=("RATE", "OPENINGBALANCE"))
+VOUCHER_SANITISER = Sanitiser(b'<>-="/:.', unit_tags=("RATE", "ACTUALQTY"))
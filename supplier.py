@@ -1,149 +1,146 @@
+import logging
 import requests
-import xml.etree.ElementTree as ET
-import re
+from functools import partial
+from operator import itemgetter
 
-TALLY_API_URL = "YOUR_TALLY_URL"
+import bulk_insert
+from bulk_insert import bulk_push
+from erpnext_index import fetch_existing_names
+from field_plan import Field, FieldPlan
+from http_client import erp_session, is_transient
+import metrics
+from push_pool import PushResults, push_records, summarise
+from records import Ledger
+from sanitiser import LEDGER_SANITISER
+from sync_ledger import SyncLedger, adopt_existing, changed_fields, ledger_push
+import tally_stream
+from tally_envelope import MASTER_NAME, collection_request, fetch_list
+from tally_source import tally_source
+from tally_stream import stream_tally_export
+from watermark import Watermark
+import xml_backend
+
+logger = logging.getLogger(__name__)
 
+find_ledgers = xml_backend.compile_findall(".//LEDGER")
 
-def clean_unwanted_characters(xml_data):
-    fixed_xml = re.sub(r'(\s)([a-zA-Z0-9_-]+)=([a-zA-Z0-9_-]+)', r'\1"\2"=\3', xml_data)
-    cleaned_data = re.sub(r'[^a-zA-Z0-9\s<>\-=/":]', '', fixed_xml)
-    return cleaned_data
+LEDGER_FIELDS = FieldPlan([
+    Field(".//NAME", "name"),
+    Field(".//INCOMETAXNUMBER", "pan"),
+    Field(".//LEDGSTREGDETAILSLIST/GSTREGISTRATIONTYPE", "gst_registration_type"),
+    Field(".//LEDGSTREGDETAILSLIST/GSTIN", "gstin"),
+    Field(".//LEDMAILINGDETAILSLIST/STATE", "state"),
+    Field(".//LEDMAILINGDETAILSLIST//ADDRESSLIST/ADDRESS", "addresses", many=True),
+    Field(".//LEDMAILINGDETAILSLIST/PINCODE", "pincode"),
+])
+
+TALLY_API_URL = "YOUR_TALLY_URL"
 
 
 def clean_xml(xml_data):
-    cleaned_xml = clean_unwanted_characters(xml_data)
+    """Sanitise a Tally response and parse it; returns the root element or None."""
+    if xml_data is None:
+        return None
     try:
-        root = ET.fromstring(cleaned_xml)
-        return ET.tostring(root, encoding="unicode")
-    except ET.ParseError as e:
-        print("Error parsing XML:", e)
+        with metrics.timed("sanitise", "Supplier"):
+            cleaned = LEDGER_SANITISER(xml_data.encode("utf-8"))
+        with metrics.timed("parse", "Supplier"):
+            return xml_backend.fromstring(cleaned)
+    except xml_backend.PARSE_ERRORS as e:
+        logger.warning(f"Error parsing XML: {e}")
         return None
 
 
-def fetch_tally_data():
-    payload = """<ENVELOPE>
-    <HEADER>
-        <VERSION>1</VERSION>
-        <TALLYREQUEST>Export</TALLYREQUEST>
-        <TYPE>Collection</TYPE>
-        <ID>SundryCreditorsLedgers</ID>
-    </HEADER>
-    <BODY>
-        <DESC>
-            <STATICVARIABLES>
-                <SVEXPORTFORMAT>$$SysName:XML</SVEXPORTFORMAT>
-            </STATICVARIABLES>
-            <TDL>
-                <TDLMESSAGE>
-                    <COLLECTION NAME="SundryCreditorsLedgers" ISMODIFY="No" ISFIXED="No" ISINITIALIZE="No" ISOPTION="No" ISINTERNAL="No">
-                        <TYPE>Ledger</TYPE>
-                        <NATIVEMETHOD>*</NATIVEMETHOD>
-                        <FILTER>IsSundryCreditors</FILTER>
-                    </COLLECTION>
-                    <SYSTEM TYPE="Formulae" NAME="IsSundryCreditors">
-                        $Parent = "Sundry Creditors"
-                    </SYSTEM>
-                </TDLMESSAGE>
-            </TDL>
-        </DESC>
-    </BODY>
-</ENVELOPE>
-"""
+def tally_request_xml(watermark=None):
+    return collection_request("SundryCreditorsLedgers", "Ledger", fetch_list(LEDGER_FIELDS, {"name": MASTER_NAME}),
+                              {"IsSundryCreditors": '$Parent = "Sundry Creditors"'}, watermark)
+
+
+def fetch_tally_data(watermark=None, source=None):
+    payload = tally_request_xml(watermark)
 
     headers = {"Content-Type": "application/xml"}
-    response = requests.post(TALLY_API_URL, data=payload, headers=headers)
+    metrics.incr("tally_requests", "Supplier")
+    with metrics.timed("tally_request", "Supplier"):
+        response = (source or tally_source()).post(TALLY_API_URL, data=payload, headers=headers)
 
     if response.status_code == 200:
         return response.text
     else:
-        print(f"Failed to fetch data from Tally. Status code: {response.status_code}")
+        logger.warning(f"Failed to fetch data from Tally. Status code: {response.status_code}")
         return None
 
 
-def get_suppliers_from_tally():
-    raw_xml = fetch_tally_data()
-
-
-    cleaned_xml = clean_xml(raw_xml)
-
-    if cleaned_xml:
-        try:
-            root = ET.fromstring(cleaned_xml)
-
-            suppliers = []
-            for ledger in root.findall(".//LEDGER"):
-                supplier_name = ledger.find(".//NAME")
-                if supplier_name is None or not supplier_name.text.strip(): 
-                    continue
-                supplier_name = supplier_name.text.strip()
-                pan_no = ledger.find(".//INCOMETAXNUMBER").text if ledger.find(".//INCOMETAXNUMBER") is not None else " "
-                
-                gst_registration ="Unregistered"
-                gst_element = ledger.find(".//LEDGSTREGDETAILSLIST/GSTREGISTRATIONTYPE")
-                if gst_element is not None:
-                    gst_registration = gst_element.text
-                
-                if gst_registration == "Regular":
-                    gst_registration = "Registered Regular"
-                if gst_registration == "Composition":
-                    gst_registration = "Registered Composition"
-                if gst_registration == "Unkown":
-                    gst_registration = " "
-                if gst_registration == "Unregistered/Consumer":
-                    gst_registration == "Unregistered"
-
-                gstin = None
-                gstin_element = ledger.find(".//LEDGSTREGDETAILSLIST/GSTIN")
-                if gstin_element is not None:
-                    gstin = gstin_element.text
-
-                state = None
-                state_element = ledger.find(".//LEDMAILINGDETAILSLIST/STATE")
-                if state_element is not None:
-                    state = state_element.text
-
-                addresses = []
-                for address_element in ledger.findall(".//LEDMAILINGDETAILSLIST//ADDRESSLIST/ADDRESS"):
-                    if address_element.text:
-                        addresses.append(address_element.text.strip())
-                primary_address = ", ".join(addresses) if addresses else "Not Available"
-                
-
-                pincode = " "
-                pincode_element = ledger.find(".//LEDMAILINGDETAILSLIST/PINCODE")
-                if pincode_element is not None:
-                    pincode = pincode_element.text
-
-
-                suppliers.append({
-                    'supplier_name': supplier_name,
-                    'pan':pan_no,
-                    'gstin': gstin,
-                    "gst":gst_registration,
-                    'state':state,
-                    'address':primary_address,
-                    'pincode':pincode
-                })
-
-            if suppliers:
-                return suppliers
-            else:
-                print("No customers found in the response.")
-        except ET.ParseError as e:
-            print(f"Error parsing cleaned XML: {e}")
-    else:
-        print("Failed to clean the XML response.")
-    return []
+def parse_supplier(ledger):
+    fields = LEDGER_FIELDS.extract(ledger)
+    supplier_name = fields.get("name")
+    if supplier_name is None or not supplier_name.strip(): 
+        return None
+    supplier_name = supplier_name.strip()
+    pan_no = fields.get("pan", " ")
 
-def add_supplier_to_erpnext(supplier):
-    erp_endpoint = "ERP_URL/api/resource/Supplier"
-    headers = {
-        "Authorization": "token API KEY:API SECRET", 
-        "Content-Type": "application/json"
-    }
+    gst_registration = fields.get("gst_registration_type", "Unregistered")
+
+    if gst_registration == "Regular":
+        gst_registration = "Registered Regular"
+    if gst_registration == "Composition":
+        gst_registration = "Registered Composition"
+    if gst_registration == "Unkown":
+        gst_registration = " "
+    if gst_registration == "Unregistered/Consumer":
+        gst_registration == "Unregistered"
+
+    gstin = fields.get("gstin")
+
+    state = fields.get("state")
+
+    addresses = [address.strip() for address in fields["addresses"] if address]
+    primary_address = ", ".join(addresses) if addresses else "Not Available"
+
+
+    pincode = fields.get("pincode", " ")
+
+
+    return Ledger(
+        supplier_name=supplier_name,
+        pan=pan_no,
+        gstin=gstin,
+        gst=gst_registration,
+        state=state,
+        address=primary_address,
+        pincode=pincode
+    )
+
+
+def iter_suppliers(ledgers, watermark=None):
+    for ledger in ledgers:
+        if watermark and not watermark.observe(ledger):
+            continue
+        with metrics.timed("transform", "Supplier"):
+            supplier = parse_supplier(ledger)
+        if supplier:
+            yield supplier
+
+
+def get_suppliers_from_tally(watermark=None, source=None):
+    source = source or tally_source()
+    if tally_stream.SPOOL or not source.live:
+        ledgers = stream_tally_export(TALLY_API_URL, tally_request_xml(watermark), "LEDGER", LEDGER_SANITISER,
+                                      {"Content-Type": "application/xml"}, watermark=watermark, doctype="Supplier",
+                                      source=source)
+    else:
+        root = clean_xml(fetch_tally_data(watermark, source))
+        if root is None:
+            logger.warning("Failed to clean the XML response.")
+            return []
+        ledgers = find_ledgers(root)
+    suppliers = list(iter_suppliers(ledgers, watermark))
+    if not suppliers:
+        logger.info("No suppliers found in the response.")
+    return suppliers
 
-    data = {
+def build_supplier_payload(supplier):
+    return {
         "doctype": "Supplier",
         "supplier_name":supplier.get('supplier_name', 'Unnamed Supplier'),
         "custom_state":supplier.get('state','Not Available'),
@@ -153,40 +150,107 @@ def add_supplier_to_erpnext(supplier):
         "pan":supplier.get('pan',' '),
         "primary_address":supplier.get('address','Not Available')
     }
+
+
+def add_supplier_to_erpnext(supplier, existing_suppliers=None):
+    if existing_suppliers is not None and supplier.get('supplier_name') in existing_suppliers:
+        logger.debug(f"Supplier {supplier['supplier_name']} already exists, skipping....")
+        return
+
+    erp_endpoint = "ERP_URL/api/resource/Supplier"
+    headers = {
+        "Authorization": "token API KEY:API SECRET", 
+        "Content-Type": "application/json"
+    }
+
+    data = build_supplier_payload(supplier)
+    doc_name = None
     try:
-        response = requests.post(erp_endpoint, headers=headers, json=data)
+        response = erp_session().post(erp_endpoint, headers=headers, json=data)
         response.raise_for_status()
-        print(f"Successfully added supplier {supplier['supplier_name']} to ERPNext.")
+        logger.debug(f"Successfully added supplier {supplier['supplier_name']} to ERPNext.")
+        doc_name = response.json().get("data", {}).get("name")
+        if existing_suppliers is not None:
+            existing_suppliers.add(supplier['supplier_name'])
     except requests.exceptions.HTTPError as err:
         if response.status_code == 409:
-            print(f"Supplier {supplier['supplier_name']} already exists, skipping....")
+            logger.debug(f"Supplier {supplier['supplier_name']} already exists, skipping....")
         else:
-            print(f"Failed to add supplier {supplier['supplier_name']} to ERPNext: {err}")
+            logger.warning(f"Failed to add supplier {supplier['supplier_name']} to ERPNext: {err}")
+            if is_transient(err):
+                raise
     try:
         response_json = response.json()  
         if "_server_messages" in response_json:
             server_message = response_json["_server_messages"]
-            print(f"Error Message: {server_message}")
+            logger.warning(f"Error Message: {server_message}")
         else:
-            print("No server messages found in the response.")
+            logger.debug("No server messages found in the response.")
     except ValueError:
-        print("Response is not in JSON format.")
+        logger.warning("Response is not in JSON format.")
     except Exception as err:
-        print(f"Error occurred while adding Supplier {supplier['supplier_name']} to ERPNext: {err}")
+        logger.warning(f"Error occurred while adding Supplier {supplier['supplier_name']} to ERPNext: {err}")
+    return doc_name
+
 
-def sync_suppliers():
-    suppliers = get_suppliers_from_tally()
+def update_supplier_in_erpnext(supplier, erp_name, previous=None):
+    erpnext_endpoint = f"ERP_URL/api/resource/Supplier/{erp_name}"
+    headers = {
+        "Authorization": "token API KEY:API SECRET",
+        "Content-Type": "application/json",
+    }
+    data = build_supplier_payload(supplier)
+    if previous is not None:
+        data = changed_fields(build_supplier_payload(previous), data)
+        if not data:
+            logger.debug(f"Supplier {supplier['supplier_name']} has no changes for ERPNext, skipping...")
+            return erp_name
+
+    try:
+        response = erp_session().put(erpnext_endpoint, headers=headers, json=data)
+        response.raise_for_status()
+        logger.debug(f"Successfully updated supplier {supplier['supplier_name']} in ERPNext.")
+        return erp_name
+    except requests.exceptions.HTTPError as err:
+        logger.warning(f"Failed to update supplier {supplier['supplier_name']} in ERPNext: {err}")
+        if is_transient(err):
+            raise
+        return None
+
+
+def sync_suppliers(max_workers=None, full=False, records=None, watermark=None, bulk=None):
+    watermark = watermark or Watermark("Supplier", full)
+    suppliers = get_suppliers_from_tally(watermark) if records is None else records
 
     if not suppliers:
-        print("No new suppliers to sync.")
-        return
+        logger.info("No new suppliers to sync.")
+        return PushResults()
 
+    existing_suppliers = fetch_existing_names("Supplier", "supplier_name")
+
+    valid = []
     for supplier in suppliers:
         if 'supplier_name' in supplier:
-            add_supplier_to_erpnext(supplier)
+            valid.append(supplier)
         else:
-            print(f"Supplier data missing 'supplier_name': {supplier}")
+            logger.warning(f"Supplier data missing 'supplier_name': {supplier}")
+
+    ledger = SyncLedger()
+    adopt_existing(ledger, "Supplier", valid, itemgetter("supplier_name"), "supplier_name", existing_suppliers)
+    add = partial(add_supplier_to_erpnext, existing_suppliers=existing_suppliers)
+    if (bulk_insert.BULK_INSERT if bulk is None else bulk):
+        results = bulk_push(valid, ledger, "Supplier", itemgetter("supplier_name"), build_supplier_payload, add,
+                            update_supplier_in_erpnext, name_field="supplier_name",
+                            existing=existing_suppliers, max_workers=max_workers, diff=True)
+    else:
+        push = ledger_push(ledger, "Supplier", itemgetter("supplier_name"), add, update_supplier_in_erpnext, diff=True)
+        results = push_records(valid, push, max_workers)
+    ledger.close()
+    watermark.commit(results.ok)
+    summarise(results, "Supplier(s)", "Supplier")
+    return results
 
 
 if __name__ == "__main__":
+    metrics.setup_logging()
     sync_suppliers()
@@ -1,47 +1,64 @@
+import logging
 import requests
-import xml.etree.ElementTree as ET
 import re
 import json
 from datetime import datetime
-
-def clean_unwanted_characters(xml_data):
-    fixed_xml = re.sub(r'(\s)([a-zA-Z0-9_-]+)\s*=\s*([a-zA-Z0-9_-]+)', r'\1"\2"="\3"', xml_data)
-    cleaned_data = re.sub(r'[^a-zA-Z0-9\s<>\-="/:.]', '', fixed_xml)
-    return cleaned_data
-
-def modify_rate_and_quantity(xml_data):
-    xml_data = re.sub(r'(<RATE[^>]*>)([\d\.]+)(/no)(</RATE>)', r'\1\2\4', xml_data)
-    xml_data = re.sub(r'(<ACTUALQTY[^>]*>\s*)([\d\.]+)\s*no(</ACTUALQTY>)', r'\1\2\3', xml_data)
-    return xml_data
-
-def preserve_numeric_format(xml_data):
-    numeric_pattern = re.compile(r'\d+\.\d+(/[a-zA-Z]*)?')
-
-    def replace_invalid_chars(match):
-        return match.group(0)
-
-    cleaned_data = numeric_pattern.sub(replace_invalid_chars, xml_data)
-    return cleaned_data
+from operator import itemgetter
+
+from batch_transform import extract_fields, transform_payment_vouchers
+from field_plan import Field, FieldPlan, Group
+from http_client import erp_session, is_transient
+import metrics
+from pipeline import new_pipeline, run_stage
+from push_pool import push_records, summarise
+from records import BillAllocation, Voucher
+from ref_cache import LIVE_FILTERS, ref_cache, resolve_ref_nos
+from sanitiser import VOUCHER_SANITISER
+from sync_ledger import SyncLedger, ledger_push
+from tally_envelope import COMPANY, voucher_request
+from tally_stream import stream_voucher_register
+from watermark import Watermark
+
+logger = logging.getLogger(__name__)
+
+PAYMENT_BATCH_SIZE = 500
+# Client-side draft markers that must not be sent when updating a saved entry.
+LOCAL_ONLY_FIELDS = ("__islocal", "__unsaved", "name")
 
 def clean_name_field(name):
-    return re.sub(r'^0+', '', name)
+    return re.sub(r'^0+', '', name) if name else name
+
+
+BILL_ALLOCATION_FIELDS = FieldPlan([
+    Field(".//NAME", "ref_no", clean_name_field),
+    Field(".//AMOUNT", "amount"),
+])
+
+LEDGER_ENTRY_FIELDS = FieldPlan(groups=[
+    Group(".//BILLALLOCATIONS.LIST", "bill_allocation", BILL_ALLOCATION_FIELDS, first=True),
+])
+
+PAYMENT_VOUCHER_FIELDS = FieldPlan(
+    [
+        Field(".//PARTYLEDGERNAME", "party_name"),
+        Field(".//VOUCHERNUMBER", "voucher_no"),
+        Field(".//DATE", "date"),
+        Field(".//BANKALLOCATIONS.LIST/TRANSACTIONTYPE", "pay_type"),
+        Field(".//BANKALLOCATIONS.LIST/AMOUNT", "amount_paid"),
+    ],
+    [Group(".//ALLLEDGERENTRIES.LIST", "ledger_entries", LEDGER_ENTRY_FIELDS)],
+)
+# The bank allocation fields live in the bank's ledger entry.
+PAYMENT_METHODS = {
+    "pay_type": ["ALLLEDGERENTRIES.BANKALLOCATIONS.TRANSACTIONTYPE"],
+    "amount_paid": ["ALLLEDGERENTRIES.BANKALLOCATIONS.AMOUNT"],
+}
 
-def clean_xml(xml_data):
-    cleaned_xml = clean_unwanted_characters(xml_data)
-    cleaned_xml = modify_rate_and_quantity(cleaned_xml)
-    cleaned_xml = preserve_numeric_format(cleaned_xml)
 
-    try:
-        root = ET.fromstring(cleaned_xml)
-        for name_element in root.findall(".//NAME"):
-            if name_element.text:
-                name_element.text = clean_name_field(name_element.text)
-        
-        return ET.tostring(root, encoding="unicode")
-    except ET.ParseError as e:
-        print("Error parsing XML:", e)
-        return None
 def get_purchase_invoice_id_by_ref_no(ref_no):
+    cached = ref_cache().get("Purchase Order", ref_no)
+    if cached:
+        return cached
     url = f"ERP_URL/api/resource/Purchase Order"
     
     headers = {
@@ -49,18 +66,19 @@ def get_purchase_invoice_id_by_ref_no(ref_no):
     }
     
     params = {
-        "filters": json.dumps([["custom_ref_no", "=", ref_no]]),
+        "filters": json.dumps([["custom_ref_no", "=", ref_no], *LIVE_FILTERS]),
         "fields": json.dumps(["name"])  
     }
     
     try:
-        response = requests.get(url, headers=headers, params=params)
+        response = erp_session().get(url, headers=headers, params=params)
         response.raise_for_status()  
         
         data = response.json()
         
         if data.get("data"):
             order_id = data["data"][0]["name"]
+            ref_cache().put("Purchase Order", ref_no, order_id)
             return order_id
         else:
             return f"No Purchase Order found with ref_no: {ref_no}"
@@ -68,135 +86,108 @@ def get_purchase_invoice_id_by_ref_no(ref_no):
     except requests.exceptions.RequestException as e:
         return f"API request failed: {str(e)}"
 
-def get_payment_vouchers_from_tally():
-    url = "TALLY URL"
-    xml_request = """
-<ENVELOPE>
-        <HEADER>
-        <TALLYREQUEST>Export Data</TALLYREQUEST>
-        </HEADER>
-        <BODY>
-        <EXPORTDATA>
-        <REQUESTDESC>
-        <STATICVARIABLES>
-        <SVCURRENTCOMPANY>$etca_name</SVCURRENTCOMPANY>
-        <SHOWCREATEDBY>YES</SHOWCREATEDBY>
-        <SHOWPARTYNAME>YES</SHOWPARTYNAME>
-        <VOUCHERTYPENAME>Payment</VOUCHERTYPENAME>
-        </STATICVARIABLES>
-        <REPORTNAME>Voucher Register</REPORTNAME>
-        </REQUESTDESC>
-        </EXPORTDATA>
-        </BODY>
-        </ENVELOPE>  
-"""
-    headers = {"Content-Type": "application/xml"}
+def get_purchase_invoice_ids_by_ref_nos(ref_nos):
+    return resolve_ref_nos("Purchase Order", ref_nos)
+
+
+def resolve_reference_numbers(payment_vouchers):
+    """Fill in invoice_number for every allocation with one batched lookup."""
+    ref_nos = {ref["ref_no"] for payment_data in payment_vouchers for ref in payment_data["reff"]}
+    invoice_ids = get_purchase_invoice_ids_by_ref_nos(ref_nos)
+    for payment_data in payment_vouchers:
+        for ref in payment_data["reff"]:
+            ref["invoice_number"] = invoice_ids.get(
+                ref["ref_no"], f"No Purchase Order found with ref_no: {ref['ref_no']}"
+            )
+    return payment_vouchers
+
+
+def build_payment_voucher(fields, amount_paid, allocations):
+    party_name = fields["party_name"].strip() if fields.get("party_name") else "Unknown Party"
+
+    voucher_no = fields.get("voucher_no").strip()
+
+    date = fields.get("date").strip()
+    if date:
+       date = datetime.strptime(date, "%Y%m%d").strftime("%Y-%m-%d")
+
+    pay_type = fields.get("pay_type")
+
+    logger.debug(f"Processing Payment Voucher for Party: {party_name}")
+
+    payment_data = Voucher(
+        vch_no=voucher_no,
+        paid=amount_paid,
+        party_name=party_name,
+        date=date,
+        pay_type=pay_type,
+        reff=[]
+    )
+
+    reff_entries = fields["ledger_entries"]
+    if not reff_entries:
+       logger.warning("NO ALLLEDGERENTRIES.LIST tag found")
+    else:
+       logger.debug(f"Found {len(reff_entries)} reff entries.")
+    for reff_no, amount in allocations:
+        payment_data["reff"].append(
+            BillAllocation(
+                ref_no=reff_no,
+                invoice_number=None,
+                allocated_amount=amount
+            )
+        )
+
+    if not payment_data["reff"]:
+        logger.warning("No valid refferences found")
+        return None
+    return payment_data
 
-    try:
-        response = requests.post(url, data=xml_request, headers=headers)
-        if response.status_code == 200:
-            raw_xml = response.text
-            cleaned_xml = clean_xml(raw_xml)
-            if cleaned_xml:
-                root = ET.fromstring(cleaned_xml)
-                payment_vouchers = []
-                
-                for voucher in root.findall(".//VOUCHER"):
-                    party_name_tag = voucher.find(".//PARTYLEDGERNAME") 
-                    
-                    party_name = (
-                        party_name_tag.text.strip()
-                        if party_name_tag is not None and party_name_tag.text
-                        else "Unknown Party"
-                    )
-
-                    voucher_number_tag = voucher.find(".//VOUCHERNUMBER")
-                    voucher_no = voucher_number_tag.text.strip()
-
-                    date_tag = voucher.find(".//DATE")
-                    date = date_tag.text.strip()
-                    if date:
-                       date = datetime.strptime(date, "%Y%m%d").strftime("%Y-%m-%d")
-
-                    pay_type = None
-                    pay_type_element = voucher.find(".//BANKALLOCATIONS.LIST/TRANSACTIONTYPE")
-                    if pay_type_element is not None:
-                       pay_type = pay_type_element.text
-
-                    amount_paid = None
-                    amount_paid_element = voucher.find(".//BANKALLOCATIONS.LIST/AMOUNT")
-                    if amount_paid_element is not None:
-                        amount_paid = amount_paid_element.text
-
-                    if amount_paid is not None:
-                       amount_paid = str(amount_paid).replace("-", "")
-
-                    print(f"\nProcessing Payment Voucher for Party: {party_name}")
-
-                    payment_data = {
-                        "vch_no":voucher_no,
-                        "paid":amount_paid,
-                        "party_name": party_name,
-                        "date":date,
-                        "pay_type":pay_type,
-                        "reff":[]
-                    }
-
-                    reff_entries = voucher.findall(".//ALLLEDGERENTRIES.LIST")
-                    if not reff_entries:
-                       print("- Warning: NO ALLLEDGERENTRIES.LIST tag found")
-                    else:
-                       print(f"Found {len(reff_entries)} reff entries.")
-                    for ref in reff_entries:
-                        bill_allocations = ref.find(".//BILLALLOCATIONS.LIST")
-                        if bill_allocations is None or not list(bill_allocations):  
-                           continue
-
-                        reff_number = bill_allocations.find(".//NAME")
-                        allocated_amount = bill_allocations.find(".//AMOUNT")
-
-                        if reff_number is not None and reff_number.text and allocated_amount is not None and allocated_amount.text:
-                           reff_no = reff_number.text.strip()
-                           amount = allocated_amount.text.strip()
-                           invoice_no = get_purchase_invoice_id_by_ref_no(reff_no)
-                        if amount is not None:
-                           amount = str(amount).replace("-", "")
-
-                        payment_data["reff"].append(
-                            {
-                                "invoice_number":invoice_no,
-                                "allocated_amount":amount
-                            }
-                        )
-                    
-                    if payment_data["reff"]:
-                        payment_vouchers.append(payment_data)
-                    else:
-                        print(f" - No valid refferences found")
-
-                return payment_vouchers
-            else:
-                print("Failed to clean and parse XML from Tally.")
-        else:
-            print(f"Failed to connect to Tally. Status code: {response.status_code}")
-    except requests.exceptions.RequestException as e:
-        print(f"Error connecting to Tally: {e}")
-    return []
 
+def parse_payment_vouchers(vouchers, watermark=None):
+    fields = extract_fields(vouchers, PAYMENT_VOUCHER_FIELDS, "Supplier Payment Entry", watermark)
+    return transform_payment_vouchers(fields, build_payment_voucher, "Supplier Payment Entry", unsigned=True)
 
 
-def add_payment_entry_to_erpnext(payment_entry):
-    erpnext_endpoint = "ERP_URL/api/resource/Payment Entry"
-    headers = {
-        "Authorization": "token 081cf178f1db3cc:9480a96f711ce0a",
-        "Content-Type": "application/json",
-    }
+def resolve_in_batches(payment_vouchers):
+    """Resolve allocations PAYMENT_BATCH_SIZE vouchers at a time with batched ERPNext lookups."""
+    batch = []
+    for payment_data in payment_vouchers:
+        batch.append(payment_data)
+        if len(batch) >= PAYMENT_BATCH_SIZE:
+            yield from resolve_reference_numbers(batch)
+            batch = []
+    yield from resolve_reference_numbers(batch)
 
-    data = {
+
+def iter_payment_vouchers_from_tally(watermark=None, resolve=True, pipeline=None, source=None):
+    """Stream Payment vouchers from Tally, yielding one payment dict at a time.
+
+    With resolve=False the bill allocations are left unresolved
+    (invoice_number None); pass the vouchers through resolve_in_batches
+    once the invoices they reference have been pushed.
+    """
+    url = "TALLY URL"
+    xml_request = voucher_request("Payment", PAYMENT_VOUCHER_FIELDS, PAYMENT_METHODS, static_variables=COMPANY)
+    vouchers = stream_voucher_register(url, xml_request, VOUCHER_SANITISER, watermark,
+                                       headers={"Content-Type": "application/xml"}, pipeline=pipeline,
+                                       doctype="Supplier Payment Entry", source=source)
+    payment_vouchers = run_stage(pipeline, "parse", parse_payment_vouchers(vouchers, watermark))
+    if resolve:
+        payment_vouchers = run_stage(pipeline, "resolve", resolve_in_batches(payment_vouchers))
+    yield from payment_vouchers
+
+
+def get_payment_vouchers_from_tally(watermark=None, resolve=True, source=None):
+    return list(iter_payment_vouchers_from_tally(watermark, resolve, source=source))
+
+
+def build_payment_entry_payload(payment_entry):
+    return {
         "__islocal": 1,
         "total_allocated_amount":float(payment_entry["paid"]),
         "naming_series": "ACC-PAY-.YYYY.-",
-        "custom_ref_no":f"pay{payment_entry["vch_no"]}",
+        "custom_ref_no":f"pay{payment_entry['vch_no']}",
         "target_exchange_rate": 1,
         "paid_from": "Cash - SSL",  
         "base_paid_amount":float(payment_entry["paid"]),
@@ -236,40 +227,89 @@ def add_payment_entry_to_erpnext(payment_entry):
 ],
     }
 
+
+def add_payment_entry_to_erpnext(payment_entry):
+    erpnext_endpoint = "ERP_URL/api/resource/Payment Entry"
+    headers = {
+        "Authorization": "token 081cf178f1db3cc:9480a96f711ce0a",
+        "Content-Type": "application/json",
+    }
+
+    data = build_payment_entry_payload(payment_entry)
+
+    doc_name = None
     try:
-       response = requests.post(erpnext_endpoint, headers=headers, json=data)
+       response = erp_session().post(erpnext_endpoint, headers=headers, json=data)
        response.raise_for_status()
-       print(f"Successfully added Payment Entry for '{payment_entry['party_name']}' to ERPNext.")
+       logger.debug(f"Successfully added Payment Entry for '{payment_entry['party_name']}' to ERPNext.")
+       doc_name = response.json().get("data", {}).get("name")
     except requests.exceptions.HTTPError as err:
-        print("HTTPError occurred:", err)  
+        logger.warning(f"HTTPError occurred: {err}")
+        if is_transient(err):
+            raise
     try:
         response_json = response.json()  
         if "_server_messages" in response_json:
             server_message = response_json["_server_messages"]
-            print(f"Error Message: {server_message}")
+            logger.warning(f"Error Message: {server_message}")
         else:
-            print("No server messages found in the response.")
+            logger.debug("No server messages found in the response.")
     except ValueError:
-        print("Response is not in JSON format.")
+        logger.warning("Response is not in JSON format.")
     except Exception as err:
-       print(f"Error occurred while adding Payment Entry for '{payment_entry['party_name']}' to ERPNext: {err}")
+       logger.warning(f"Error occurred while adding Payment Entry for '{payment_entry['party_name']}' to ERPNext: {err}")
+    return doc_name
 
 
-def sync_payment_vouchers():
-    print("Fetching Payment Vouchers from Tally Prime...")
-    payment_vouchers = get_payment_vouchers_from_tally()
+def update_payment_entry_in_erpnext(payment_entry, erp_name):
+    """Update a Payment Entry previously pushed from Tally; only valid while it is a draft."""
+    erpnext_endpoint = f"ERP_URL/api/resource/Payment Entry/{erp_name}"
+    headers = {
+        "Authorization": "token API KEY:API SECRET",
+        "Content-Type": "application/json",
+    }
+    data = {
+        key: value for key, value in build_payment_entry_payload(payment_entry).items()
+        if key not in LOCAL_ONLY_FIELDS
+    }
 
-    if not payment_vouchers:
-        print("No payment vouchers to sync.")
-        return
+    try:
+        response = erp_session().put(erpnext_endpoint, headers=headers, json=data)
+        response.raise_for_status()
+        logger.debug(f"Successfully updated Payment Entry for '{payment_entry['party_name']}' in ERPNext.")
+        return erp_name
+    except requests.exceptions.HTTPError as err:
+        logger.warning(f"Failed to update Payment Entry for '{payment_entry['party_name']}' in ERPNext: {err}")
+        if is_transient(err):
+            raise
+        return None
 
-    print(f"\nFound {len(payment_vouchers)} Payment Voucher(s) to sync.\n")
 
-    for idx, payment_entry in enumerate(payment_vouchers, start=1):
-        print(f"Syncing Payment Voucher {idx}...")
-        add_payment_entry_to_erpnext(payment_entry)
+def sync_payment_vouchers(max_workers=None, full=False, records=None, watermark=None):
+    watermark = watermark or Watermark("Supplier Payment Entry", full)
+    pipeline = new_pipeline(records)
+    if records is None:
+        logger.info("Fetching Payment Vouchers from Tally Prime...")
+        records = iter_payment_vouchers_from_tally(watermark, pipeline=pipeline)
+    else:
+        records = resolve_in_batches(records)
+    ledger = SyncLedger()
+    push = ledger_push(ledger, "Supplier Payment Entry", itemgetter("vch_no"), add_payment_entry_to_erpnext, update_payment_entry_in_erpnext)
+    results = push_records(records, push, max_workers, label="Payment Voucher")
+    if pipeline is not None:
+        pipeline.report()
+    ledger.close()
+
+    if not results:
+        logger.info("No payment vouchers to sync.")
+        return results
+
+    watermark.commit(results.ok)
+    summarise(results, "Payment Voucher(s)", "Supplier Payment Entry")
+    return results
 
 if __name__ == "__main__":
+    metrics.setup_logging()
     sync_payment_vouchers()
 
 
@@ -0,0 +1,175 @@
+"""Sync every Tally collection to ERPNext in dependency order, streaming each export into its push."""
+import argparse
+import asyncio
+import logging
+from collections import namedtuple
+
+import batch_transform
+import customer
+import customer_payment_entry
+import dry_run
+import item
+import purchase_invoice
+import purchase_order
+import sales_invoice
+import sales_order
+import supplier
+import supplier_payment_entry
+import http_client
+from http_client import close_sessions
+import metrics
+import push_pool
+from ref_cache import close_ref_cache
+import tally_envelope
+import tally_source
+from tally_source import open_source, use_source
+import tally_stream
+import xml_backend
+
+logger = logging.getLogger(__name__)
+
+Collection = namedtuple("Collection", ["doctype", "sync"])
+
+# Each stage is fully pushed before the next one starts: orders need their
+# customers, suppliers and items, and payments resolve the invoices they pay.
+# The collections of a stage are synced side by side; only their requests to
+# Tally are limited (tally_source.CONCURRENCY), so one collection is exported
+# while another is pushed. A collection is only exported when its stage
+# starts, and its records are pushed as they are parsed, so no export is held
+# in memory ahead of time.
+STAGES = [
+    ("masters", [
+        Collection("Customer", customer.sync_customers),
+        Collection("Supplier", supplier.sync_suppliers),
+        Collection("Item", item.sync_stock_items),
+    ]),
+    ("orders", [
+        Collection("Sales Order", sales_order.sync_sales_orders),
+        Collection("Purchase Order", purchase_order.sync_purchase_orders),
+    ]),
+    ("invoices", [
+        Collection("Sales Invoice", sales_invoice.sync_sales_invoices),
+        Collection("Purchase Invoice", purchase_invoice.sync_purchase_invoices),
+    ]),
+    ("payments", [
+        Collection("Customer Payment Entry", customer_payment_entry.sync_payment_vouchers),
+        Collection("Supplier Payment Entry", supplier_payment_entry.sync_payment_vouchers),
+    ]),
+]
+
+
+def pool_size(max_workers=None):
+    """ERPNext connections needed to push max_workers records per collection of the widest stage at once."""
+    widest = max(len(stage) for _, stage in STAGES)
+    return max(http_client.POOL_SIZE, (max_workers or push_pool.MAX_WORKERS) * widest)
+
+
+async def sync_collection(collection, max_workers, full):
+    logger.info(f"Syncing {collection.doctype} from Tally...")
+    return await asyncio.to_thread(collection.sync, max_workers, full)
+
+
+async def sync_all(max_workers=None, full=False, tally_concurrency=None, only=None):
+    """Sync stage by stage, every collection of a stage at once.
+
+    Each collection streams its export from Tally into its push, so memory
+    does not depend on how much the other collections export; at most
+    tally_concurrency (tally_source.CONCURRENCY) requests are sent to Tally
+    at a time. Returns {doctype: push results}. A collection whose sync
+    raised is reported and left out; its watermark stays where it was. Once
+    a collection raised or could not push some records (a held watermark),
+    the later stages, which depend on it, are not run. `only` limits the
+    run to the named doctypes.
+    """
+    tally_source.configure(concurrency=tally_concurrency)
+    results = {}
+    for name, stage in STAGES:
+        stage = [collection for collection in stage if not only or collection.doctype in only]
+        if not stage:
+            continue
+        logger.info(f"Syncing {name}: {', '.join(collection.doctype for collection in stage)}")
+        stage_results = await asyncio.gather(
+            *(sync_collection(collection, max_workers, full) for collection in stage),
+            return_exceptions=True,
+        )
+        failed = []
+        for collection, result in zip(stage, stage_results):
+            if isinstance(result, Exception):
+                logger.warning(f"Error syncing {collection.doctype}: {result}")
+                failed.append(collection.doctype)
+            else:
+                results[collection.doctype] = result
+                if not result.ok:
+                    failed.append(collection.doctype)
+        if failed:
+            logger.warning(f"Not syncing the stages after {name}: {', '.join(failed)} did not sync completely.")
+            break
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--full", action="store_true", help="ignore the stored watermarks and export everything")
+    parser.add_argument("--tally-concurrency", type=int, default=tally_source.CONCURRENCY,
+                        help="requests sent to Tally at the same time")
+    parser.add_argument("--max-workers", type=int, help="concurrent ERPNext pushes per collection")
+    parser.add_argument("--log-level", default=metrics.LOG_LEVEL, help="DEBUG shows every record, WARNING only problems")
+    parser.add_argument("--metrics-json", help="write per-doctype timings and counters to this file when done")
+    parser.add_argument("--metrics-port", type=int, help="serve /metrics (Prometheus) and /metrics.json on this port")
+    parser.add_argument("--metrics-host", default=metrics.METRICS_HOST,
+                        help="interface the metrics are served on; 0.0.0.0 for every interface")
+    parser.add_argument("--from-date", metavar="YYYYMMDD",
+                        help="earliest voucher date exported when a doctype has no watermark yet")
+    parser.add_argument("--window", choices=[*tally_stream.WINDOW_DAYS, "none"], default=tally_stream.WINDOW,
+                        help="date window of each Voucher Register request; none exports everything at once")
+    parser.add_argument("--spool", action="store_true",
+                        help="write Tally responses to disk and parse them memory-mapped, for exports too big for RAM")
+    parser.add_argument("--spool-dir", help="where spooled responses go (default: the system temp directory)")
+    parser.add_argument("--keep-spool", action="store_true", help="keep the spooled responses for replay and debugging")
+    parser.add_argument("--replay", metavar="PATH",
+                        help="read the exports from a capture (.xml or .xml.gz) or a --keep-spool directory "
+                             "instead of Tally; implies --full")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="count the ERPNext requests instead of sending them; sync state goes to a temp dir")
+    parser.add_argument("--only", nargs="*", help="doctypes to sync, e.g. Customer 'Sales Invoice'")
+    parser.add_argument("--fetch-fields", action="store_true",
+                        help="export only the fields the sync reads, through TDL collections (not yet verified "
+                             "on every Tally release)")
+    parser.add_argument("--xml-parser", choices=["auto", "lxml", "etree"], default=xml_backend.PARSER,
+                        help="XML parser for the exports; auto uses lxml when it is installed")
+    parser.add_argument("--batch-backend", choices=["auto", "numpy", "python"], default=batch_transform.BACKEND,
+                        help="how voucher lines are transformed; auto uses numpy when it is installed")
+    parser.add_argument("--batch-size", type=int, default=batch_transform.BATCH_SIZE,
+                        help="vouchers transformed together")
+    args = parser.parse_args()
+    try:
+        xml_backend.configure(parser=args.xml_parser)
+        batch_transform.configure(backend=args.batch_backend, batch_size=args.batch_size)
+    except ValueError as e:
+        parser.error(str(e))
+    metrics.setup_logging(args.log_level)
+    http_client.configure(pool_size=pool_size(args.max_workers))
+    tally_stream.EXPORT_FROM_DATE = args.from_date or tally_stream.EXPORT_FROM_DATE
+    tally_stream.WINDOW = None if args.window == "none" else args.window
+    tally_stream.SPOOL = args.spool or args.keep_spool
+    tally_stream.SPOOL_DIR = args.spool_dir
+    tally_stream.KEEP_SPOOL = args.keep_spool
+    tally_envelope.FETCH_FIELDS = args.fetch_fields
+    if args.metrics_port:
+        metrics.serve(args.metrics_port, args.metrics_host)
+    if args.replay:
+        use_source(open_source(args.replay))
+    sink = dry_run.install() if args.dry_run else None
+    try:
+        asyncio.run(sync_all(args.max_workers, args.full or bool(args.replay), args.tally_concurrency, args.only))
+    finally:
+        if sink is not None:
+            dry_run.report(sink)
+        close_sessions()
+        close_ref_cache()
+        if args.metrics_json:
+            metrics.write_json(args.metrics_json)
+
+
+if __name__ == "__main__":
+    main()
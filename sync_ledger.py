@@ -0,0 +1,188 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+from datetime import datetime
+
+from erpnext_index import fetch_names_by_field
+from push_pool import Rejected
+from records import Record
+
+logger = logging.getLogger(__name__)
+
+LEDGER_FILE = "sync_ledger.sqlite3"
+
+NEW = "new"
+CHANGED = "changed"
+UNCHANGED = "unchanged"
+
+
+def _jsonable(value):
+    # Records normalise exactly like the dicts they replaced; Decimals as their text.
+    return value.as_dict() if isinstance(value, Record) else str(value)
+
+
+def normalise(record):
+    return json.dumps(record, sort_keys=True, default=_jsonable)
+
+
+def content_hash(record):
+    return hashlib.sha256(normalise(record).encode("utf-8")).hexdigest()
+
+
+def changed_fields(previous, current):
+    """The entries of payload `current` that differ from payload `previous`."""
+    return {field: value for field, value in current.items() if previous.get(field) != value}
+
+
+class SyncLedger:
+    """Local record of what has already been pushed to ERPNext.
+
+    Rows are keyed by (doctype, Tally voucher number / master name). Each row
+    stores the hash of the record that was pushed, the record itself (so an
+    update can send only what changed) and the ERPNext document name it
+    produced.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or LEDGER_FILE
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS synced_records (
+                doctype TEXT NOT NULL,
+                tally_key TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                erp_name TEXT,
+                synced_at TEXT NOT NULL,
+                content TEXT,
+                PRIMARY KEY (doctype, tally_key)
+            )"""
+        )
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(synced_records)")]
+        if "content" not in columns:
+            self._conn.execute("ALTER TABLE synced_records ADD COLUMN content TEXT")
+        self._conn.commit()
+
+    def lookup(self, doctype, tally_key):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT content_hash, erp_name FROM synced_records WHERE doctype = ? AND tally_key = ?",
+                (doctype, str(tally_key)),
+            ).fetchone()
+
+    def classify(self, doctype, tally_key, record):
+        """Return (NEW | CHANGED | UNCHANGED, erp_name) for a record about to be pushed."""
+        row = self.lookup(doctype, tally_key)
+        if row is None:
+            return NEW, None
+        stored_hash, erp_name = row
+        if stored_hash == content_hash(record):
+            return UNCHANGED, erp_name
+        return CHANGED, erp_name
+
+    def previous(self, doctype, tally_key):
+        """The record as it was last pushed, or None if it was not stored."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT content FROM synced_records WHERE doctype = ? AND tally_key = ?",
+                (doctype, str(tally_key)),
+            ).fetchone()
+        return json.loads(row[0]) if row and row[0] else None
+
+    def record(self, doctype, tally_key, record, erp_name):
+        content = normalise(record)
+        self._write(doctype, tally_key, hashlib.sha256(content.encode("utf-8")).hexdigest(), erp_name, content)
+
+    def adopt(self, doctype, tally_key, erp_name):
+        """Link a record to a document ERPNext already has.
+
+        No hash or content is stored, so the record classifies as CHANGED
+        and its next push updates the document with the full payload.
+        """
+        self._write(doctype, tally_key, "", erp_name, None)
+
+    def _write(self, doctype, tally_key, hash_value, erp_name, content):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO synced_records (doctype, tally_key, content_hash, erp_name, synced_at, content)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (doctype, str(tally_key), hash_value, erp_name, datetime.now().isoformat(), content),
+            )
+            self._conn.commit()
+
+    def forget(self, doctype, tally_key=None):
+        """Drop ledger rows so the next run pushes those records again."""
+        with self._lock:
+            if tally_key is None:
+                self._conn.execute("DELETE FROM synced_records WHERE doctype = ?", (doctype,))
+            else:
+                self._conn.execute(
+                    "DELETE FROM synced_records WHERE doctype = ? AND tally_key = ?", (doctype, str(tally_key))
+                )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def ledger_push(ledger, doctype, key, add, update=None, diff=False):
+    """Wrap an add_*_to_erpnext function so the ledger is consulted first.
+
+    Unchanged records are skipped without any HTTP call. Changed records go
+    to `update(record, erp_name)` when the doctype supports updating in place;
+    otherwise push raises Rejected, so they count as failed in the summary
+    and metrics. New records go to `add`.
+    With diff=True the update is called as `update(record, erp_name,
+    previous)`, where `previous` is the record as last pushed (None if it is
+    not known), so only the fields that changed need to be sent.
+    push(record, classified) takes the (state, erp_name) of a caller that
+    already classified the record.
+    """
+    def push(record, classified=None):
+        tally_key = key(record)
+        state, erp_name = classified or ledger.classify(doctype, tally_key, record)
+        if state == UNCHANGED:
+            logger.debug(f"{doctype} {tally_key} is unchanged since the last sync, skipping...")
+            return erp_name
+        if state == CHANGED:
+            if update is None:
+                raise Rejected(f"{doctype} {tally_key} changed in Tally but {erp_name} cannot be updated in place")
+            if diff:
+                result = update(record, erp_name, ledger.previous(doctype, tally_key))
+            else:
+                result = update(record, erp_name)
+        else:
+            result = add(record)
+        if result:
+            ledger.record(doctype, tally_key, record, result)
+        return result
+    return push
+
+
+def adopt_existing(ledger, doctype, records, key, field, existing=None):
+    """Link records ERPNext already has, but the ledger does not, to their documents.
+
+    Masters that already existed used to be skipped, so later edits made in
+    Tally (GSTIN, address, pincode...) never reached ERPNext. Adopted records
+    go through the update path on their next push. `key(record)` must be
+    the value of `field` in ERPNext. `existing`, when given, is the set of
+    `field` values known to exist and limits the lookup to those.
+    """
+    unknown = []
+    for record in records:
+        value = key(record)
+        if (existing is None or value in existing) and ledger.lookup(doctype, value) is None:
+            unknown.append(value)
+    if not unknown:
+        return 0
+    names = fetch_names_by_field(doctype, field, unknown)
+    for value, erp_name in names.items():
+        ledger.adopt(doctype, value, erp_name)
+    if names:
+        logger.info(f"Linked {len(names)} existing {doctype} record(s) in ERPNext to the sync ledger.")
+    return len(names)
@@ -0,0 +1,156 @@
+"""Export requests for Tally that fetch only the fields the parsers read.
+
+With FETCH_FIELDS set, every export is a TDL collection with an explicit
+FETCH list instead of NATIVEMETHOD * or the full Voucher Register report,
+so Tally only computes and sends the methods a doctype uses. fetch_list()
+derives the list from the doctype's FieldPlan: each path becomes a method
+path with sub-collections (.LIST tags) as prefixes,
+
+    ".//LEDMAILINGDETAILSLIST/STATE"               -> LEDMAILINGDETAILS.STATE
+    Group(".//ALLINVENTORYENTRIES.LIST") / ".//RATE" -> ALLINVENTORYENTRIES.RATE
+
+A `.//TAG` path does not say which sub-collection TAG lives in; `methods`
+maps such a field key to the method paths to fetch instead. ALTERID is
+always fetched for the watermark.
+
+FETCH_FIELDS is off until the voucher collections have been checked
+against the Tally releases in use; meanwhile the old requests are sent
+(NATIVEMETHOD * for masters, the Voucher Register report for vouchers).
+A voucher collection is limited to the SVFROMDATE/SVTODATE of its window
+by an explicit $Date filter, since the static variables alone need not
+restrict a collection the way they restrict the report.
+"""
+from xml.sax.saxutils import escape
+
+FETCH_FIELDS = False
+# Fetched for every collection: the watermark reads ALTERID.
+ALWAYS_FETCH = ("ALTERID",)
+EXPORT_FORMAT = "$$SysName:XML"
+# The company the voucher exports were written against.
+COMPANY = {"SVCURRENTCOMPANY": "$etca_name"}
+# Voucher Register display options the full report requests were sent with.
+REGISTER_VARIABLES = {"SHOWCREATEDBY": "YES", "SHOWPARTYNAME": "YES"}
+# A master's name is its NAME method; full exports also list it under LANGUAGENAME.
+MASTER_NAME = ("NAME", "LANGUAGENAME.NAME")
+# Keeps a voucher collection to the date range stream_voucher_register asks for.
+VOUCHER_DATE_FILTER = "$Date >= ##SVFromDate AND $Date <= ##SVToDate"
+# Order due dates are kept per batch allocation; some exports repeat them on the voucher.
+ORDER_DUE_DATE = ("ORDERDUEDATE", "ALLINVENTORYENTRIES.BATCHALLOCATIONS.ORDERDUEDATE")
+
+
+def method_path(path):
+    """The TDL method path of an ElementPath, e.g. ".//LEDMAILINGDETAILSLIST//ADDRESSLIST/ADDRESS" -> "LEDMAILINGDETAILS.ADDRESS"."""
+    names = []
+    for tag in path.split("/"):
+        if tag in ("", "."):
+            continue
+        # The ledger sanitiser drops the dot of ".LIST".
+        if tag.endswith(".LIST"):
+            tag = tag[:-5]
+        elif tag.endswith("LIST"):
+            tag = tag[:-4]
+        # ADDRESS.LIST/ADDRESS is the one list method ADDRESS.
+        if not names or names[-1] != tag:
+            names.append(tag)
+    return ".".join(names)
+
+
+def fetch_list(plan, methods=None, prefix=""):
+    """Method paths for every field and group of a FieldPlan, in plan order."""
+    methods = methods or {}
+    names = []
+    for field in plan.fields:
+        names.extend(methods.get(field.key) or [prefix + method_path(field.path)])
+    for group in plan.groups:
+        names.extend(fetch_list(group.fields, methods, prefix + method_path(group.path) + "."))
+    return list(dict.fromkeys(names))
+
+
+def static_variables_xml(static_variables):
+    return "".join(f"<{tag}>{escape(value)}</{tag}>" for tag, value in static_variables.items())
+
+
+def collection_request(name, object_type, fetch, filters=None, watermark=None, static_variables=None):
+    """Export envelope for a TDL collection of `object_type` objects.
+
+    `filters` maps formula names to TDL formulae that must all hold. With a
+    watermark only objects altered since the last sync are exported.
+    static_variables (e.g. SVCURRENTCOMPANY) go next to SVEXPORTFORMAT.
+    """
+    filters = filters or {}
+    filter_names = list(filters)
+    formulae = [f'<SYSTEM TYPE="Formulae" NAME="{formula_name}">{escape(formula)}</SYSTEM>'
+                for formula_name, formula in filters.items()]
+    filter_name, filter_formula = watermark.alter_id_filter() if watermark else ("", "")
+    if filter_name:
+        filter_names.append(filter_name)
+        formulae.append(filter_formula)
+    filter_tag = f"<FILTER>{','.join(filter_names)}</FILTER>" if filter_names else ""
+    if FETCH_FIELDS:
+        methods = f"<FETCH>{', '.join(dict.fromkeys([*ALWAYS_FETCH, *fetch]))}</FETCH>"
+    else:
+        methods = "<NATIVEMETHOD>*</NATIVEMETHOD>"
+    variables = static_variables_xml({"SVEXPORTFORMAT": EXPORT_FORMAT, **(static_variables or {})})
+    return f"""<ENVELOPE>
+    <HEADER>
+        <VERSION>1</VERSION>
+        <TALLYREQUEST>Export</TALLYREQUEST>
+        <TYPE>Collection</TYPE>
+        <ID>{name}</ID>
+    </HEADER>
+    <BODY>
+        <DESC>
+            <STATICVARIABLES>{variables}</STATICVARIABLES>
+            <TDL>
+                <TDLMESSAGE>
+                    <COLLECTION NAME="{name}" ISMODIFY="No" ISFIXED="No" ISINITIALIZE="No" ISOPTION="No" ISINTERNAL="No">
+                        <TYPE>{object_type}</TYPE>
+                        {methods}
+                        {filter_tag}
+                    </COLLECTION>
+                    {''.join(formulae)}
+                </TDLMESSAGE>
+            </TDL>
+        </DESC>
+    </BODY>
+</ENVELOPE>
+"""
+
+
+def voucher_collection_name(voucher_type):
+    return voucher_type.replace(" ", "") + "Vouchers"
+
+
+def voucher_register_request(voucher_type, static_variables=None):
+    """The Voucher Register report for one voucher type, every field of every voucher."""
+    variables = static_variables_xml({**(static_variables or {}), **REGISTER_VARIABLES, "VOUCHERTYPENAME": voucher_type})
+    return f"""<ENVELOPE>
+    <HEADER>
+        <TALLYREQUEST>Export Data</TALLYREQUEST>
+    </HEADER>
+    <BODY>
+        <EXPORTDATA>
+            <REQUESTDESC>
+                <STATICVARIABLES>{variables}</STATICVARIABLES>
+                <REPORTNAME>Voucher Register</REPORTNAME>
+            </REQUESTDESC>
+        </EXPORTDATA>
+    </BODY>
+</ENVELOPE>
+"""
+
+
+def voucher_request(voucher_type, plan, methods=None, static_variables=None):
+    """Export envelope for the vouchers of one type with the fields of `plan`.
+
+    stream_voucher_register adds the date range to its STATICVARIABLES;
+    the collection filters on it with VOUCHER_DATE_FILTER.
+    """
+    if not FETCH_FIELDS:
+        return voucher_register_request(voucher_type, static_variables)
+    filters = {
+        "IsRequestedVoucherType": f'$VoucherTypeName = "{voucher_type}"',
+        "IsInRequestedDates": VOUCHER_DATE_FILTER,
+    }
+    return collection_request(voucher_collection_name(voucher_type), "Voucher", fetch_list(plan, methods), filters,
+                              static_variables=static_variables)
@@ -0,0 +1,143 @@
+"""Where Tally exports come from: the live Tally HTTP server, or captures of it.
+
+Captures are the raw responses kept with `sync_all.py --keep-spool`
+(tally_stream.KEEP_SPOOL), optionally gzipped. A directory of them is
+replayed one collection at a time: a collection reads the files whose names
+start with its doctype (spaces as underscores), in name order, which for
+Voucher Register windows is date order.
+
+    use_source(open_source("captures/"))      # every get_*_from_tally now replays
+    get_sales_invoices_from_tally(source=FileSource("sales.xml.gz"))
+"""
+import gzip
+import os
+import threading
+
+from http_client import tally_session
+
+CAPTURE_SUFFIXES = (".xml", ".xml.gz")
+GZIP_MAGIC = b"\x1f\x8b"
+# Tally's HTTP server handles exports more or less one at a time, so only
+# this many requests are sent to it at once, however many collections are
+# being synced. Raise it for an instance that copes with more.
+CONCURRENCY = 2
+
+_source = None
+_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(CONCURRENCY)
+
+
+def _release_on_close(response, slots):
+    close = response.close
+    released = threading.Lock()
+
+    def close_and_release():
+        try:
+            close()
+        finally:
+            if released.acquire(blocking=False):
+                slots.release()
+
+    response.close = close_and_release
+    return response
+
+
+class HTTPSource:
+    """The live Tally server, through the shared keep-alive session.
+
+    Each request holds one of the CONCURRENCY slots until its response has
+    been read: for stream=True, until the response is closed. Pushing what
+    was exported does not hold a slot.
+    """
+
+    live = True
+
+    def post(self, url, **kwargs):
+        slots = _slots
+        slots.acquire()
+        try:
+            response = tally_session().post(url, **kwargs)
+        except BaseException:
+            slots.release()
+            raise
+        if not kwargs.get("stream"):
+            slots.release()
+            return response
+        return _release_on_close(response, slots)
+
+
+class FileSource:
+    """One captured export, plain or gzipped, replayed for every collection that asks."""
+
+    live = False
+
+    def __init__(self, path):
+        self.path = path
+
+    def captures(self, doctype=None):
+        return [self.path]
+
+
+class DirectorySource:
+    """A directory of captured exports, picked per collection by file name prefix."""
+
+    live = False
+
+    def __init__(self, path):
+        self.path = path
+
+    def captures(self, doctype=None):
+        names = sorted(name for name in os.listdir(self.path) if name.endswith(CAPTURE_SUFFIXES))
+        if doctype:
+            prefix = doctype.replace(" ", "_") + "-"
+            names = [name for name in names if name.startswith(prefix)]
+        return [os.path.join(self.path, name) for name in names]
+
+
+def is_gzip(path):
+    with open(path, "rb") as f:
+        return f.read(2) == GZIP_MAGIC
+
+
+def iter_gzip_chunks(path, chunk_size):
+    with gzip.open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+def open_source(spec):
+    """Build a source from a CLI value: "http" (or nothing), a capture file or a directory of them."""
+    if not spec or spec == "http":
+        return HTTPSource()
+    if os.path.isdir(spec):
+        return DirectorySource(spec)
+    if os.path.isfile(spec):
+        return FileSource(spec)
+    raise ValueError(f"No Tally capture at {spec}")
+
+
+def tally_source():
+    """Return the source get_*_from_tally uses when none is passed (live Tally by default)."""
+    global _source
+    if _source is None:
+        with _lock:
+            if _source is None:
+                _source = HTTPSource()
+    return _source
+
+
+def configure(concurrency=None):
+    """Change how many requests are sent to Tally at once."""
+    global CONCURRENCY, _slots
+    if concurrency is not None:
+        CONCURRENCY = concurrency
+        _slots = threading.BoundedSemaphore(concurrency)
+
+
+def use_source(source):
+    global _source
+    with _lock:
+        _source = source
@@ -0,0 +1,433 @@
+import codecs
+import logging
+import mmap
+import os
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+import requests
+from urllib3.exceptions import ReadTimeoutError
+
+import metrics
+from pipeline import run_stage
+from tally_source import is_gzip, iter_gzip_chunks, tally_source
+import xml_backend
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+# Voucher Register exports are requested one date window at a time. None
+# sends a single request for the whole period.
+WINDOW_DAYS = {"day": 1, "week": 7, "month": 30}
+WINDOW = "month"
+# Earliest voucher date (YYYYMMDD) to export when no watermark is stored yet.
+# Windows need a start date: without this or a stored watermark the export
+# is sent as a single request for Tally's default period.
+EXPORT_FROM_DATE = None
+# A window whose response is bigger or slower than this halves the windows
+# that follow it.
+MAX_WINDOW_BYTES = 32 * 1024 * 1024
+MAX_WINDOW_SECONDS = 5
+# With SPOOL set, each Tally response is written to a file in SPOOL_DIR (the
+# system temp directory when None) and parsed from a memory-mapped view, so
+# neither the raw export nor a decoded copy of it is ever held in memory and
+# the connection is released as soon as the export is on disk. KEEP_SPOOL
+# leaves the raw responses behind for replay and debugging.
+SPOOL = False
+SPOOL_DIR = None
+KEEP_SPOOL = False
+
+
+def find_safe_split(data):
+    """Return the offset just past the last closing tag in data.
+
+    The sanitisers never match across a closing tag boundary, so
+    everything before this offset can be sanitised without the rest of
+    the document.
+    """
+    idx = len(data)
+    while True:
+        idx = data.rfind(b"</", 0, idx)
+        if idx == -1:
+            return 0
+        end = data.find(b">", idx)
+        if end != -1:
+            return end + 1
+
+
+def is_ascii_compatible(encoding):
+    try:
+        return "<A/>".encode(encoding) == b"<A/>"
+    except LookupError:
+        return False
+
+
+def iter_byte_chunks(chunks, encoding=None):
+    """Yield chunks as bytes the sanitisers can work on directly.
+
+    UTF-8 and the single-byte encodings pass through untouched. Anything
+    else (e.g. UTF-16) is transcoded to UTF-8 incrementally.
+    """
+    if not encoding or is_ascii_compatible(encoding):
+        yield from chunks
+        return
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    for chunk in chunks:
+        yield decoder.decode(chunk).encode("utf-8")
+    yield decoder.decode(b"", final=True).encode("utf-8")
+
+
+def iter_sanitised_chunks(chunks, sanitise, encoding=None):
+    """Sanitise a byte stream in pieces cut after closing tags."""
+    pending = b""
+    for chunk in iter_byte_chunks(chunks, encoding):
+        if not chunk:
+            continue
+        pending += chunk
+        split = find_safe_split(pending)
+        if split:
+            yield sanitise(pending[:split])
+            pending = pending[split:]
+    if pending:
+        yield sanitise(pending)
+
+
+def spool_chunks(chunks, doctype=None, label=None):
+    """Write a response body to a new spool file and return its path."""
+    if SPOOL_DIR:
+        os.makedirs(SPOOL_DIR, exist_ok=True)
+    prefix = "-".join(part.replace(" ", "_") for part in (doctype or "tally", label) if part) + "-"
+    spool = tempfile.NamedTemporaryFile("wb", prefix=prefix, suffix=".xml", dir=SPOOL_DIR, delete=False)
+    try:
+        with spool:
+            for chunk in chunks:
+                spool.write(chunk)
+    except BaseException:
+        os.unlink(spool.name)
+        raise
+    return spool.name
+
+
+def iter_spooled_chunks(path, keep=None):
+    """Yield a spool file in CHUNK_SIZE slices of a read-only memory map.
+
+    The file is deleted once it has been read, unless `keep` (KEEP_SPOOL
+    when None) is set.
+    """
+    remove = not (KEEP_SPOOL if keep is None else keep)
+    try:
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                    if hasattr(view, "madvise"):
+                        view.madvise(mmap.MADV_SEQUENTIAL)
+                    for start in range(0, len(view), CHUNK_SIZE):
+                        yield view[start:start + CHUNK_SIZE]
+    finally:
+        if remove:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+        elif keep is None:
+            logger.info(f"Kept the Tally export in {path}")
+
+
+def iter_capture_chunks(path):
+    """Yield a captured export (plain or gzipped) in CHUNK_SIZE pieces, leaving the file in place."""
+    if is_gzip(path):
+        return iter_gzip_chunks(path, CHUNK_SIZE)
+    return iter_spooled_chunks(path, keep=True)
+
+
+def replay_captures(source, tag, sanitise, doctype=None, pipeline=None):
+    """Yield `tag` elements from every capture `source` holds for `doctype`."""
+    paths = source.captures(doctype)
+    if not paths:
+        logger.warning(f"No Tally capture to replay for {doctype or 'this export'}.")
+    for path in paths:
+        logger.info(f"Replaying {doctype or 'Tally export'} from {path}")
+        chunks = run_stage(pipeline, "fetch", iter_capture_chunks(path))
+        sanitised = run_stage(pipeline, "sanitise", iter_sanitised_chunks(chunks, sanitise))
+        yield from iter_elements(sanitised, tag, doctype)
+
+
+def iter_elements(chunks, tag, doctype=None):
+    """Incrementally parse chunks, yielding each completed `tag` element.
+
+    Elements are detached from the tree as soon as they are finished, so
+    only the ancestors of the element being built are kept in memory. The
+    time spent parsing (not waiting for chunks or for the consumer) is
+    recorded as the "parse" phase of `doctype`.
+    """
+    parser = xml_backend.pull_parser(("start", "end"))
+    stack = []
+    inside = 0
+    parsing = 0.0
+    try:
+        for chunk in chunks:
+            started = time.perf_counter()
+            parser.feed(chunk)
+            for event, elem in parser.read_events():
+                if event == "start":
+                    stack.append(elem)
+                    if elem.tag == tag:
+                        inside += 1
+                    continue
+                stack.pop()
+                if elem.tag == tag:
+                    inside -= 1
+                    if inside == 0:
+                        parsing += time.perf_counter() - started
+                        yield elem
+                        started = time.perf_counter()
+                if inside == 0 and stack:
+                    stack[-1].remove(elem)
+                    elem.clear()
+            parsing += time.perf_counter() - started
+        parser.close()
+    finally:
+        metrics.observe("parse", doctype, parsing)
+
+
+def _hold(watermark, reason):
+    if watermark is not None:
+        watermark.hold(reason)
+
+
+def stream_tally_export(url, xml_request, tag, sanitise, headers=None, timeout=None, watermark=None, pipeline=None,
+                        doctype=None, source=None):
+    """POST an export request to Tally and yield `tag` elements as they arrive.
+
+    If the export fails part way, `watermark` is held so the partial run does
+    not move it forward. With a `pipeline`, reading the response and
+    sanitising it run as its "fetch" and "sanitise" stages. `source`
+    defaults to tally_source(); one that is not live replays its captures.
+    """
+    headers = headers or {"Content-Type": "text/xml"}
+    source = source or tally_source()
+    sanitise = metrics.timed_call("sanitise", doctype, sanitise)
+    try:
+        if not source.live:
+            yield from replay_captures(source, tag, sanitise, doctype, pipeline)
+            return
+        metrics.incr("tally_requests", doctype)
+        with metrics.timed("tally_request", doctype):
+            response = source.post(url, data=xml_request, headers=headers, timeout=timeout, stream=True)
+        with response:
+            if response.status_code != 200:
+                logger.warning(f"Failed to connect to Tally. Status code: {response.status_code}")
+                _hold(watermark, f"Tally returned status {response.status_code}")
+                return
+            chunks = run_stage(pipeline, "fetch", response.iter_content(chunk_size=CHUNK_SIZE))
+            if SPOOL:
+                chunks = iter_spooled_chunks(spool_chunks(chunks, doctype))
+            sanitised = run_stage(pipeline, "sanitise", iter_sanitised_chunks(chunks, sanitise, response.encoding))
+            yield from iter_elements(sanitised, tag, doctype)
+    except requests.exceptions.RequestException as e:
+        metrics.incr("tally_errors", doctype)
+        logger.warning(f"Error connecting to Tally: {e}")
+        _hold(watermark, "the Tally export failed")
+    except xml_backend.PARSE_ERRORS as e:
+        logger.warning(f"Error parsing XML: {e}")
+        _hold(watermark, "the Tally export could not be parsed")
+
+
+def date_variables(from_date, to_date):
+    """SVFROMDATE/SVTODATE static variables for a Voucher Register request."""
+    return (f"<SVFROMDATE TYPE=\"Date\">{from_date:%Y%m%d}</SVFROMDATE>"
+            f"<SVTODATE TYPE=\"Date\">{to_date:%Y%m%d}</SVTODATE>")
+
+
+def with_date_range(xml_request, from_date, to_date):
+    """Add a date range to the STATICVARIABLES of an export request."""
+    return xml_request.replace("</STATICVARIABLES>", date_variables(from_date, to_date) + "</STATICVARIABLES>", 1)
+
+
+def is_timeout(error):
+    if isinstance(error, requests.exceptions.Timeout):
+        return True
+    # Read timeouts that used up the adapter's retries arrive wrapped in a ConnectionError.
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(reason, ReadTimeoutError)
+
+
+def fetch_window(source, url, xml_request, headers, timeout, doctype=None, label=None):
+    """POST one window's export; returns (response, spool file path or None, seconds).
+
+    Without SPOOL only the headers have been read: the caller streams the
+    body and must close the response.
+    """
+    started = time.monotonic()
+    if not SPOOL:
+        response = source.post(url, data=xml_request, headers=headers, timeout=timeout, stream=True)
+        return response, None, time.monotonic() - started
+    path = None
+    with source.post(url, data=xml_request, headers=headers, timeout=timeout, stream=True) as response:
+        if response.status_code == 200:
+            path = spool_chunks(response.iter_content(chunk_size=CHUNK_SIZE), doctype, label)
+    return response, path, time.monotonic() - started
+
+
+def window_label(window):
+    return f"{window[0]:%Y%m%d}-{window[1]:%Y%m%d}"
+
+
+def discard_window(future):
+    """Release a prefetched window that will not be read: close its response or delete its spool file."""
+    if future is None:
+        return
+    try:
+        response, path, _ = future.result()
+    except requests.exceptions.RequestException:
+        return
+    if path is None:
+        response.close()
+    elif not KEEP_SPOOL:
+        os.unlink(path)
+
+
+def iter_metered_chunks(chunks, meter):
+    """Pass chunks through, adding their bytes and the seconds spent waiting for them to `meter`."""
+    chunks = iter(chunks)
+    while True:
+        started = time.monotonic()
+        chunk = next(chunks, None)
+        meter["seconds"] += time.monotonic() - started
+        if chunk is None:
+            return
+        meter["bytes"] += len(chunk)
+        yield chunk
+
+
+def shrink_window(days, size, elapsed, label):
+    """Halve `days` after a window larger than MAX_WINDOW_BYTES or slower than MAX_WINDOW_SECONDS."""
+    if days > 1 and (size > MAX_WINDOW_BYTES or elapsed > MAX_WINDOW_SECONDS):
+        days = max(1, days // 2)
+        logger.info(f"Tally took {elapsed:.1f}s for {size} bytes on {label}, "
+                    f"shrinking windows to {days} day(s)...")
+    return days
+
+
+def next_window(pending, cursor, end, days):
+    """Return (window, new cursor): a pending split window first, else the next `days` from cursor."""
+    if pending:
+        return pending.popleft(), cursor
+    if cursor > end:
+        return None, cursor
+    window_end = min(cursor + timedelta(days=days - 1), end)
+    return (cursor, window_end), window_end + timedelta(days=1)
+
+
+def stream_voucher_register(url, xml_request, sanitise, watermark=None, headers=None, timeout=None, window=None,
+                            pipeline=None, doctype=None, source=None):
+    """Yield the VOUCHER elements of a Voucher Register export, one date window at a time.
+
+    The export covers the watermark's voucher date (or EXPORT_FROM_DATE) up
+    to today. Tally answers one request at a time, so window N+1 is only
+    requested once window N has been read: with SPOOL that is as soon as N
+    is on disk, so N+1 is fetched while N is parsed and pushed by the
+    caller; without it, after N has been streamed to the end. A window
+    that comes back larger than MAX_WINDOW_BYTES or slower than
+    MAX_WINDOW_SECONDS halves the windows after it. A window that times out
+    is split in two and retried, down to a single day. With no window, or
+    no start date, this is a single stream_tally_export call.
+    With a `pipeline`, each window is sanitised on its "sanitise" stage.
+    Timings and request counts are recorded in metrics under `doctype`.
+    A `source` that is not live Tally replays its captures instead.
+    """
+    headers = headers or {"Content-Type": "text/xml"}
+    window = window or WINDOW
+    start = (watermark.voucher_date if watermark else None) or EXPORT_FROM_DATE
+    if start:
+        start = datetime.strptime(start, "%Y%m%d").date()
+    source = source or tally_source()
+    if source.live and not start and window in WINDOW_DAYS:
+        logger.info(f"No start date for the {doctype or 'Voucher Register'} export, sending it as one request. "
+                    f"Set tally_stream.EXPORT_FROM_DATE (sync_all.py --from-date) to export it in windows.")
+    if not source.live or not start or window not in WINDOW_DAYS:
+        if start:
+            xml_request = with_date_range(xml_request, start, date.today())
+        yield from stream_tally_export(url, xml_request, "VOUCHER", sanitise, headers, timeout, watermark, pipeline,
+                                       doctype, source)
+        return
+
+    sanitise = metrics.timed_call("sanitise", doctype, sanitise)
+    end = date.today()
+    days = WINDOW_DAYS[window]
+    pending = deque()
+    current, cursor = next_window(pending, start, end, days)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        def submit(window):
+            return executor.submit(fetch_window, source, url, with_date_range(xml_request, *window), headers, timeout,
+                                   doctype, window_label(window))
+
+        future = submit(current)
+        try:
+            while future is not None:
+                window_start, window_end = current
+                label = window_label(current)
+                metrics.incr("tally_requests", doctype)
+                try:
+                    response, path, elapsed = future.result()
+                except requests.exceptions.RequestException as e:
+                    metrics.incr("tally_errors", doctype)
+                    if not is_timeout(e) or window_start == window_end:
+                        logger.warning(f"Error connecting to Tally: {e}")
+                        _hold(watermark, f"the {label} export failed")
+                        return
+                    logger.warning(f"Tally timed out on {label}, splitting the window...")
+                    middle = window_start + (window_end - window_start) // 2
+                    pending.appendleft((middle + timedelta(days=1), window_end))
+                    days = max(1, days // 2)
+                    current = (window_start, middle)
+                    future = submit(current)
+                    continue
+                if response.status_code != 200:
+                    response.close()
+                    logger.warning(f"Failed to connect to Tally. Status code: {response.status_code}")
+                    _hold(watermark, f"Tally returned status {response.status_code}")
+                    return
+                metrics.observe("tally_request", doctype, elapsed)
+                future = None
+                meter = None
+                if path is None:
+                    # Streamed while it is parsed: the next window waits until
+                    # this one has been read, and is sized by it then.
+                    meter = {"bytes": 0, "seconds": 0.0}
+                    chunks = run_stage(pipeline, "fetch",
+                                       iter_metered_chunks(response.iter_content(chunk_size=CHUNK_SIZE), meter))
+                else:
+                    size = os.path.getsize(path)
+                    chunks = iter_spooled_chunks(path)
+                    days = shrink_window(days, size, elapsed, label)
+                    if pipeline is not None:
+                        pipeline.record("fetch", -(-size // CHUNK_SIZE), elapsed)
+                    current, cursor = next_window(pending, cursor, end, days)
+                    if current is not None:
+                        future = submit(current)
+
+                sanitised = run_stage(pipeline, "sanitise", iter_sanitised_chunks(chunks, sanitise, response.encoding))
+                try:
+                    with response:
+                        yield from iter_elements(sanitised, "VOUCHER", doctype)
+                except requests.exceptions.RequestException as e:
+                    metrics.incr("tally_errors", doctype)
+                    logger.warning(f"Error reading the {label} export from Tally: {e}")
+                    _hold(watermark, f"the {label} export failed")
+                    return
+                except xml_backend.PARSE_ERRORS as e:
+                    logger.warning(f"Error parsing XML: {e}")
+                    _hold(watermark, f"the {label} export could not be parsed")
+                    return
+                if meter is not None:
+                    days = shrink_window(days, meter["bytes"], elapsed + meter["seconds"], label)
+                    current, cursor = next_window(pending, cursor, end, days)
+                    if current is not None:
+                        future = submit(current)
+        finally:
+            discard_window(future)
@@ -0,0 +1,60 @@
+import json
+import os
+import sys
+
+import pytest
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import http_client  # noqa: E402
+
+
+def erp_response(status, body=None):
+    response = requests.Response()
+    response.status_code = status
+    response.url = "ERP_URL"
+    response._content = json.dumps(body if body is not None else {}).encode()
+    return response
+
+
+class FakeERP:
+    """Stands in for the shared "erp" session.
+
+    Each request gets the next (status, body) queued in `replies`, or a
+    200 naming the document "DOC-n" once they run out. Requests are kept
+    in `requests` as (method, url, json).
+    """
+
+    def __init__(self, *replies):
+        self.replies = list(replies)
+        self.requests = []
+
+    def request(self, method, url, json=None, **kwargs):
+        self.requests.append((method, url, json))
+        if self.replies:
+            return erp_response(*self.replies.pop(0))
+        return erp_response(200, {"data": {"name": f"DOC-{len(self.requests)}"}})
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request("PUT", url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request("DELETE", url, **kwargs)
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def erp():
+    fake = FakeERP()
+    http_client.set_session("erp", fake)
+    yield fake
+    http_client.close_sessions()
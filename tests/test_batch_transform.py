@@ -0,0 +1,43 @@
+from decimal import Decimal
+
+import pytest
+
+import batch_transform
+import metrics
+from batch_transform import NumericColumn, check_totals
+
+BACKENDS = ["python"] + (["numpy"] if batch_transform.numpy is not None else [])
+
+
+@pytest.fixture(params=BACKENDS)
+def backend(request, monkeypatch):
+    monkeypatch.setattr(batch_transform, "BACKEND", request.param)
+    metrics.reset()
+    yield request.param
+    metrics.reset()
+
+
+def sums(texts, starts):
+    return NumericColumn(texts).sums(starts)
+
+
+def test_check_totals_counts_unbalanced_vouchers(backend, caplog):
+    batch = [{"voucher_no": " 1 "}, {"voucher_no": "2"}, {"voucher_no": "3"}, {"voucher_no": "4"}]
+    # Voucher 1 balances (signs ignored), 2 is off by 5, 3 has no lines, 4 is within the tolerance.
+    lines = sums(["10.00", "20.00", "40.00", "5.005"], [0, 2, 3, 3, 4])
+    totals = sums(["-30.00", "45.00", "99.00", "-5.00"], [0, 1, 2, 3, 4])
+    check_totals(batch, lines, totals, "Sales Invoice")
+    assert metrics.summary()["Sales Invoice"]["counters"] == {"unbalanced": 1}
+    assert "Sales Invoice 2: line amounts add up to 40.00, the voucher amount is 45.00" in caplog.text
+
+
+def test_non_numeric_amounts_are_not_checked(backend):
+    lines = sums(["abc", "10"], [0, 1, 2])
+    totals = sums(["1", "x"], [0, 1, 2])
+    check_totals([{}, {}], lines, totals, "Sales Order")
+    assert "Sales Order" not in metrics.summary()
+
+
+def test_numeric_column_reuses_conversions():
+    column = NumericColumn([" 1.50", "-2", " 1.50", None], unsigned=True)
+    assert column.values == [Decimal("1.50"), Decimal("2"), Decimal("1.50"), None]
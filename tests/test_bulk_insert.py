@@ -0,0 +1,73 @@
+from operator import itemgetter
+
+import pytest
+
+import bulk_insert
+from bulk_insert import LocalInsertMany, bulk_push
+from sync_ledger import SyncLedger
+
+key = itemgetter("customer_name")
+
+
+def payload(customer):
+    return {"customer_name": customer["customer_name"]}
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    ledger = SyncLedger(str(tmp_path / "ledger.sqlite3"))
+    yield ledger
+    ledger.close()
+
+
+@pytest.fixture
+def insert_many(monkeypatch):
+    insert_many = LocalInsertMany()
+    monkeypatch.setattr(bulk_insert, "INSERT_MANY", insert_many)
+    return insert_many
+
+
+def customers(*names):
+    return [{"customer_name": name} for name in names]
+
+
+def test_new_records_are_inserted_in_batches(ledger, insert_many):
+    added = []
+    results = bulk_push(customers("A", "B", "C", "D", "E"), ledger, "Customer", key, payload, added.append,
+                        name_field="customer_name", batch_size=2)
+    assert (results.total, results.pushed) == (5, 5)
+    assert insert_many.calls == 3
+    assert added == []
+    assert ledger.lookup("Customer", "E") is not None
+
+
+def test_rejected_batch_is_retried_one_by_one(ledger, insert_many):
+    # ERPNext already has B, so the batch holding it is rejected as a whole.
+    insert_many.docs[("Customer", "B")] = {"customer_name": "B"}
+    added = []
+
+    def add(customer):
+        added.append(customer["customer_name"])
+        return None if customer["customer_name"] == "B" else customer["customer_name"]
+
+    results = bulk_push(customers("A", "B", "C", "D"), ledger, "Customer", key, payload, add,
+                        name_field="customer_name", batch_size=2)
+    assert added == ["A", "B"]
+    assert (results.total, results.pushed) == (4, 3)
+    assert [failure.index for failure in results.failures] == [2]
+
+
+def test_known_and_existing_records_skip_the_batches(ledger, insert_many):
+    ledger.record("Customer", "A", {"customer_name": "A"}, "A")
+    added = []
+
+    def add(customer):
+        added.append(customer["customer_name"])
+        return customer["customer_name"]
+
+    results = bulk_push(customers("A", "B", "C"), ledger, "Customer", key, payload, add,
+                        name_field="customer_name", existing={"B"})
+    # A is unchanged and skipped, B goes through add, only C is batched.
+    assert added == ["B"]
+    assert list(insert_many.docs) == [("Customer", "C")]
+    assert results.pushed == 3
@@ -0,0 +1,40 @@
+import pytest
+
+import dry_run
+import http_client
+import ref_cache
+import sync_ledger
+import watermark
+from customer import add_customer_to_erpnext, is_customer_present
+from http_client import erp_session
+
+
+@pytest.fixture
+def session(tmp_path, monkeypatch):
+    for module, name in ((sync_ledger, "LEDGER_FILE"), (watermark, "WATERMARK_FILE"), (ref_cache, "REF_CACHE_FILE")):
+        monkeypatch.setattr(module, name, getattr(module, name))
+    session = dry_run.install(str(tmp_path))
+    yield session
+    http_client.close_sessions()
+    ref_cache.close_ref_cache()
+
+
+def test_state_goes_to_the_scratch_directory(session, tmp_path):
+    assert erp_session() is session
+    for path in (sync_ledger.LEDGER_FILE, watermark.WATERMARK_FILE, ref_cache.REF_CACHE_FILE):
+        assert path.startswith(str(tmp_path))
+
+
+def test_requests_are_answered_and_counted(session):
+    assert not is_customer_present("Acme")
+    assert add_customer_to_erpnext({"customer_name": "Acme"}) == "DRY-CUSTOMER-000001"
+    response = erp_session().put("ERP_URL/api/resource/Customer/Acme", json={"customer_name": "Acme"})
+    assert response.json() == {"data": {"name": "Acme"}}
+    response = erp_session().post("ERP_URL/api/method/frappe.client.insert_many",
+                                  json={"docs": [{"doctype": "Item"}, {"doctype": "Item"}]})
+    assert len(response.json()["message"]) == 2
+    # add_customer_to_erpnext checks for the customer again before adding it.
+    assert dict(session.summary()) == {
+        ("GET", "-"): 2, ("POST", "Customer"): 1, ("PUT", "Customer"): 1,
+        ("POST", "frappe.client.insert_many"): 1,
+    }
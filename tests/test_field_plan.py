@@ -0,0 +1,67 @@
+import xml.etree.ElementTree as ET
+
+from field_plan import Field, FieldPlan, Group, INVENTORY_ENTRY_FIELDS, split_path
+
+VOUCHER = ET.fromstring("""
+<VOUCHER>
+  <DATE>20240105</DATE>
+  <VOUCHERNUMBER> 42 </VOUCHERNUMBER>
+  <ALLINVENTORYENTRIES.LIST>
+    <STOCKITEMNAME>Bolt</STOCKITEMNAME>
+    <RATE>10.00</RATE>
+    <ACTUALQTY> 3</ACTUALQTY>
+    <AMOUNT>30.00</AMOUNT>
+    <BATCHALLOCATIONS.LIST><AMOUNT>30.00</AMOUNT></BATCHALLOCATIONS.LIST>
+  </ALLINVENTORYENTRIES.LIST>
+  <ALLINVENTORYENTRIES.LIST>
+    <STOCKITEMNAME>Nut</STOCKITEMNAME>
+    <RATE>2.50</RATE>
+  </ALLINVENTORYENTRIES.LIST>
+  <ALLLEDGERENTRIES.LIST>
+    <LEDGERNAME>Party</LEDGERNAME>
+    <BILLALLOCATIONS.LIST><NAME>INV-1</NAME></BILLALLOCATIONS.LIST>
+    <BILLALLOCATIONS.LIST><NAME>INV-2</NAME></BILLALLOCATIONS.LIST>
+  </ALLLEDGERENTRIES.LIST>
+</VOUCHER>
+""")
+
+
+def test_split_path():
+    assert split_path(".//A") == ("A", None)
+    assert split_path(".//A/B") == ("A", "B")
+    assert split_path(".//A//B/C") == ("A", ".//B/C")
+    assert split_path("AMOUNT") == (None, "AMOUNT")
+
+
+def test_fields_match_find():
+    plan = FieldPlan([
+        Field(".//DATE", "date"),
+        Field(".//VOUCHERNUMBER", "voucher_no", str.strip),
+        Field(".//RATE", "first_rate"),
+        Field(".//MISSING", "missing"),
+    ])
+    record = plan.extract(VOUCHER)
+    assert record == {"date": "20240105", "voucher_no": "42", "first_rate": VOUCHER.findtext(".//RATE")}
+    assert record.get("missing") is None
+
+
+def test_many_collects_every_match():
+    plan = FieldPlan([Field(".//BILLALLOCATIONS.LIST/NAME", "bills", many=True)])
+    assert plan.extract(VOUCHER) == {"bills": ["INV-1", "INV-2"]}
+
+
+def test_groups_extract_each_match():
+    plan = FieldPlan(groups=[Group(".//ALLINVENTORYENTRIES.LIST", "lines", INVENTORY_ENTRY_FIELDS)])
+    lines = plan.extract(VOUCHER)["lines"]
+    assert [line.get("item_name") for line in lines] == ["Bolt", "Nut"]
+    assert [line.get("quantity") for line in lines] == [" 3", None]
+    # Only the entry's own AMOUNT, not the one inside its batch allocation.
+    assert lines[0]["amount"] == "30.00" and "amount" not in lines[1]
+
+
+def test_first_group():
+    plan = FieldPlan(groups=[
+        Group(".//ALLLEDGERENTRIES.LIST", "ledger", FieldPlan([Field(".//LEDGERNAME", "name")]), first=True),
+        Group(".//ABSENT.LIST", "absent", FieldPlan([Field(".//X", "x")]), first=True),
+    ])
+    assert plan.extract(VOUCHER) == {"ledger": {"name": "Party"}, "absent": None}
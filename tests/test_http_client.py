@@ -0,0 +1,34 @@
+import requests
+
+from http_client import ERP_RETRY_METHODS, TALLY_RETRY_METHODS, InsertRetry, is_transient
+
+
+def test_inserts_are_only_retried_when_turned_away():
+    retry = InsertRetry(total=3, status_forcelist=(429, 500, 502, 503, 504), allowed_methods=ERP_RETRY_METHODS)
+    assert retry.is_retry("PUT", 502)
+    assert retry.is_retry("POST", 429)
+    assert retry.is_retry("POST", 503, has_retry_after=True)
+    assert not retry.is_retry("POST", 503)
+    assert not retry.is_retry("POST", 502)
+    assert not retry.is_retry("POST", 500, has_retry_after=True)
+    assert not InsertRetry(total=0, allowed_methods=ERP_RETRY_METHODS).is_retry("POST", 429)
+
+
+def test_tally_exports_are_retried_on_any_retry_status():
+    retry = InsertRetry(total=3, status_forcelist=(500, 502), allowed_methods=TALLY_RETRY_METHODS)
+    assert retry.is_retry("POST", 502)
+    # new() keeps the subclass for the retries that follow.
+    assert isinstance(retry.increment("POST", "TALLY_URL"), InsertRetry)
+
+
+def test_is_transient():
+    def error(status):
+        response = requests.Response()
+        response.status_code = status
+        return requests.exceptions.HTTPError(response=response)
+
+    assert is_transient(error(503))
+    assert is_transient(error(429))
+    assert not is_transient(error(417))
+    assert not is_transient(error(500))
+    assert not is_transient(requests.exceptions.HTTPError("no response"))
@@ -0,0 +1,55 @@
+import threading
+
+import pytest
+
+from pipeline import Pipeline, new_pipeline, run_stage
+
+
+def test_stages_chain_in_order():
+    pipeline = Pipeline(queue_size=2)
+    doubled = pipeline.stage("double", (n * 2 for n in pipeline.stage("fetch", range(100))))
+    assert list(doubled) == [n * 2 for n in range(100)]
+    pipeline.close()
+    assert pipeline.stats["fetch"].items == 100
+    assert pipeline.sink.items == 100
+
+
+def test_errors_are_raised_where_the_output_is_read():
+    def chunks():
+        yield 1
+        raise ValueError("broken export")
+
+    pipeline = Pipeline()
+    parsed = pipeline.stage("parse", (n for n in pipeline.stage("fetch", chunks())))
+    with pytest.raises(ValueError, match="broken export"):
+        list(parsed)
+    pipeline.close()
+
+
+def test_stopping_early_stops_every_stage():
+    produced = []
+    finished = threading.Event()
+
+    def chunks():
+        try:
+            for n in range(10000):
+                produced.append(n)
+                yield n
+        finally:
+            finished.set()
+
+    pipeline = Pipeline(queue_size=4)
+    records = pipeline.stage("fetch", chunks())
+    assert next(records) == 0
+    records.close()
+    assert finished.wait(timeout=2)
+    pipeline.close()
+    # Bounded by the queue, not the size of the export.
+    assert len(produced) < 20
+
+
+def test_without_a_pipeline():
+    items = [1, 2]
+    assert run_stage(None, "fetch", items) is items
+    assert new_pipeline(records=items) is None
+    assert isinstance(new_pipeline(records=None), Pipeline)
@@ -0,0 +1,76 @@
+import threading
+import time
+
+import pytest
+
+from push_pool import PushResult, PushResults, Rejected, push_records
+
+
+def test_failures_are_listed_in_input_order():
+    def push(n):
+        time.sleep(0.001 * (10 - n))
+        if n % 3 == 0:
+            raise RuntimeError(f"push {n} failed")
+        return None if n == 4 else f"DOC-{n}"
+
+    results = push_records(range(1, 10), push, max_workers=4)
+    assert (results.total, results.pushed, results.errors) == (9, 5, 3)
+    assert [failure.index for failure in results.failures] == [3, 4, 6, 9]
+    assert not results.ok
+
+
+@pytest.mark.parametrize("max_workers", [1, 3])
+def test_at_most_max_workers_push_at_once(max_workers):
+    lock = threading.Lock()
+    running = [0]
+    peak = [0]
+
+    def push(n):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.005)
+        with lock:
+            running[0] -= 1
+        return n
+
+    assert push_records(range(1, 13), push, max_workers=max_workers).pushed == 12
+    assert peak[0] == max_workers
+
+
+def test_records_are_taken_lazily():
+    taken = []
+
+    def records():
+        for n in range(1, 101):
+            taken.append(n)
+            yield n
+
+    def push(n):
+        # Never more than 2 * max_workers records ahead of the workers.
+        assert len(taken) <= n + 2 * 2
+        return n
+
+    assert push_records(records(), push, max_workers=2).pushed == 100
+
+
+def test_rejections_do_not_make_results_not_ok():
+    def push(n):
+        if n == 2:
+            raise Rejected("cannot be updated in place")
+        return n
+
+    results = push_records([1, 2, 3], push)
+    assert (results.pushed, results.rejected, results.failed) == (2, 1, 1)
+    assert results.ok
+
+
+def test_merge_maps_indexes_back():
+    part = PushResults()
+    part.add(PushResult(1, "DOC-1", None))
+    part.add(PushResult(2, None, RuntimeError("503")))
+    results = PushResults()
+    results.merge(part, [5, 8])
+    assert (results.total, results.pushed, results.errors) == (2, 1, 1)
+    assert [failure.index for failure in results.failures] == [8]
+    assert len(results) == 2
@@ -0,0 +1,42 @@
+from decimal import Decimal
+
+import pytest
+
+from records import InventoryLine, Ledger, Voucher, plain, to_decimal
+
+
+def test_records_behave_like_dicts():
+    line = InventoryLine(item_code="Widget", qty="2.50", rate="10")
+    assert line["qty"] == Decimal("2.50")
+    assert line.get("warehouse") is None
+    assert line.get("warehouse", "Main") == "Main"
+    assert "rate" in line and "warehouse" not in line
+    assert list(line) == line.keys() == ["item_code", "qty", "rate"]
+    assert len(line) == 3
+    assert dict(line) == {"item_code": "Widget", "qty": Decimal("2.50"), "rate": Decimal("10")}
+    assert line == {"item_code": "Widget", "qty": Decimal("2.50"), "rate": Decimal("10")}
+    with pytest.raises(KeyError):
+        line["warehouse"]
+
+
+def test_only_declared_fields_can_be_set():
+    ledger = Ledger(customer_name="Acme")
+    with pytest.raises(KeyError):
+        ledger["discount"] = "5"
+    assert not hasattr(ledger, "__dict__")
+
+
+def test_numbers_are_parsed_once_and_shared():
+    first, second = InventoryLine(qty="12.000"), InventoryLine(qty="12.000")
+    assert first["qty"] is second["qty"]
+    assert plain(first["qty"]) == "12.000"
+    # Text that is not a number is kept as it is.
+    assert InventoryLine(rate="12/no")["rate"] == "12/no"
+    assert to_decimal(None) is None
+
+
+def test_voucher_items_field_hides_the_items_method():
+    voucher = Voucher(customer="Acme", items=[InventoryLine(item_code="Widget")])
+    assert voucher["items"] == voucher.items == [{"item_code": "Widget"}]
+    assert voucher.as_dict() == {"customer": "Acme", "items": [InventoryLine(item_code="Widget")]}
+    assert dict(voucher)["customer"] == "Acme"
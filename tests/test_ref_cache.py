@@ -0,0 +1,64 @@
+import pytest
+
+import ref_cache
+from ref_cache import RefCache, resolve_ref_nos
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "refs.sqlite3")
+
+
+def test_lru_keeps_the_most_recent_entries(path):
+    cache = RefCache(path, size=2)
+    cache.put_many("Sales Invoice", {"1": "SINV-1", "2": "SINV-2"})
+    assert cache.get("Sales Invoice", "1") == "SINV-1"
+    cache.put("Sales Invoice", "3", "SINV-3")
+    assert list(cache._lru) == [("Sales Invoice", "1"), ("Sales Invoice", "3")]
+    # Evicted entries are still read back from SQLite.
+    assert cache.get("Sales Invoice", "2") == "SINV-2"
+    cache.close()
+
+
+def test_entries_persist(path):
+    cache = RefCache(path)
+    cache.put("Sales Invoice", 7, "SINV-7")
+    cache.close()
+    cache = RefCache(path)
+    assert cache.get_many("Sales Invoice", ["7", "8"]) == {"7": "SINV-7"}
+    assert cache.get("Purchase Invoice", "7") is None
+    cache.close()
+
+
+def test_invalidate(path):
+    cache = RefCache(path)
+    cache.put_many("Sales Invoice", {"1": "SINV-1", "2": "SINV-2"})
+    cache.put("Purchase Invoice", "1", "PINV-1")
+    cache.invalidate("Sales Invoice", ["1"])
+    assert cache.get_many("Sales Invoice", ["1", "2"]) == {"2": "SINV-2"}
+    cache.invalidate("Sales Invoice")
+    assert cache.get("Sales Invoice", "2") is None
+    assert cache.get("Purchase Invoice", "1") == "PINV-1"
+    cache.close()
+    cache = RefCache(path)
+    assert cache.get_many("Sales Invoice", ["1", "2"]) == {}
+    cache.close()
+
+
+def test_only_missing_ref_nos_are_looked_up(path, monkeypatch):
+    monkeypatch.setattr(ref_cache, "REF_CACHE_FILE", path)
+    asked = []
+
+    def fetch_names_by_field(doctype, field, values, filters=None):
+        asked.append(list(values))
+        return {value: f"SINV-{value}" for value in values if value != "9"}
+
+    monkeypatch.setattr(ref_cache, "fetch_names_by_field", fetch_names_by_field)
+    try:
+        ref_cache.remember("Sales Invoice", "1", "SINV-1")
+        assert resolve_ref_nos("Sales Invoice", ["1", "2", "2", None, "9"]) == {"1": "SINV-1", "2": "SINV-2"}
+        assert resolve_ref_nos("Sales Invoice", ["2", "9"]) == {"2": "SINV-2"}
+        # Not found is not cached: it may be created later.
+        assert asked == [["2", "9"], ["9"]]
+    finally:
+        ref_cache.close_ref_cache()
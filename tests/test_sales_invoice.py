@@ -0,0 +1,61 @@
+import pytest
+import requests
+
+import ref_cache
+import sales_invoice
+from sales_invoice import add_sales_invoice_to_erpnext
+
+INVOICE = {"custom_ref_no": "SI-1", "customer": "Acme", "posting_date": "2024-01-02",
+           "items": [{"item_code": "Widget", "qty": 1, "rate": 10}]}
+REJECTED = {"exception": "frappe.exceptions.ValidationError"}
+
+
+@pytest.fixture(autouse=True)
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(ref_cache, "REF_CACHE_FILE", str(tmp_path / "refs.sqlite3"))
+    yield
+    ref_cache.close_ref_cache()
+
+
+def methods(erp):
+    return [(method, json.get("docstatus") if json else None) for method, _, json in erp.requests]
+
+
+def test_submitted_in_one_request(erp):
+    assert add_sales_invoice_to_erpnext(INVOICE) == "DOC-1"
+    assert methods(erp) == [("POST", 1)]
+    assert ref_cache.ref_cache().get("Sales Invoice", "SI-1") == "DOC-1"
+
+
+def test_rejected_submit_falls_back_to_draft_and_submit(erp):
+    erp.replies.append((417, REJECTED))
+    assert add_sales_invoice_to_erpnext(INVOICE) == "DOC-2"
+    assert methods(erp) == [("POST", 1), ("POST", None), ("PUT", 1)]
+
+
+@pytest.mark.parametrize("status", [409, 500])
+def test_other_errors_do_not_create_a_draft(erp, status):
+    erp.replies.append((status, REJECTED))
+    assert add_sales_invoice_to_erpnext(INVOICE) is None
+    assert methods(erp) == [("POST", 1)]
+
+
+def test_transient_errors_are_raised(erp):
+    erp.replies.append((503, {}))
+    with pytest.raises(requests.exceptions.HTTPError):
+        add_sales_invoice_to_erpnext(INVOICE)
+    assert methods(erp) == [("POST", 1)]
+
+
+def test_draft_is_deleted_when_its_submit_fails(erp):
+    erp.replies.extend([(417, REJECTED), (200, {"data": {"name": "DRAFT-1"}}), (417, REJECTED)])
+    assert add_sales_invoice_to_erpnext(INVOICE) is None
+    assert [(method, url.rsplit("/", 1)[-1]) for method, url, _ in erp.requests] == [
+        ("POST", "Sales Invoice"), ("POST", "Sales Invoice"), ("PUT", "DRAFT-1"), ("DELETE", "DRAFT-1")]
+    assert ref_cache.ref_cache().get("Sales Invoice", "SI-1") is None
+
+
+def test_draft_only_when_submit_on_create_is_off(erp, monkeypatch):
+    monkeypatch.setattr(sales_invoice, "SUBMIT_ON_CREATE", False)
+    assert add_sales_invoice_to_erpnext(INVOICE) == "DOC-1"
+    assert methods(erp) == [("POST", None), ("PUT", 1)]
@@ -0,0 +1,64 @@
+import re
+
+import pytest
+
+from benchmarks.synthetic import collection_export, ledger_xml, stock_item_xml, voucher_register
+from sanitiser import LEDGER_SANITISER, STOCK_ITEM_SANITISER, VOUCHER_SANITISER
+from tally_stream import iter_sanitised_chunks
+
+
+# The clean functions each module carried before the shared sanitiser,
+# copied as they were. preserve_numeric_format never changed anything.
+def ledger_clean(xml_data):
+    fixed_xml = re.sub(r'(\s)([a-zA-Z0-9_-]+)=([a-zA-Z0-9_-]+)', r'\1"\2"=\3', xml_data)
+    return re.sub(r'[^a-zA-Z0-9\s<>\-=/":]', '', fixed_xml)
+
+
+def clean_unwanted_characters(xml_data):
+    fixed_xml = re.sub(r'(\s)([a-zA-Z0-9_-]+)\s*=\s*([a-zA-Z0-9_-]+)', r'\1"\2"="\3"', xml_data)
+    return re.sub(r'[^a-zA-Z0-9\s<>\-="/:.]', '', fixed_xml)
+
+
+def stock_item_clean(xml_data):
+    xml_data = clean_unwanted_characters(xml_data)
+    xml_data = re.sub(r'(<RATE[^>]*>)([\d\.]+)(/no)(</RATE>)', r'\1\2\4', xml_data)
+    return re.sub(r'(<OPENINGBALANCE[^>]*>)\s*([\d\.]+)\s*no(</OPENINGBALANCE>)', r'\1\2\3', xml_data)
+
+
+def voucher_clean(xml_data):
+    xml_data = clean_unwanted_characters(xml_data)
+    xml_data = re.sub(r'(<RATE[^>]*>)([\d\.]+)(/no)(</RATE>)', r'\1\2\4', xml_data)
+    return re.sub(r'(<ACTUALQTY[^>]*>\s*)([\d\.]+)\s*no(</ACTUALQTY>)', r'\1\2\3', xml_data)
+
+
+EDGE_CASES = [
+    '<LEDGER NAME=Cash RESERVEDNAME=x-1>',
+    '<A B = c D=e F="g">text = value</A>',
+    '<A\tB=c\nD =e>',
+    '<RATE>125.50/no</RATE><RATE>12/no</RATE><RATE>abc/no</RATE>',
+    '<ACTUALQTY> 10 no</ACTUALQTY><ACTUALQTY>5no</ACTUALQTY><ACTUALQTY TYPE=x> 2.5 no</ACTUALQTY>',
+    '<OPENINGBALANCE> 7 no</OPENINGBALANCE><OPENINGBALANCE>-7 no</OPENINGBALANCE>',
+    '<NAME>Party &amp; Sons (P) Ltd. ₹ é &#4;</NAME>',
+    'a=b =c x= y',
+]
+
+
+@pytest.mark.parametrize("sanitiser, legacy, export", [
+    (LEDGER_SANITISER, ledger_clean, collection_export(50, ledger_xml)),
+    (STOCK_ITEM_SANITISER, stock_item_clean, collection_export(50, stock_item_xml)),
+    (VOUCHER_SANITISER, voucher_clean, voucher_register(50)),
+])
+def test_matches_legacy_clean_functions(sanitiser, legacy, export):
+    for text in [export.decode("utf-8"), *EDGE_CASES]:
+        expected = legacy(text).encode("ascii", "ignore")
+        assert sanitiser(text.encode("utf-8")) == expected
+
+
+def test_chunked_matches_whole_document():
+    export = voucher_register(200)
+    chunks = [export[start:start + 1000] for start in range(0, len(export), 1000)]
+    assert b"".join(iter_sanitised_chunks(chunks, VOUCHER_SANITISER)) == VOUCHER_SANITISER(export)
+
+
+def test_ledger_sanitiser_drops_dots():
+    assert LEDGER_SANITISER(b"<LEDGSTREGDETAILS.LIST>") == b"<LEDGSTREGDETAILSLIST>"
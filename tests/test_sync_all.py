@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+
+import http_client
+from push_pool import PushResult, PushResults
+import sync_all
+from sync_all import Collection
+import tally_source
+from tally_source import HTTPSource
+
+
+def synced(ok=True):
+    results = PushResults()
+    results.add(PushResult(1, "DOC-1", None if ok else RuntimeError("503")))
+    return lambda max_workers, full: results
+
+
+def fail(max_workers, full):
+    raise RuntimeError("Tally went away")
+
+
+@pytest.mark.parametrize("broken", [fail, synced(ok=False)], ids=["raised", "not ok"])
+def test_stages_after_a_failed_one_are_skipped(monkeypatch, broken):
+    monkeypatch.setattr(sync_all, "STAGES", [
+        ("masters", [Collection("Customer", synced()), Collection("Item", broken)]),
+        ("orders", [Collection("Sales Order", synced())]),
+    ])
+    results = asyncio.run(sync_all.sync_all())
+    assert "Customer" in results
+    assert "Sales Order" not in results
+
+
+class FakeStream:
+    def __init__(self):
+        self.closed = 0
+
+    def close(self):
+        self.closed += 1
+
+
+class FakeTallySession:
+    def post(self, url, **kwargs):
+        return FakeStream()
+
+    def close(self):
+        pass
+
+
+def test_streamed_tally_responses_hold_a_slot_until_closed(monkeypatch):
+    monkeypatch.setattr(tally_source, "CONCURRENCY", tally_source.CONCURRENCY)
+    monkeypatch.setattr(tally_source, "_slots", tally_source._slots)
+    tally_source.configure(concurrency=1)
+    http_client.set_session("tally", FakeTallySession())
+    try:
+        source = HTTPSource()
+        response = source.post("TALLY_URL", stream=True)
+        assert not tally_source._slots.acquire(blocking=False)
+        response.close()
+        response.close()
+        assert response.closed == 2
+        # Released once, however often the response is closed.
+        assert tally_source._slots.acquire(blocking=False)
+        assert not tally_source._slots.acquire(blocking=False)
+        tally_source._slots.release()
+        source.post("TALLY_URL")
+        assert tally_source._slots.acquire(blocking=False)
+    finally:
+        http_client.close_sessions()
@@ -0,0 +1,64 @@
+from decimal import Decimal
+
+import pytest
+
+from push_pool import Rejected, push_records
+from records import InventoryLine
+from sync_ledger import CHANGED, NEW, UNCHANGED, SyncLedger, content_hash, ledger_push, normalise
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    ledger = SyncLedger(str(tmp_path / "ledger.sqlite3"))
+    yield ledger
+    ledger.close()
+
+
+def test_records_normalise_like_dicts():
+    line = InventoryLine(item_code="Bolt", qty=Decimal("3"), rate=Decimal("10.50"))
+    assert normalise(line) == normalise({"item_code": "Bolt", "qty": "3", "rate": "10.50"})
+    assert content_hash({"a": 1, "b": 2}) == content_hash({"b": 2, "a": 1})
+
+
+def test_classify(ledger):
+    record = {"name": "A", "value": 1}
+    assert ledger.classify("Customer", "A", record) == (NEW, None)
+    ledger.record("Customer", "A", record, "CUST-1")
+    assert ledger.classify("Customer", "A", record) == (UNCHANGED, "CUST-1")
+    assert ledger.classify("Customer", "A", dict(record, value=2)) == (CHANGED, "CUST-1")
+    assert ledger.previous("Customer", "A") == record
+    ledger.adopt("Customer", "B", "CUST-2")
+    assert ledger.classify("Customer", "B", {"name": "B"}) == (CHANGED, "CUST-2")
+    ledger.forget("Customer")
+    assert ledger.lookup("Customer", "A") is None
+
+
+def test_ledger_push(ledger):
+    calls = []
+
+    def add(record):
+        calls.append(("add", record["name"]))
+        return f"DOC-{record['name']}"
+
+    def update(record, erp_name, previous):
+        calls.append(("update", erp_name, previous["value"]))
+        return erp_name
+
+    push = ledger_push(ledger, "Customer", lambda record: record["name"], add, update, diff=True)
+    assert push({"name": "A", "value": 1}) == "DOC-A"
+    assert push({"name": "A", "value": 1}) == "DOC-A"
+    assert push({"name": "A", "value": 2}) == "DOC-A"
+    assert calls == [("add", "A"), ("update", "DOC-A", 1)]
+    # A caller that already classified the record is trusted.
+    assert push({"name": "B", "value": 1}, (UNCHANGED, "DOC-B")) == "DOC-B"
+    assert ledger.lookup("Customer", "B") is None
+
+
+def test_changed_record_without_update_is_rejected(ledger):
+    push = ledger_push(ledger, "Sales Invoice", lambda record: record["no"], lambda record: "SI-1")
+    push({"no": "1", "total": 10})
+    results = push_records([{"no": "1", "total": 12}], push)
+    assert (results.total, results.pushed, results.rejected) == (1, 0, 1)
+    assert isinstance(results.failures[0].error, Rejected)
+    # A rejection does not hold the watermark back.
+    assert results.ok
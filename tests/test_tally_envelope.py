@@ -0,0 +1,59 @@
+import pytest
+
+import tally_envelope
+from field_plan import Field, FieldPlan, Group, INVENTORY_ENTRY_FIELDS
+from tally_envelope import collection_request, fetch_list, method_path, voucher_request
+from watermark import Watermark
+
+
+@pytest.fixture
+def fetch_fields(monkeypatch):
+    monkeypatch.setattr(tally_envelope, "FETCH_FIELDS", True)
+
+
+def test_method_path():
+    assert method_path(".//LEDMAILINGDETAILSLIST/STATE") == "LEDMAILINGDETAILS.STATE"
+    assert method_path(".//LEDMAILINGDETAILSLIST//ADDRESSLIST/ADDRESS") == "LEDMAILINGDETAILS.ADDRESS"
+    assert method_path(".//ALLINVENTORYENTRIES.LIST") == "ALLINVENTORYENTRIES"
+    assert method_path("AMOUNT") == "AMOUNT"
+
+
+def test_fetch_list():
+    plan = FieldPlan(
+        [Field(".//VOUCHERNUMBER", "voucher_no"), Field(".//DATE", "date"), Field(".//ORDERDUEDATE", "due_date")],
+        [Group(".//ALLINVENTORYENTRIES.LIST", "lines", INVENTORY_ENTRY_FIELDS)],
+    )
+    assert fetch_list(plan, {"due_date": ["ORDERDUEDATE", "BATCH.ORDERDUEDATE"]}) == [
+        "VOUCHERNUMBER", "DATE", "ORDERDUEDATE", "BATCH.ORDERDUEDATE",
+        "ALLINVENTORYENTRIES.STOCKITEMNAME", "ALLINVENTORYENTRIES.RATE", "ALLINVENTORYENTRIES.ACTUALQTY",
+        "ALLINVENTORYENTRIES.AMOUNT",
+    ]
+
+
+def test_fetch_list_drops_duplicates():
+    plan = FieldPlan([Field(".//NAME", "name"), Field(".//NAME", "alias")])
+    assert fetch_list(plan) == ["NAME"]
+
+
+def test_collection_request(fetch_fields, tmp_path):
+    watermark = Watermark("Customer", path=str(tmp_path / "marks.json"))
+    watermark.alter_id = 7
+    request = collection_request("Ledgers", "Ledger", ["NAME", "ALTERID"], {"IsDebtor": '$Parent = "Debtors"'},
+                                 watermark)
+    assert "<FETCH>ALTERID, NAME</FETCH>" in request
+    assert "<FILTER>IsDebtor,IsAlteredSinceLastSync</FILTER>" in request
+    assert "$AlterID > 7" in request
+    assert '$Parent = "Debtors"' in request
+
+
+def test_native_methods_without_fetch_fields(monkeypatch):
+    monkeypatch.setattr(tally_envelope, "FETCH_FIELDS", False)
+    assert "<NATIVEMETHOD>*</NATIVEMETHOD>" in collection_request("Ledgers", "Ledger", ["NAME"])
+    assert "<REPORTNAME>Voucher Register</REPORTNAME>" in voucher_request("Sales", FieldPlan())
+
+
+def test_voucher_collection_filters_on_the_requested_dates(fetch_fields):
+    request = voucher_request("Sales Order", FieldPlan([Field(".//DATE", "date")]))
+    assert "<ID>SalesOrderVouchers</ID>" in request
+    assert "<FILTER>IsRequestedVoucherType,IsInRequestedDates</FILTER>" in request
+    assert "##SVFromDate" in request and "##SVToDate" in request
@@ -0,0 +1,51 @@
+import gzip
+
+import pytest
+
+from tally_source import DirectorySource, FileSource, HTTPSource, open_source
+from tally_stream import stream_tally_export, stream_voucher_register
+
+
+def voucher(date):
+    return f"<VOUCHER><DATE>{date}</DATE></VOUCHER>"
+
+
+@pytest.fixture
+def captures(tmp_path):
+    (tmp_path / "Sales_Invoice-20240201-20240229-a1.xml").write_text(f"<ENVELOPE>{voucher('20240201')}</ENVELOPE>")
+    with gzip.open(tmp_path / "Sales_Invoice-20240101-20240131-b2.xml.gz", "wt") as f:
+        f.write(f"<ENVELOPE>{voucher('20240101')}{voucher('20240115')}</ENVELOPE>")
+    (tmp_path / "Purchase_Invoice-20240101-20240131-c3.xml").write_text(f"<ENVELOPE>{voucher('20240102')}</ENVELOPE>")
+    (tmp_path / "notes.txt").write_text("not a capture")
+    return tmp_path
+
+
+def test_open_source(captures):
+    assert isinstance(open_source(None), HTTPSource)
+    assert isinstance(open_source("http"), HTTPSource)
+    assert isinstance(open_source(str(captures)), DirectorySource)
+    assert isinstance(open_source(str(captures / "notes.txt")), FileSource)
+    with pytest.raises(ValueError):
+        open_source(str(captures / "missing.xml"))
+
+
+def test_directory_captures_are_picked_by_doctype(captures):
+    source = DirectorySource(str(captures))
+    assert [path.rsplit("/", 1)[-1] for path in source.captures("Sales Invoice")] == [
+        "Sales_Invoice-20240101-20240131-b2.xml.gz", "Sales_Invoice-20240201-20240229-a1.xml"]
+    assert len(source.captures()) == 3
+
+
+def test_voucher_register_replays_every_window(captures):
+    vouchers = stream_voucher_register("TALLY_URL", "<ENVELOPE/>", lambda data: data, window="month",
+                                       doctype="Sales Invoice", source=DirectorySource(str(captures)))
+    assert [element.findtext("DATE") for element in vouchers] == ["20240101", "20240115", "20240201"]
+    # Replaying never removes a capture.
+    assert len(list(captures.iterdir())) == 4
+
+
+def test_file_source_is_replayed_for_any_doctype(captures):
+    source = FileSource(str(captures / "Purchase_Invoice-20240101-20240131-c3.xml"))
+    vouchers = stream_tally_export("TALLY_URL", "<ENVELOPE/>", "VOUCHER", lambda data: data, doctype="Sales Invoice",
+                                   source=source)
+    assert [element.findtext("DATE") for element in vouchers] == ["20240102"]
@@ -0,0 +1,257 @@
+import re
+from collections import deque
+from datetime import date
+
+import pytest
+import requests
+
+import tally_stream
+from tally_stream import (find_safe_split, iter_elements, iter_sanitised_chunks, next_window, stream_tally_export,
+                          stream_voucher_register)
+from watermark import Watermark
+
+REQUEST = "<ENVELOPE><STATICVARIABLES></STATICVARIABLES></ENVELOPE>"
+
+
+class FakeResponse:
+    status_code = 200
+    encoding = "utf-8"
+
+    def __init__(self, body):
+        self.body = body
+        self.closed = False
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.body), chunk_size):
+            yield self.body[start:start + chunk_size]
+
+    def close(self):
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class FakeSource:
+    """Answers every export with one fixed response."""
+
+    live = True
+
+    def __init__(self, response):
+        self.response = response
+
+    def post(self, url, data=None, headers=None, timeout=None, stream=False):
+        return self.response
+
+
+def register(count):
+    vouchers = "".join(f"<VOUCHER><DATE>2024010{n}</DATE><LIST><A>{n}</A></LIST></VOUCHER>" for n in range(1, count + 1))
+    return f"<ENVELOPE><BODY>{vouchers}</BODY></ENVELOPE>".encode()
+
+
+def pieces(data, size):
+    return [data[start:start + size] for start in range(0, len(data), size)]
+
+
+def test_find_safe_split():
+    assert find_safe_split(b"<A><B>1</B><C>2") == len(b"<A><B>1</B>")
+    assert find_safe_split(b"<A><B>1</") == 0
+    assert find_safe_split(b"no tags") == 0
+
+
+def test_sanitised_chunks_are_cut_after_closing_tags():
+    seen = []
+
+    def sanitise(data):
+        seen.append(data)
+        return data
+
+    export = register(5)
+    assert b"".join(iter_sanitised_chunks(pieces(export, 7), sanitise)) == export
+    assert all(piece.endswith(b">") for piece in seen)
+
+
+def test_utf16_exports_are_transcoded():
+    export = register(2).decode().encode("utf-16")
+    assert b"".join(iter_sanitised_chunks(pieces(export, 5), lambda data: data, "utf-16")) == register(2)
+
+
+@pytest.mark.parametrize("size", [1, 13, 4096])
+def test_elements_are_yielded_and_detached(size):
+    parents = []
+    dates = []
+    for voucher in iter_elements(pieces(register(3), size), "VOUCHER"):
+        dates.append(voucher.findtext("DATE"))
+        parents.append(voucher)
+    assert dates == ["20240101", "20240102", "20240103"]
+    # Finished vouchers are cleared, so the document never holds them all.
+    assert all(len(voucher) == 0 for voucher in parents[:-1])
+
+
+def test_stream_tally_export():
+    response = FakeResponse(register(3))
+    vouchers = stream_tally_export("TALLY_URL", REQUEST, "VOUCHER", lambda data: data, source=FakeSource(response))
+    assert [voucher.findtext("DATE") for voucher in vouchers] == ["20240101", "20240102", "20240103"]
+    assert response.closed
+
+
+@pytest.mark.parametrize("status, body", [(503, b""), (200, b"<ENVELOPE><VOUCHER>")], ids=["status", "truncated"])
+def test_failed_export_holds_the_watermark(tmp_path, status, body):
+    response = FakeResponse(body)
+    response.status_code = status
+    watermark = Watermark("Sales Invoice", full=True, path=str(tmp_path / "marks.json"))
+    vouchers = stream_tally_export("TALLY_URL", REQUEST, "VOUCHER", lambda data: data, watermark=watermark,
+                                   source=FakeSource(response))
+    assert list(vouchers) == []
+    assert watermark.held
+    assert response.closed
+
+
+class FakeTally:
+    """Answers every window with one voucher dated on its first day; `slow` windows time out."""
+
+    live = True
+
+    def __init__(self, slow=(), padding=None):
+        self.slow = set(slow)
+        self.padding = padding or {}
+        self.windows = []
+        self.responses = []
+        # Requests sent while an earlier response was still being read.
+        self.overlapping = 0
+
+    def post(self, url, data=None, headers=None, timeout=None, stream=False):
+        window = tuple(re.findall(r">(\d{8})</SV", data))
+        self.windows.append(window)
+        self.overlapping += any(not response.closed for response in self.responses)
+        if window in self.slow:
+            raise requests.exceptions.ReadTimeout("Tally is busy")
+        first = window[0] if window else ""
+        body = f"<ENVELOPE><VOUCHER><DATE>{first}</DATE></VOUCHER></ENVELOPE>".encode()
+        response = FakeResponse(body + b" " * self.padding.get(first, 0))
+        self.responses.append(response)
+        return response
+
+
+@pytest.fixture
+def today(monkeypatch):
+    class FixedDate(date):
+        @classmethod
+        def today(cls):
+            return cls(2024, 3, 15)
+
+    monkeypatch.setattr(tally_stream, "date", FixedDate)
+    monkeypatch.setattr(tally_stream, "EXPORT_FROM_DATE", "20240101")
+
+
+@pytest.fixture(params=[False, True], ids=["streamed", "spooled"])
+def windowing(request, today, monkeypatch, tmp_path):
+    monkeypatch.setattr(tally_stream, "SPOOL", request.param)
+    monkeypatch.setattr(tally_stream, "SPOOL_DIR", str(tmp_path))
+
+
+def dates(source, **kwargs):
+    vouchers = stream_voucher_register("TALLY_URL", REQUEST, lambda data: data, source=source, window="month",
+                                       **kwargs)
+    return [voucher.findtext("DATE") for voucher in vouchers]
+
+
+def test_next_window():
+    pending = deque()
+    assert next_window(pending, date(2024, 1, 1), date(2024, 1, 10), 7) == (
+        (date(2024, 1, 1), date(2024, 1, 7)), date(2024, 1, 8))
+    assert next_window(pending, date(2024, 1, 8), date(2024, 1, 10), 7) == (
+        (date(2024, 1, 8), date(2024, 1, 10)), date(2024, 1, 11))
+    assert next_window(pending, date(2024, 1, 11), date(2024, 1, 10), 7) == (None, date(2024, 1, 11))
+
+
+def test_windows_cover_the_period(windowing):
+    tally = FakeTally()
+    assert dates(tally) == ["20240101", "20240131", "20240301"]
+    assert tally.windows == [("20240101", "20240130"), ("20240131", "20240229"), ("20240301", "20240315")]
+    assert all(response.closed for response in tally.responses)
+    assert tally.overlapping == 0
+
+
+def test_timed_out_window_is_split(windowing, tmp_path):
+    tally = FakeTally(slow={("20240131", "20240229")})
+    watermark = Watermark("Sales Invoice", full=True, path=str(tmp_path / "marks.json"))
+    assert dates(tally, watermark=watermark) == ["20240101", "20240131", "20240215", "20240301"]
+    assert tally.windows[1:4] == [("20240131", "20240229"), ("20240131", "20240214"), ("20240215", "20240229")]
+    # Later windows are half as long.
+    assert tally.windows[4:] == [("20240301", "20240315")]
+    assert watermark.held is None
+
+
+def test_single_day_timeout_fails_the_export(windowing, tmp_path, monkeypatch):
+    monkeypatch.setattr(tally_stream, "EXPORT_FROM_DATE", "20240315")
+    tally = FakeTally(slow={("20240315", "20240315")})
+    watermark = Watermark("Sales Invoice", full=True, path=str(tmp_path / "marks.json"))
+    assert dates(tally, watermark=watermark) == []
+    assert watermark.held
+
+
+def test_large_window_shrinks_the_following_ones(windowing, monkeypatch):
+    monkeypatch.setattr(tally_stream, "MAX_WINDOW_BYTES", 1000)
+    tally = FakeTally(padding={"20240101": 2000})
+    dates(tally)
+    assert tally.windows[1] == ("20240131", "20240214")
+
+
+def test_streamed_window_is_read_before_the_next_request(today, monkeypatch):
+    monkeypatch.setattr(tally_stream, "SPOOL", False)
+    tally = FakeTally()
+    vouchers = stream_voucher_register("TALLY_URL", REQUEST, lambda data: data, source=tally, window="month")
+    next(vouchers)
+    assert tally.windows == [("20240101", "20240130")]
+    vouchers.close()
+    assert all(response.closed for response in tally.responses)
+
+
+def test_no_start_date_sends_one_request(windowing, tmp_path, monkeypatch):
+    monkeypatch.setattr(tally_stream, "EXPORT_FROM_DATE", None)
+    tally = FakeTally()
+    watermark = Watermark("Sales Invoice", full=True, path=str(tmp_path / "marks.json"))
+    vouchers = stream_voucher_register("TALLY_URL", REQUEST, lambda data: data, watermark=watermark, source=tally,
+                                       window="month")
+    assert [voucher.tag for voucher in vouchers] == ["VOUCHER"]
+    assert tally.windows == [()]
+    assert watermark.held is None
+
+
+@pytest.fixture
+def spool(monkeypatch, tmp_path):
+    monkeypatch.setattr(tally_stream, "SPOOL", True)
+    monkeypatch.setattr(tally_stream, "SPOOL_DIR", str(tmp_path))
+    monkeypatch.setattr(tally_stream, "CHUNK_SIZE", 16)
+    return tmp_path
+
+
+def test_spooled_file_is_read_in_chunks_and_removed(spool):
+    path = tally_stream.spool_chunks(pieces(register(2), 5), "Sales Invoice", "20240101-20240131")
+    assert path.startswith(str(spool / "Sales_Invoice-20240101-20240131-"))
+    chunks = list(tally_stream.iter_spooled_chunks(path))
+    assert b"".join(chunks) == register(2)
+    assert max(len(chunk) for chunk in chunks) == 16
+    assert list(spool.iterdir()) == []
+
+
+def test_kept_spool_files_stay(spool, monkeypatch):
+    monkeypatch.setattr(tally_stream, "KEEP_SPOOL", True)
+    response = FakeResponse(register(3))
+    vouchers = stream_tally_export("TALLY_URL", REQUEST, "VOUCHER", lambda data: data, doctype="Sales Invoice",
+                                   source=FakeSource(response))
+    assert len(list(vouchers)) == 3
+    assert response.closed
+    [kept] = spool.iterdir()
+    assert kept.read_bytes() == register(3)
+
+
+def test_spooled_export_leaves_nothing_behind(spool):
+    vouchers = stream_tally_export("TALLY_URL", REQUEST, "VOUCHER", lambda data: data,
+                                   source=FakeSource(FakeResponse(register(3))))
+    assert len(list(vouchers)) == 3
+    assert list(spool.iterdir()) == []
@@ -0,0 +1,64 @@
+import json
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from customer import add_customer_to_erpnext
+from push_pool import push_records
+from watermark import Watermark, load_watermarks
+
+
+def element(alter_id, date=None):
+    xml = f"<VOUCHER><ALTERID> {alter_id}</ALTERID>" + (f"<DATE>{date}</DATE>" if date else "") + "</VOUCHER>"
+    return ET.fromstring(xml)
+
+
+def test_full_sync_records_the_high_water_mark(tmp_path):
+    path = str(tmp_path / "marks.json")
+    watermark = Watermark("Sales Invoice", full=True, path=path)
+    assert watermark.alter_id_filter() == ("", "")
+    assert watermark.observe(element(5, "20240102"))
+    assert watermark.observe(element(3, "20240301"))
+    assert watermark.commit()
+    assert load_watermarks(path) == {"Sales Invoice": {"alter_id": 5, "voucher_date": "20240301"}}
+
+
+def test_incremental_sync_skips_what_was_synced(tmp_path):
+    path = tmp_path / "marks.json"
+    path.write_text(json.dumps({"Customer": {"alter_id": 10}}))
+    watermark = Watermark("Customer", path=str(path))
+    assert not watermark.observe(element(10))
+    assert watermark.observe(element(11))
+    name, formula = watermark.alter_id_filter()
+    assert name == "IsAlteredSinceLastSync"
+    assert "$AlterID > 10" in formula
+    # Nothing new seen by a full re-read: the mark does not move.
+    assert not Watermark("Customer", path=str(path)).commit()
+
+
+def test_failed_or_held_runs_keep_the_old_mark(tmp_path):
+    path = str(tmp_path / "marks.json")
+    watermark = Watermark("Item", full=True, path=path)
+    watermark.observe(element(7))
+    assert not watermark.commit(ok=False)
+    watermark.hold("the export failed")
+    assert not watermark.commit()
+    assert load_watermarks(path) == {}
+
+
+def test_unreadable_file_means_a_full_sync(tmp_path):
+    path = tmp_path / "marks.json"
+    path.write_text("{not json")
+    assert Watermark("Item", path=str(path)).alter_id is None
+
+
+@pytest.mark.parametrize("status, held", [(503, True), (429, True), (417, False), (409, False)])
+def test_transient_push_errors_hold_the_mark(tmp_path, erp, status, held):
+    erp.replies.append((status, {"exception": "frappe.exceptions.ValidationError"}))
+    watermark = Watermark("Customer", full=True, path=str(tmp_path / "marks.json"))
+    watermark.observe(element(7))
+    customers = [{"customer_name": "Acme"}, {"customer_name": "Globex"}]
+    results = push_records(customers, lambda customer: add_customer_to_erpnext(customer, set()))
+    assert (results.pushed, results.failed) == (1, 1)
+    assert results.ok is not held
+    assert watermark.commit(results.ok) is not held
@@ -0,0 +1,110 @@
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+WATERMARK_FILE = "sync_watermarks.json"
+
+# Doctypes synced side by side (sync_all.py) share the file.
+_commit_lock = threading.Lock()
+
+
+def load_watermarks(path=None):
+    path = path or WATERMARK_FILE
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Failed to read watermarks from {path}, doing a full sync: {e}")
+        return {}
+
+
+def save_watermarks(watermarks, path=None):
+    path = path or WATERMARK_FILE
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(watermarks, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def _to_int(text):
+    try:
+        return int((text or "").strip())
+    except ValueError:
+        return None
+
+
+class Watermark:
+    """Last synced Tally ALTERID and voucher date for one doctype.
+
+    Pass it to a get_*/iter_* fetcher to export only what changed since the
+    previous run, then call commit() once the push is done to move it forward.
+    With full=True the stored values are ignored, but commit() still records
+    the new high-water mark.
+    """
+
+    def __init__(self, doctype, full=False, path=None):
+        self.doctype = doctype
+        self.path = path
+        stored = {} if full else load_watermarks(path).get(doctype, {})
+        self.alter_id = stored.get("alter_id")
+        self.voucher_date = stored.get("voucher_date")
+        self.max_alter_id = self.alter_id
+        self.max_voucher_date = self.voucher_date
+        self.held = None
+
+    def observe(self, element):
+        """Record the ALTERID/DATE of an exported object; False if it was already synced."""
+        alter_id = _to_int(element.findtext("ALTERID"))
+        voucher_date = (element.findtext("DATE") or "").strip() or None
+        if alter_id is not None:
+            if self.alter_id is not None and alter_id <= self.alter_id:
+                return False
+            if self.max_alter_id is None or alter_id > self.max_alter_id:
+                self.max_alter_id = alter_id
+        if voucher_date and (self.max_voucher_date is None or voucher_date > self.max_voucher_date):
+            self.max_voucher_date = voucher_date
+        return True
+
+    def hold(self, reason):
+        """Keep the stored mark for this run, e.g. because part of the export failed."""
+        self.held = reason
+
+    def alter_id_filter(self):
+        """Return (filter name, TDL formula) restricting a collection to altered objects."""
+        if self.alter_id is None:
+            return "", ""
+        return ("IsAlteredSinceLastSync",
+                f"<SYSTEM TYPE=\"Formulae\" NAME=\"IsAlteredSinceLastSync\">$AlterID > {self.alter_id}</SYSTEM>")
+
+    def commit(self, ok=True):
+        """Persist the new high-water mark; ok=False (a push raised an exception) keeps the old one.
+
+        Pushes raise on connection errors and on transient statuses (429,
+        502, 503, 504), so those hold the mark and the records are exported
+        again next run. Documents ERPNext rejects (other 4xx and 500) do not
+        hold it back: fixing that data needs an edit in Tally, which gives
+        the object a new ALTERID, so the next run picks it up again.
+        """
+        if self.held:
+            logger.warning(f"Not advancing {self.doctype} watermark: {self.held}.")
+            return False
+        if not ok:
+            logger.warning(f"Not advancing {self.doctype} watermark: some records failed to sync.")
+            return False
+        if self.max_alter_id == self.alter_id and self.max_voucher_date == self.voucher_date:
+            return False
+        with _commit_lock:
+            watermarks = load_watermarks(self.path)
+            entry = watermarks.setdefault(self.doctype, {})
+            if self.max_alter_id is not None:
+                entry["alter_id"] = self.max_alter_id
+            if self.max_voucher_date is not None:
+                entry["voucher_date"] = self.max_voucher_date
+            save_watermarks(watermarks, self.path)
+        logger.info(f"{self.doctype} watermark advanced to {entry}.")
+        return True
@@ -0,0 +1,65 @@
+import xml.etree.ElementTree as ET
+
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None
+
+# "auto" uses lxml when it is installed, "lxml" requires it, "etree" always
+# uses the standard library parser.
+PARSER = "auto"
+
+PARSE_ERRORS = (ET.ParseError,) if lxml_etree is None else (ET.ParseError, lxml_etree.XMLSyntaxError)
+
+
+def configure(parser=None):
+    global PARSER
+    if parser is not None:
+        if parser not in ("auto", "lxml", "etree"):
+            raise ValueError(f"Unknown XML parser backend: {parser}")
+        if parser == "lxml" and lxml_etree is None:
+            raise ValueError("The lxml parser backend was requested but lxml is not installed")
+        PARSER = parser
+
+
+def using_lxml():
+    return lxml_etree is not None and PARSER in ("auto", "lxml")
+
+
+def fromstring(data):
+    """Parse a complete document and return its root element.
+
+    With lxml the parser runs with recover=True, so a stray malformed
+    character costs the element it sits in rather than the whole export.
+    """
+    if not using_lxml():
+        return ET.fromstring(data)
+    parser = lxml_etree.XMLParser(recover=True, huge_tree=True, resolve_entities=False)
+    root = lxml_etree.fromstring(data, parser)
+    if root is None:
+        raise ET.ParseError("no element could be recovered from the document")
+    return root
+
+
+def pull_parser(events):
+    """Return an incremental parser with the feed/read_events/close interface."""
+    if not using_lxml():
+        return ET.XMLPullParser(events=events)
+    return lxml_etree.XMLPullParser(events=events, recover=True, huge_tree=True, resolve_entities=False)
+
+
+def compile_findall(path):
+    """Compile an ElementPath such as ".//LEDGER".
+
+    Returns a function mapping an element to its list of matches. lxml
+    elements are searched with an XPath object compiled once here, and the
+    paths used in this repo are valid XPath as written. Stdlib elements
+    fall back to element.findall(path).
+    """
+    xpath = lxml_etree.XPath(path) if lxml_etree is not None else None
+
+    def findall(element):
+        if xpath is None or isinstance(element, ET.Element):
+            return element.findall(path)
+        return xpath(element)
+    return findall